@@ -3,7 +3,7 @@ import rospy
 import math
 from sensor_msgs.msg import LaserScan
 from demo3.msg import Vector 
-from Utils import closest_object_in_range, DISTANCE_LIMIT
+from Utils import closest_object_in_range, scan_to_array, DISTANCE_LIMIT
 
 # From LaserScan topic
 #   msg.angle_min: -0.521567881107
@@ -45,10 +45,9 @@ class object_detector:
             self.scan_max_angle, self.object_angle + SCAN_BOUNDARY_DELTA_DEG
         )
 
-        angle, distance = closest_object_in_range(msg.ranges, scan_left_boundary, scan_right_boundary, self.scan_min_angle, self.scan_angle_increment)
-        if distance >= DISTANCE_LIMIT:
-            angle, distance = closest_object_in_range(msg.ranges, scan_left_boundary, scan_right_boundary, self.scan_min_angle, self.scan_angle_increment)
- 
+        ranges = scan_to_array(msg.ranges)
+        angle, distance = closest_object_in_range(ranges, scan_left_boundary, scan_right_boundary, self.scan_min_angle, self.scan_angle_increment)
+
         self.object_distance = distance
         self.object_angle = angle
 
@@ -1,19 +1,33 @@
 import math
+import numpy as np
 
 DISTANCE_LIMIT = 1000
 
+
+def scan_to_array(range_data):
+    """Convert LaserScan ranges to a float array once per scan.
+
+    NaN and inf readings (no return, or out of range) become DISTANCE_LIMIT so
+    they can never be picked as the closest object.
+    """
+    ranges = np.array(range_data, dtype=float)
+    ranges[~np.isfinite(ranges)] = DISTANCE_LIMIT
+    return ranges
+
+
 def closest_object_in_range(range_data, left_boundary_angle, right_boundary_angle, min_angle, angle_increment):
-    left_boundary_index = scan_angle_to_range_index(left_boundary_angle, min_angle, angle_increment)
+    left_boundary_index = max(0, scan_angle_to_range_index(left_boundary_angle, min_angle, angle_increment))
     right_boundary_index = scan_angle_to_range_index(right_boundary_angle, min_angle, angle_increment)
 
     distance = DISTANCE_LIMIT
-    angle_index = (left_boundary_index + right_boundary_index) / 2
+    angle_index = (left_boundary_index + right_boundary_index) // 2
 
-    for i in range(left_boundary_index, right_boundary_index):
-        current_distance = range_data[i]
-        if current_distance < distance:
-            distance = current_distance
-            angle_index = i
+    window = scan_to_array(range_data[left_boundary_index:right_boundary_index])
+    if len(window) > 0:
+        closest = int(np.argmin(window))
+        if window[closest] < distance:
+            distance = window[closest]
+            angle_index = left_boundary_index + closest
 
     angle = range_index_to_angle(angle_index, min_angle, angle_increment)
     return (angle, distance)
@@ -24,4 +38,67 @@ def scan_angle_to_range_index(angle, min_angle, angle_increment):
 
 
 def range_index_to_angle(index, min_angle, angle_increment):
-    return math.floor((index * angle_increment) + min_angle)
\ No newline at end of file
+    return math.floor((index * angle_increment) + min_angle)
+
+
+class ScanZones(object):
+    """Closest reading in each of several angular zones of a scan.
+
+    The zone boundaries are turned into beam indices once for a given scan
+    configuration; each scan after that is a single np.minimum.reduceat over
+    the range array plus a vectorised argmin, with no Python loop over beams.
+    """
+
+    def __init__(self, zone_bounds, min_angle, angle_increment, beam_count):
+        """
+        :param zone_bounds: [(left_angle, right_angle)] in degrees, in scan order
+        :param min_angle: angle of the first beam in degrees
+        :param angle_increment: degrees between beams
+        :param beam_count: number of ranges in each scan
+        """
+        self.beam_count = beam_count
+        self.min_angle = min_angle
+        self.angle_increment = angle_increment
+
+        bounds = np.array(
+            [
+                [scan_angle_to_range_index(angle, min_angle, angle_increment) for angle in zone]
+                for zone in zone_bounds
+            ]
+        )
+        self.starts = np.clip(bounds[:, 0], 0, beam_count)
+        self.stops = np.clip(bounds[:, 1], self.starts, beam_count)
+        self.middles = (bounds[:, 0] + bounds[:, 1]) // 2
+        self.empty = self.stops == self.starts
+
+        # reduceat over [start0, stop0, start1, stop1, ...] reduces each zone
+        # and each gap between zones; the zone results are every other entry.
+        # A sentinel beam at the end keeps a stop of beam_count a valid index.
+        self.reduce_indices = np.column_stack((self.starts, self.stops)).ravel()
+
+        self.beam_zone = np.full(beam_count + 1, -1, dtype=int)
+        for zone, (start, stop) in enumerate(zip(self.starts, self.stops)):
+            self.beam_zone[start:stop] = zone
+
+    def closest(self, ranges):
+        """Return (distances, angles) arrays for the closest reading per zone.
+
+        ranges should come from scan_to_array. Zones with no valid reading get
+        DISTANCE_LIMIT at the zone's middle angle, like closest_object_in_range.
+        """
+        padded = np.append(ranges, DISTANCE_LIMIT)
+        distances = np.minimum.reduceat(padded, self.reduce_indices)[::2]
+        distances[self.empty] = DISTANCE_LIMIT
+        distances = np.minimum(distances, DISTANCE_LIMIT)
+
+        # First beam of each zone that hits the zone minimum
+        in_zone = self.beam_zone >= 0
+        is_closest = in_zone & (padded == distances[self.beam_zone])
+        hit_beams = np.flatnonzero(is_closest)
+        hit_zones, first = np.unique(self.beam_zone[hit_beams], return_index=True)
+
+        indices = self.middles.copy()
+        found = distances[hit_zones] < DISTANCE_LIMIT
+        indices[hit_zones[found]] = hit_beams[first][found]
+        angles = np.floor(indices * self.angle_increment + self.min_angle)
+        return distances, angles
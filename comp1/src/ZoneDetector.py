@@ -3,7 +3,7 @@ import rospy
 import math
 from sensor_msgs.msg import LaserScan
 from demo3.msg import ZoneScan
-from Utils import closest_object_in_range, DISTANCE_LIMIT
+from Utils import ScanZones, scan_to_array, DISTANCE_LIMIT
 from Constants import (
     DISTANCE_LIMIT,
     OUTER_DISTANCE_LIMIT,
@@ -69,9 +69,21 @@ class zone_detector:
         self.scan_max_angle = None
         self.scan_angle_increment = None
 
+        self.zones = None
+
         self.object_distance = DISTANCE_LIMIT
         self.object_angle = 0.0
 
+    def zone_bounds(self):
+        """Left and right angle of each of the ZONE_NUM equal zones, in degrees."""
+        zone_span = (self.scan_max_angle - self.scan_min_angle) / ZONE_NUM
+        bounds = []
+        for x in range(0, ZONE_NUM):
+            left_zone_bound = self.scan_min_angle + (zone_span * x)
+            right_zone_bound = left_zone_bound + zone_span - self.scan_angle_increment
+            bounds.append((left_zone_bound, right_zone_bound))
+        return bounds
+
     def laser_scan_callback(self, msg):
         if (
             self.scan_min_angle is None
@@ -82,20 +94,16 @@ class zone_detector:
             self.scan_max_angle = math.degrees(msg.angle_max)
             self.scan_angle_increment = math.degrees(msg.angle_increment)
 
-        zone_span = (self.scan_max_angle - self.scan_min_angle) / ZONE_NUM
-        zone_distances = []
-
-        for x in range(0, ZONE_NUM):
-            left_zone_bound = self.scan_min_angle + (zone_span * x)
-            right_zone_bound = left_zone_bound + zone_span - self.scan_angle_increment
-            _, distance = closest_object_in_range(
-                msg.ranges,
-                left_zone_bound,
-                right_zone_bound,
+        if self.zones is None or self.zones.beam_count != len(msg.ranges):
+            self.zones = ScanZones(
+                self.zone_bounds(),
                 self.scan_min_angle,
                 self.scan_angle_increment,
+                len(msg.ranges),
             )
-            zone_distances.append(distance)
+
+        distances, _ = self.zones.closest(scan_to_array(msg.ranges))
+        zone_distances = distances.tolist()
 
         print("DISTANCES: " + str(zone_distances))
 
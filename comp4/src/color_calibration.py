@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""Fit HSV bounds for the course colors and save them as a venue profile.
+
+Frames come from a directory of images, a rosbag or a live image topic.
+Each color is sampled from a rectangle of the frames, given as
+--roi color=x,y,w,h or drawn on the first frame when left out, and its
+bounds are fitted from percentiles of the sampled pixels. Colors that are
+not fitted keep the bounds of the base profile.
+
+    ./color_calibration.py --bag run.bag --roi red=200,400,240,30 --save arena
+    ./color_calibration.py --live /usb_cam/image_raw --colors white --save lab
+    roslaunch comp4 comp4.launch color_profile:=arena
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from color_profile import ColorBounds, ColorProfile, active_profile
+from color_segmenter import ColorSegmenter, ColorSpec
+
+# hue: "wrap" for a range through 0 (red), "range" for a plain range and
+# None to accept any hue (white). saturation: which bound is fitted, the
+# other is left open. The value lower bound is always fitted.
+ColorFit = namedtuple("ColorFit", ["hue", "saturation"])
+
+COLOR_FITS = {
+    "red": ColorFit("wrap", "lower"),
+    "red_image_det": ColorFit("wrap", "lower"),
+    "green": ColorFit("range", "lower"),
+    "white": ColorFit(None, "upper"),
+}
+
+
+def percentiles(values, percentile):
+    return np.percentile(values, [percentile, 100 - percentile])
+
+
+def fit_hue(hue, fit, hue_scale, percentile, margin):
+    """(upper, lower) hue bounds; margin is in degrees."""
+    if fit is None:
+        return (360, 0) if hue_scale == 360 else (179, 0)
+    if (fit == "wrap") != (hue_scale == 360):
+        # hue_scale 360 bounds always wrap through 0, and 180 ones never do
+        raise ValueError("a %s hue fit can not use hue_scale %d" % (fit, hue_scale))
+    degrees = hue.astype(float) * 2
+    if fit == "range":
+        low, high = percentiles(degrees, percentile) + (-margin, margin)
+        return int(min(high / 2, 179)), int(max(low / 2, 0))
+
+    # Centre the samples on 180 degrees so red does not split across 0
+    low, high = percentiles((degrees + 180) % 360, percentile) + (-margin, margin)
+    low, high = low - 180, high - 180
+    if low >= 0:
+        # All above 0: nothing matches h >= 360
+        upper, lower = high, 360
+    elif high < 0:
+        # All below 360: only h = 0 matches h <= 0
+        upper, lower = 0, low + 360
+    else:
+        upper, lower = high, low + 360
+    return int(round(min(upper, 360))), int(round(max(lower, 0)))
+
+
+def fit_bounds(pixels, fit, hue_scale, percentile=1.0, margin=(6, 20, 20)):
+    """Fit ColorBounds to an (N, 3) array of OpenCV HSV pixels.
+
+    :param percentile: share of the samples at each end left outside
+    :param margin: (hue in degrees, saturation, value) added past the fit
+    """
+    hue_upper, hue_lower = fit_hue(
+        pixels[:, 0], fit.hue, hue_scale, percentile, margin[0]
+    )
+    s_low, s_high = percentiles(pixels[:, 1], percentile)
+    if fit.saturation == "upper":
+        s_upper, s_lower = min(s_high + margin[1], 255), 0
+    else:
+        s_upper, s_lower = 255, max(s_low - margin[1], 0)
+    v_lower = max(percentiles(pixels[:, 2], percentile)[0] - margin[2], 0)
+    return ColorBounds(
+        [hue_upper, int(s_upper), 255],
+        [hue_lower, int(s_lower), int(v_lower)],
+        hue_scale,
+    )
+
+
+def coverage(pixels, bounds):
+    """Share of the pixels the bounds accept, as the segmenter applies them."""
+    segmenter = ColorSegmenter(
+        {"color": ColorSpec(bounds.upper, bounds.lower, hue_scale=bounds.hue_scale)}
+    )
+    hsv = np.ascontiguousarray(pixels.reshape(1, -1, 3), dtype=np.uint8)
+    mask = segmenter.segment(hsv, clean=False)["color"]
+    return np.count_nonzero(mask) / float(mask.size)
+
+
+def sample_pixels(hsv_frames, roi):
+    """HSV pixels inside an (x, y, w, h) rectangle of every frame."""
+    x, y, w, h = roi
+    return np.concatenate(
+        [hsv[y : y + h, x : x + w].reshape(-1, 3) for hsv in hsv_frames]
+    )
+
+
+def select_roi(frame, color):
+    """Have the rectangle for a color drawn on the frame."""
+    window = "Select %s, then press enter" % color
+    roi = tuple(int(v) for v in cv2.selectROI(window, frame, False))
+    cv2.destroyWindow(window)
+    if roi[2] == 0 or roi[3] == 0:
+        return None
+    return roi
+
+
+def load_live(topic, count):
+    import cv_bridge
+    import rospy
+    from sensor_msgs.msg import Image
+
+    rospy.init_node("color_calibration", anonymous=True)
+    bridge = cv_bridge.CvBridge()
+    return [
+        bridge.imgmsg_to_cv2(
+            rospy.wait_for_message(topic, Image, timeout=5.0), desired_encoding="bgr8"
+        )
+        for _ in range(count)
+    ]
+
+
+def parse_roi(text):
+    color, _, rect = text.partition("=")
+    try:
+        roi = tuple(int(v) for v in rect.split(","))
+    except ValueError:
+        roi = ()
+    if len(roi) != 4 or color not in COLOR_FITS:
+        raise argparse.ArgumentTypeError(
+            "expected color=x,y,w,h with color one of %s"
+            % ", ".join(sorted(COLOR_FITS))
+        )
+    return color, roi
+
+
+def main():
+    from vision_benchmark import load_bag, load_image_dir
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="directory of images")
+    source.add_argument("--bag", help="rosbag with camera images")
+    source.add_argument("--live", metavar="TOPIC", help="image topic to sample")
+    parser.add_argument(
+        "--topic", default="/usb_cam/image_raw", help="image topic in the bag"
+    )
+    parser.add_argument("--limit", type=int, default=30, help="frames to sample")
+    parser.add_argument(
+        "--roi", type=parse_roi, action="append", default=[], help="color=x,y,w,h"
+    )
+    parser.add_argument(
+        "--colors", nargs="+", default=[], help="colors to select by hand"
+    )
+    parser.add_argument(
+        "--base", help="profile to start from (default: the active profile)"
+    )
+    parser.add_argument("--save", metavar="VENUE", help="save the profile as VENUE")
+    parser.add_argument(
+        "--percentile",
+        type=float,
+        default=1.0,
+        help="percent of samples at each end left out of the fit",
+    )
+    args = parser.parse_args()
+
+    if args.images:
+        frames = load_image_dir(args.images, args.limit)
+    elif args.bag:
+        frames = load_bag(args.bag, args.topic, args.limit)
+    else:
+        frames = load_live(args.live, args.limit)
+    if not frames:
+        sys.exit("no frames loaded")
+
+    rois = dict(args.roi)
+    for color in args.colors:
+        if color not in COLOR_FITS:
+            sys.exit("unknown color %s" % color)
+        if color not in rois:
+            rois[color] = select_roi(frames[0], color)
+    rois = dict((color, roi) for color, roi in rois.items() if roi)
+    if not rois:
+        sys.exit("no colors to fit; give --roi or --colors")
+
+    base = ColorProfile.load(args.base) if args.base else active_profile()
+    profile = ColorProfile(args.save or base.venue, base.colors)
+    hsv_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2HSV) for frame in frames]
+    for color in sorted(rois):
+        pixels = sample_pixels(hsv_frames, rois[color])
+        bounds = fit_bounds(
+            pixels, COLOR_FITS[color], base.colors[color].hue_scale, args.percentile
+        )
+        profile.colors[color] = bounds
+        print(
+            "%-14s upper %-16s lower %-16s covers %5.1f%% (was %5.1f%%) of %d pixels"
+            % (
+                color,
+                bounds.upper,
+                bounds.lower,
+                coverage(pixels, bounds) * 100,
+                coverage(pixels, base.colors[color]) * 100,
+                len(pixels),
+            )
+        )
+
+    if args.save:
+        print("Saved %s" % profile.save(args.save))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Per-venue color bounds, kept as YAML files in param/color_profiles.
+
+A profile holds the [h, s, v] upper and lower bounds of each color class
+in the form config_globals and ColorSpec use. color_calibration.py fits
+and writes them; config_globals loads the profile named by the
+COMP4_COLOR_PROFILE environment variable, or "default", once at import.
+"""
+import os
+from collections import namedtuple
+
+import yaml
+
+PROFILE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "param", "color_profiles"
+)
+PROFILE_ENV = "COMP4_COLOR_PROFILE"
+DEFAULT_PROFILE = "default"
+
+# hue_scale 360: hue in degrees, matching h <= upper or h >= lower
+# hue_scale 180: hue in OpenCV units, matching lower <= h <= upper
+ColorBounds = namedtuple("ColorBounds", ["upper", "lower", "hue_scale"])
+
+
+def profile_path(name):
+    """Path of a profile given a venue name or a path to a YAML file."""
+    if name.endswith(".yaml") or os.sep in name:
+        return os.path.expanduser(name)
+    return os.path.join(PROFILE_DIR, name + ".yaml")
+
+
+class ColorProfile(object):
+    """The color bounds for one venue."""
+
+    def __init__(self, venue, colors):
+        """
+        :param colors: dict of color class name -> ColorBounds
+        """
+        self.venue = venue
+        self.colors = dict(colors)
+
+    @classmethod
+    def load(cls, name):
+        path = profile_path(name)
+        with open(path) as profile_file:
+            data = yaml.safe_load(profile_file)
+        colors = {}
+        for color, bounds in data["colors"].items():
+            if bounds.get("hue_scale", 360) not in (180, 360):
+                raise ValueError("%s: %s hue_scale must be 180 or 360" % (path, color))
+            colors[color] = ColorBounds(
+                list(bounds["upper"]),
+                list(bounds["lower"]),
+                bounds.get("hue_scale", 360),
+            )
+        return cls(data.get("venue", name), colors)
+
+    def save(self, name=None):
+        """Write the profile, by default to the file named after the venue."""
+        path = profile_path(name or self.venue)
+        with open(path, "w") as profile_file:
+            profile_file.write("# Written by color_calibration.py\n")
+            yaml.safe_dump(
+                {
+                    "venue": self.venue,
+                    "colors": dict(
+                        (color, dict(bounds._asdict()))
+                        for color, bounds in self.colors.items()
+                    ),
+                },
+                profile_file,
+                default_flow_style=None,
+            )
+        return path
+
+    def bounds(self, color):
+        """(upper, lower) for a color class."""
+        return self.colors[color].upper, self.colors[color].lower
+
+
+def active_profile():
+    """The profile picked by COMP4_COLOR_PROFILE, or the default one."""
+    return ColorProfile.load(os.environ.get(PROFILE_ENV, DEFAULT_PROFILE))
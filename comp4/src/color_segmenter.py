@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+import cv2
+import numpy as np
+
+from collections import namedtuple
+
+# Up to this many colors share one label plane (one bit per color)
+COLORS_PER_BANK = 8
+
+
+class ColorSpec(
+    namedtuple("ColorSpec", ["upper", "lower", "denoise", "fill", "hue_scale"])
+):
+    """Bounds and cleanup settings for a single named color.
+
+    upper/lower are [h, s, v] lists in the same form as config_globals.
+    With hue_scale=360 the hue is treated like threshold_hsv_360 does, so the
+    range wraps through 0 (h <= upper or h >= lower). With hue_scale=180 the
+    hue is compared directly against OpenCV's 0-179 hue like cv2.inRange.
+    """
+
+    def __new__(cls, upper, lower, denoise=0, fill=0, hue_scale=360):
+        return super(ColorSpec, cls).__new__(
+            cls, upper, lower, denoise, fill, hue_scale
+        )
+
+
+def _channel_table(lower, upper):
+    values = np.arange(256)
+    return (values >= lower) & (values <= upper)
+
+
+def _hue_table(spec):
+    if spec.hue_scale == 360:
+        # cv2.inRange rounds halved bounds to the nearest even integer
+        upper = np.rint(spec.upper[0] / 2.0)
+        lower = np.rint(spec.lower[0] / 2.0)
+        return _channel_table(0, upper) | _channel_table(lower, 180)
+    return _channel_table(spec.lower[0], spec.upper[0])
+
+
+class ColorSegmenter(object):
+    """Produce masks for many colors from one HSV image.
+
+    Every color gets one bit in a uint8 label plane. A per-channel lookup table
+    maps each H, S and V value to the set of colors that accept it, so the
+    label image is a single cv2.LUT pass plus two bitwise ands, no matter how
+    many colors are in the bank. Extracting a color is then one more LUT pass.
+    """
+
+    def __init__(self, specs):
+        self.specs = dict(specs)
+        self.names = sorted(self.specs)
+        self._location = {}
+        self._luts = []
+        self._extractors = {}
+
+        for index, name in enumerate(self.names):
+            bank, bit = divmod(index, COLORS_PER_BANK)
+            if bank == len(self._luts):
+                self._luts.append(np.zeros((1, 256, 3), np.uint8))
+            spec = self.specs[name]
+            flag = np.uint8(1 << bit)
+            tables = (
+                _hue_table(spec),
+                _channel_table(spec.lower[1], spec.upper[1]),
+                _channel_table(spec.lower[2], spec.upper[2]),
+            )
+            for channel, table in enumerate(tables):
+                self._luts[bank][0, table, channel] |= flag
+
+            extractor = np.zeros(256, np.uint8)
+            extractor[(np.arange(256) & flag) != 0] = 255
+            self._location[name] = bank
+            self._extractors[name] = extractor
+
+    def label(self, hsv, names=None):
+        """Return one label plane per bank; bit n is set where color n matches.
+
+        Banks that hold none of the requested names are left as None.
+        """
+        if names is None:
+            names = self.names
+        wanted = set(self._location[name] for name in names)
+        planes = []
+        for bank, lut in enumerate(self._luts):
+            if bank not in wanted:
+                planes.append(None)
+                continue
+            h, s, v = cv2.split(cv2.LUT(hsv, lut))
+            cv2.bitwise_and(h, s, h)
+            cv2.bitwise_and(h, v, h)
+            planes.append(h)
+        return planes
+
+    def extract(self, planes, name, clean=True):
+        """Pull a single 0/255 mask out of the label planes.
+
+        The mask matches what hsv_bound returns for the same bounds, including
+        the spec's open/close morphology when clean is set.
+        """
+        mask = cv2.LUT(planes[self._location[name]], self._extractors[name])
+        if not clean:
+            return mask
+        spec = self.specs[name]
+        if spec.denoise > 0:
+            kernel = np.ones((spec.denoise, spec.denoise), np.uint8)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        if spec.fill > 0:
+            kernel = np.ones((spec.fill, spec.fill), np.uint8)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        return mask
+
+    def segment(self, hsv, names=None, clean=True):
+        """Return a dict of name -> mask for every requested color."""
+        if names is None:
+            names = self.names
+        planes = self.label(hsv, names)
+        return dict((name, self.extract(planes, name, clean)) for name in names)
@@ -1,5 +1,8 @@
+import os
 from enum import Enum
 from geometry_msgs.msg import Pose, Point, Quaternion
+from color_profile import active_profile
+from waypoint_db import LazyWaypointMap
 
 # Shapes
 class Shapes(Enum):
@@ -13,15 +16,62 @@ class Shapes(Enum):
 # Common
 SPEED = 0.55
 
-# Color Bounds
-RED_UPPER = [20, 255, 255]
-RED_LOWER = [317, 80, 80]
-RED_UPPER_IMG = [10, 255, 255]
-RED_LOWER_IMG = [335, 185, 50]
-GREEN_UPPER_180 = [75, 255, 255]
-GREEN_LOWER_180 = [48, 65, 101]
-WHITE_UPPER = [255, 10, 255]
-WHITE_LOWER = [0, 0, 185]
+# Drive states - publish on each new centroid (rate limited) instead of at
+# the loop rate, and stop if centroids stop for the watchdog time (seconds)
+DRIVE_EVENT_DRIVEN = True
+DRIVE_MAX_RATE_HZ = 50
+DRIVE_WATCHDOG_TIMEOUT = 0.3
+
+# Latency tracing - diagnostics period (seconds) and where nodes dump on exit
+LATENCY_REPORT_PERIOD = 1.0
+LATENCY_DUMP_DIR = "~/.ros"
+
+# State profiling - each run writes a directory of timings under this one
+STATE_PROFILE_DIR = "~/.ros/state_profile"
+
+# Turn Controller - angles in degrees, rates in rad/s. Turn states only use
+# it when TURN_USE_CONTROLLER is set; the angles in param/ultra_course.yaml
+# are tuned for the open loop simple_turn and need retuning before switching
+TURN_USE_CONTROLLER = False
+TURN_RATE_HZ = 30
+TURN_MAX_SPEED = 2.2
+TURN_MAX_ACCEL = 6.0
+TURN_MIN_SPEED = 0.3
+TURN_KP = 3.0
+TURN_KD = 0.1
+TURN_TOLERANCE = 3
+TURN_SETTLE_SPEED = 0.15
+TURN_SETTLE_CYCLES = 3
+TURN_TIMEOUT = 10.0
+
+# Map analysis - match param/costmap_common_params.yaml
+MAP_ROBOT_RADIUS = 0.20
+MAP_INFLATION_RADIUS = 0.1
+MAP_COST_SCALING = 10.0
+
+# Grid planner - map goals this close (metres of path) skip move_base
+GRID_HOP_MAX_DISTANCE = 1.5
+GRID_CLEARANCE_WEIGHT = 2.0
+GRID_LOOKAHEAD = 0.3
+GRID_SPEED = 0.3
+GRID_MIN_SPEED = 0.08
+GRID_SLOW_RADIUS = 0.4
+GRID_MAX_TURN_SPEED = 1.5
+GRID_GOAL_TOLERANCE = 0.05
+GRID_RATE_HZ = 20
+GRID_TIMEOUT = 15.0
+
+# Nav client - routes send the next goal this close (metres) to the current
+NAV_HANDOFF_RADIUS = 0.35
+NAV_HANDOFF_RATE_HZ = 10
+
+# Color Bounds - from the venue profile picked by COMP4_COLOR_PROFILE (see
+# color_profile.py and color_calibration.py)
+COLOR_PROFILE = active_profile()
+RED_UPPER, RED_LOWER = COLOR_PROFILE.bounds("red")
+RED_UPPER_IMG, RED_LOWER_IMG = COLOR_PROFILE.bounds("red_image_det")
+GREEN_UPPER_180, GREEN_LOWER_180 = COLOR_PROFILE.bounds("green")
+WHITE_UPPER, WHITE_LOWER = COLOR_PROFILE.bounds("white")
 
 # Red Line Finder - Image Constants
 TOP_CROP_FRAC = 0.0
@@ -40,6 +90,13 @@ S_MIN = 180
 V_MAX = 255
 V_MIN = 80
 
+# Shape Classifier - sequential test settings
+SHAPE_SPRT_MIN_SAMPLES = 5
+SHAPE_SPRT_P_MATCH = 0.8
+SHAPE_SPRT_P_OTHER = 0.3
+SHAPE_SPRT_ERROR_RATE = 0.01
+SHAPE_CLASSIFY_TIMEOUT = 10.0  # seconds without a decision before giving up
+
 # Location 2
 g2_the_shape = Shapes.unknown
 
@@ -49,81 +106,43 @@ g3_turns = [69, 92, 92]
 
 # Location 4
 MARKER_POSE_TOPIC = "ar_pose_marker"
-WAYPOINT_MAP = {
-    "off_ramp": Pose(
-        Point(-0.04193958488532269, -0.08882399277556528, 0.010199999999999999),
-        Quaternion(0.0, 0.0, 0.34350948056213637, 0.9391492089992576),
-    ),
-    "1": Pose(
-        Point(1.4128346917258936, 3.0314988225881017, 0.0102),
-        Quaternion(0.0, 0.0, 0.11511062216559612, 0.9933526788933774),
-    ),
-    "2": Pose(
-        Point(1.4974838033521558, 2.281408009296837, 0.0102),
-        Quaternion(0.0, 0.0, 0.07185644361174354, 0.9974149846034358),
-    ),
-    "3": Pose(
-        Point(1.6296398016279827, 1.4617992377591547, 0.0102),
-        Quaternion(0.0, 0.0, 0.07214590937638982, 0.997394088492735),
-    ),
-    "4": Pose(
-        Point(1.7891876967063711, 0.6209652252079119, 0.0102),
-        Quaternion(0.0, 0.0, -0.005679318202515465, 0.9999838725423299),
-    ),
-    "5": Pose(
-        Point(1.9150393764830873, -0.21134129264055662, 0.010199999999999999),
-        #Quaternion(0.0, 0.0, -0.2439218105436791, 0.9697949011729714),
-        Quaternion(0.0, 0.0, -0.005679318202515465, 0.9999838725423299),
-    ),
-    "6": Pose(
-        #Point(0.20461857551725132, 1.6533389602064918, 0.010200000000000004),
-        Point(0.12461857551725132, 1.6533389602064918, 0.010200000000000004),
-        Quaternion(0.0, 0.0, 0.9964777382330111, -0.08385772001445518),
-    ),
-    "7": Pose(
-        #Point(0.4272674336836944, 0.83219598399239, 0.0102),
-        Point(0.3272674336836944, 0.83219598399239, 0.0102),
-        Quaternion(0.0, 0.0, 0.9947478059045937, -0.10235625358519646),
-    ),
-    "8": Pose(
-        Point(1.0648070049458176, -0.302468245750806, 0.010199999999999999),
-        Quaternion(0.0, 0.0, -0.6178099553656561, 0.7863274502718863),
-    ),
-    "far": Pose(
-        Point(0.8348034063867399, 2.058496798133918, 0.010199999999999999),
-        Quaternion(0.0, 0.0, 0.4270189450655432, 0.9042426779106981),
-    ),
-    "on_ramp": Pose(
-        Point(-0.8334473332557941, 2.584811945485156, 0.0102),
-        Quaternion(0.0, 0.0, -0.9617331318932912, 0.2739879249505739),
-    ),
-    "scan": Pose(
-        Point(0.9380181464288736, 1.4855115054663668, 0.0102),
-        Quaternion(0.0, 0.0, 0.0009838736033419004, 0.9999995159962491),
-    ),
-    "scan_backwards": Pose(
-        Point(0.9380181464288736, 1.4855115054663668, 0.0102),
-        Quaternion(0.0, 0.0, 0.9947478059045937, -0.10235625358519646),
-    ),
-    "box_vantage": Pose(
-        Point(1.9078119085847494, -0.25639876407921636, 0.0102),
-        Quaternion(0.0, 0.0, 0.7627512753474568, 0.646691960639552),
-    ),
-    "scan_east": Pose(
-        Point(1.117095360029464, 0.3325128316758337, 0.010200000000000002),
-        Quaternion(0.0, 0.0, -0.5705387475488254, 0.8212706846986674),
-    ),
-    "scan_west": Pose(
-        Point(0.6111472171378642, 2.0457316691198826, 0.0102),
-        Quaternion(0.0, 0.0, 0.7258962437656054, 0.6878042187185134),
-    ),
-    "scan_westest": Pose(
-        Point(0.6111472171378642, 2.80457316691198826, 0.0102),
-        Quaternion(0.0, 0.0, 0.9964777382330111, -0.08385772001445518),
-    ),
+TARGET_MARKER_IDS = (1, 2, 3, 4, 5)
+MARKER_CONFIRM_HITS = 4
+BOX_MARKER_CONFIRM_HITS = 5
+
+# Named map poses, memory mapped from waypoints.npy on first use. Inspect or
+# rebuild the file with waypoint_db.py (--dump, --compile).
+WAYPOINT_MAP = LazyWaypointMap(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "waypoints.npy")
+)
+
+# Course description that ultra_sm builds its state machine from
+COURSE_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "param", "ultra_course.yaml"
+)
+
+# Parking spots that may hold the location 2 shape
+SHAPE_SCAN_SPOTS = ["8", "7", "6"]
+
+# Tag scan poses as (turn speed in rad/s, sweep in degrees, box side to push
+# from, waypoint to drive to after finding the tag there)
+TAG_SCAN_POINTS = {
+    "scan_east": (0.3, 104, "box_left", "scan_west"),
+    "scan_west": (-0.3, 147, "box_right", None),
 }
+# Where to assume the tag is if no scan finds it, and the box side to push from
+TAG_SCAN_FALLBACK = ("3", "box_right")
+
+# Box frames as (side, offset from the box middle, rotation) in the map frame
+BOX_SIDES = [
+    ("front", (-0.7, 0, 0.010), (0, 0, 0, 1)),
+    ("back", (0.7, 0, 0.010), (0, 0, 1, 0)),
+    ("right", (0.38, -0.7, 0.010), (0, 0, 0.81915204, 0.57357644)),  # yaw 110 deg
+    ("left", (0.02, 0.7, 0.010), (0, 0, -0.70710678, 0.70710678)),
+]
 
 g4_box_id = -1
 g4_box_left_side = None
 g4_box_right_side = None
 g4_target_location = Pose()
+g4_tag_scan_order = []
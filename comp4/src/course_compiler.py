@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""Build smach state machines from a course description.
+
+A course file (see param/ultra_course.yaml) lists each state with its type,
+transitions and parameters, such as turn angles and the red line table.
+load_course() checks it and returns a Course, which build() turns into a
+state machine; several courses can be loaded and built in one process.
+
+    ./course_compiler.py ../param/ultra_course.yaml --option skip_push
+
+checks a course and prints its states without ROS running.
+"""
+import argparse
+import importlib
+import os
+import threading
+from collections import namedtuple
+
+import yaml
+
+# module: where the class named by the type lives
+# args: constructor arguments, looked up in the state's spec, then the context
+# outcomes: None where they depend on the spec (Turn, AtLine)
+StateType = namedtuple(
+    "StateType", ["module", "args", "outcomes", "input_keys", "output_keys"]
+)
+
+
+def _state_type(module, args, outcomes=None, input_keys=(), output_keys=()):
+    return StateType(module, args, outcomes, list(input_keys), list(output_keys))
+
+
+DRIVE_ARGS = ("rate", "cmd_vel_pub")
+LOCATION4_ARGS = ("rate", "cmd_vel_pub", "light_pubs", "sound_pub")
+
+STATE_TYPES = {
+    "Driver": _state_type(
+        "general_states", DRIVE_ARGS + ("sound_pub",), ["advance", "exit"]
+    ),
+    "Advancer": _state_type("general_states", DRIVE_ARGS, ["at_line", "exit"]),
+    "AtLine": _state_type(
+        "general_states",
+        ("rate", "light_pubs", "sound_pub", "next_states", "initial_line", "lap_line"),
+    ),
+    "Turn": _state_type("general_states", ("cmd_vel_pub", "angle", "next_state")),
+    "Detect1": _state_type(
+        "location1", ("rate", "sound_pub", "light_pubs"), ["turn_right", "exit"]
+    ),
+    "DriveToObjects": _state_type("location2", DRIVE_ARGS, ["detect2", "exit"]),
+    "Detect2": _state_type(
+        "location2", ("rate", "sound_pub", "light_pubs"), ["turn_180", "exit"]
+    ),
+    "DriveFromObjects": _state_type("location2", DRIVE_ARGS, ["advance", "exit"]),
+    "Detect3": _state_type(
+        "location3",
+        ("rate", "cmd_vel_pub", "sound_pub", "light_pubs"),
+        ["turn_right_3_1", "turn_right_3_2", "turn_right_3_3", "exit"],
+    ),
+    "DriverRamp": _state_type("location4", DRIVE_ARGS, ["start", "exit"]),
+    "ShapeScan": _state_type("location4", LOCATION4_ARGS, ["done", "exit"]),
+    "BoxSurvey": _state_type("location4", LOCATION4_ARGS, ["tag_scan_1", "exit"]),
+    "TagScan1": _state_type(
+        "location4",
+        LOCATION4_ARGS,
+        ["tag_scan_2", "found_tag", "exit"],
+        output_keys=["push_start_tf"],
+    ),
+    "TagScan2": _state_type(
+        "location4",
+        LOCATION4_ARGS,
+        ["tag_scan_1", "found_tag", "exit"],
+        output_keys=["push_start_tf"],
+    ),
+    "Push": _state_type(
+        "location4", LOCATION4_ARGS, ["on_ramp", "exit"], input_keys=["push_start_tf"]
+    ),
+    "OnRamp": _state_type("location4", ("rate",), ["drive"]),
+}
+
+# Spec entries that are not constructor arguments
+SPEC_KEYS = ("type", "transitions", "lazy")
+
+_courses = {}
+_courses_lock = threading.Lock()
+
+
+class CourseError(ValueError):
+    """A course description that can not be built."""
+
+
+class StateSpec(object):
+    """One state of a course, checked against its type."""
+
+    def __init__(self, label, spec):
+        self.label = label
+        if not isinstance(spec, dict) or spec.get("type") not in STATE_TYPES:
+            raise CourseError(
+                "%s: type must be one of %s" % (label, ", ".join(sorted(STATE_TYPES)))
+            )
+        self.type_name = spec["type"]
+        self.type = STATE_TYPES[self.type_name]
+        self.transitions = dict(spec.get("transitions") or {})
+        self.lazy = bool(spec.get("lazy", False))
+        self.params = dict((k, v) for k, v in spec.items() if k not in SPEC_KEYS)
+        self.outcomes = self._outcomes()
+
+        if set(self.transitions) != set(self.outcomes):
+            raise CourseError(
+                "%s: transitions %s do not match %s outcomes %s"
+                % (
+                    label,
+                    sorted(self.transitions),
+                    self.type_name,
+                    sorted(self.outcomes),
+                )
+            )
+
+    def _outcomes(self):
+        if self.type.outcomes is not None:
+            return list(self.type.outcomes)
+        if self.type_name == "Turn":
+            if len(self.transitions) != 1 or "angle" not in self.params:
+                raise CourseError(
+                    "%s: a Turn takes an angle and one transition" % self.label
+                )
+            self.params["next_state"] = list(self.transitions)[0]
+            return list(self.transitions)
+        # AtLine
+        next_states = self.params.get("next_states")
+        if not isinstance(next_states, dict) or not next_states:
+            raise CourseError("%s: AtLine needs a next_states table" % self.label)
+        self.params["next_states"] = dict(
+            (int(line), outcome) for line, outcome in next_states.items()
+        )
+        lap_line = self.params.get("lap_line")
+        if not isinstance(lap_line, int) or isinstance(lap_line, bool) or lap_line < 1:
+            raise CourseError("%s: AtLine needs a positive int lap_line" % self.label)
+        missing = set(range(1, lap_line + 1)) - set(self.params["next_states"])
+        if missing:
+            raise CourseError(
+                "%s: next_states has no outcome for lines %s"
+                % (self.label, ", ".join(str(line) for line in sorted(missing)))
+            )
+        return sorted(set(self.params["next_states"].values()) | set(["exit"]))
+
+    def args(self, context):
+        values = []
+        for name in self.type.args:
+            if name in self.params:
+                values.append(self.params[name])
+            elif name in context:
+                values.append(context[name])
+            else:
+                raise CourseError("%s: no value for %s" % (self.label, name))
+        return values
+
+    def factory(self, context):
+        """Callable that builds the state with arguments from context."""
+        args = self.args(context)
+        module = importlib.import_module(self.type.module)
+        cls = getattr(module, self.type_name)
+        return lambda: cls(*args)
+
+
+class Course(object):
+    """A checked course: the states, where to start and the final outcomes."""
+
+    def __init__(self, spec, options=(), name="course"):
+        self.name = name
+        if not isinstance(spec, dict) or not isinstance(spec.get("states"), dict):
+            raise CourseError("%s: no states" % name)
+        self.outcomes = list(spec.get("outcomes") or ["exit"])
+        self.start = spec.get("start")
+        if self.start not in spec["states"]:
+            raise CourseError("%s: start state %s is not defined" % (name, self.start))
+
+        self.states = dict(
+            (label, StateSpec(label, state)) for label, state in spec["states"].items()
+        )
+        for option in options:
+            self._apply_option(spec.get("options") or {}, option)
+
+        self._check_targets()
+        self.unreachable = self._check_reachability()
+
+    def _apply_option(self, options, option):
+        if option not in options:
+            raise CourseError(
+                "%s: unknown option %s, expected one of %s"
+                % (self.name, option, ", ".join(sorted(options)))
+            )
+        for label, transitions in options[option].items():
+            if label not in self.states:
+                raise CourseError("option %s: no state %s" % (option, label))
+            state = self.states[label]
+            for outcome, target in transitions.items():
+                if outcome not in state.transitions:
+                    raise CourseError(
+                        "option %s: %s has no outcome %s" % (option, label, outcome)
+                    )
+                state.transitions[outcome] = target
+
+    def _check_targets(self):
+        for state in self.states.values():
+            for outcome, target in state.transitions.items():
+                if target not in self.states and target not in self.outcomes:
+                    raise CourseError(
+                        "%s: %s leads to %s, which is not a state or outcome"
+                        % (state.label, outcome, target)
+                    )
+
+    def _successors(self, label):
+        return [t for t in self.states[label].transitions.values() if t in self.states]
+
+    def _check_reachability(self):
+        """Raise for states that can not finish; return the unreachable ones.
+
+        Unreachable states are allowed, since options can route around a
+        state, but a state that can never lead to one of the course outcomes
+        would run forever.
+        """
+        reachable = set([self.start])
+        frontier = [self.start]
+        while frontier:
+            for target in self._successors(frontier.pop()):
+                if target not in reachable:
+                    reachable.add(target)
+                    frontier.append(target)
+
+        finishing = set(
+            label
+            for label, state in self.states.items()
+            if any(t in self.outcomes for t in state.transitions.values())
+        )
+        changed = True
+        while changed:
+            changed = False
+            for label in self.states:
+                if label not in finishing and any(
+                    t in finishing for t in self._successors(label)
+                ):
+                    finishing.add(label)
+                    changed = True
+        stuck = sorted(reachable - finishing)
+        if stuck:
+            raise CourseError(
+                "%s: %s can never reach an outcome" % (self.name, ", ".join(stuck))
+            )
+        return sorted(set(self.states) - reachable)
+
+    def labels(self):
+        """State labels with the start state first, then in name order."""
+        others = sorted(label for label in self.states if label != self.start)
+        return [self.start] + others
+
+    def build(self, context):
+        """Build the state machine.
+
+        :param context: constructor arguments shared by the states (rate,
+            cmd_vel_pub, sound_pub, light_pubs, initial_line)
+        :return: the state machine and its LazyStates, for warm_up()
+        """
+        import smach
+        from lazy_state import LazyState
+
+        state_machine = smach.StateMachine(outcomes=self.outcomes)
+        lazy_states = []
+        with state_machine:
+            for label in self.labels():
+                spec = self.states[label]
+                factory = spec.factory(context)
+                if spec.lazy:
+                    state = LazyState(
+                        factory,
+                        spec.outcomes,
+                        input_keys=spec.type.input_keys,
+                        output_keys=spec.type.output_keys,
+                    )
+                    lazy_states.append(state)
+                else:
+                    state = factory()
+                smach.StateMachine.add(label, state, transitions=dict(spec.transitions))
+        state_machine.set_initial_state([self.start])
+        return state_machine, lazy_states
+
+
+def load_course(path, options=()):
+    """Load and check a course file, reusing it until the file changes."""
+    path = os.path.abspath(os.path.expanduser(path))
+    key = (path, os.path.getmtime(path), tuple(sorted(options)))
+    with _courses_lock:
+        if key not in _courses:
+            with open(path) as course_file:
+                spec = yaml.safe_load(course_file)
+            _courses[key] = Course(spec, options, name=os.path.basename(path))
+        return _courses[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("course", help="course YAML file")
+    parser.add_argument(
+        "--option", action="append", default=[], help="course option to turn on"
+    )
+    args = parser.parse_args()
+
+    try:
+        course = load_course(args.course, args.option)
+    except CourseError as e:
+        parser.exit(1, "%s\n" % e)
+    for label in course.labels():
+        state = course.states[label]
+        print(
+            "%-20s %-16s %s"
+            % (
+                label,
+                state.type_name + (" (lazy)" if state.lazy else ""),
+                ", ".join(
+                    "%s -> %s" % item for item in sorted(state.transitions.items())
+                ),
+            )
+        )
+    if course.unreachable:
+        print("Unreachable: %s" % ", ".join(course.unreachable))
+
+
+if __name__ == "__main__":
+    main()
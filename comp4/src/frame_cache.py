@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import cv2
+import cv_bridge
+
+
+class RegionOfInterest(
+    namedtuple("RegionOfInterest", ["top", "bottom", "left", "right", "height"])
+):
+    """A rectangular band of an image, given as fractions of its size.
+
+    height, when set, is a pixel count measured down from top and overrides
+    bottom. Bounds are clipped to the image, so a band that runs off the
+    bottom simply ends there.
+    """
+
+    def __new__(cls, top=0.0, bottom=1.0, left=0.0, right=1.0, height=None):
+        return super(RegionOfInterest, cls).__new__(
+            cls, top, bottom, left, right, height
+        )
+
+    def bounds(self, shape):
+        """Return (top, bottom, left, right) pixel bounds for an image shape."""
+        h, w = shape[:2]
+        top = int(h * self.top)
+        if self.height is None:
+            bottom = int(h * self.bottom)
+        else:
+            bottom = int(h * self.top + self.height)
+        return top, min(bottom, h), int(w * self.left), min(int(w * self.right), w)
+
+    def slice(self, image):
+        """Return a view of image covering the region; nothing is copied."""
+        top, bottom, left, right = self.bounds(image.shape)
+        return image[top:bottom, left:right]
+
+
+class Frame(object):
+    """A decoded image message with lazily computed, shared arrays.
+
+    The arrays handed out here are owned by the cache and given to every
+    consumer of the same message without copying. Do not modify them in
+    place; copy first if a mask needs to be edited or drawn on.
+
+    With a tracer (see latency_tracer), the decode and threshold work is
+    timed when it is actually done, whichever consumer triggers it.
+    """
+
+    def __init__(self, msg, bridge, segmenter=None, tracer=None):
+        self.msg = msg
+        self._bridge = bridge
+        self._segmenter = segmenter
+        self._tracer = tracer
+        self._lock = threading.RLock()
+        self._bgr = None
+        self._hsv = None
+        self._planes = None
+        self._masks = {}
+        self._regions = {}
+
+    @property
+    def bgr(self):
+        with self._lock:
+            if self._bgr is None:
+                start = time.time()
+                self._bgr = self._bridge.imgmsg_to_cv2(
+                    self.msg, desired_encoding="bgr8"
+                )
+                self._trace("decode", start)
+            return self._bgr
+
+    @property
+    def hsv(self):
+        with self._lock:
+            if self._hsv is None:
+                self._hsv = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2HSV)
+            return self._hsv
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    def mask(self, name):
+        """Get the cleaned mask for one color known to the segmenter."""
+        with self._lock:
+            if name not in self._masks:
+                self.bgr  # decoded outside the threshold timing
+                start = time.time()
+                if self._planes is None:
+                    self._planes = self._segmenter.label(self.hsv)
+                self._masks[name] = self._segmenter.extract(self._planes, name)
+                self._trace("threshold", start)
+            return self._masks[name]
+
+    def _trace(self, stage, start):
+        if self._tracer is not None:
+            self._tracer.record(stage, time.time() - start)
+
+    def masks(self, names):
+        """Get a dict of name -> mask, sharing one labelling pass."""
+        return dict((name, self.mask(name)) for name in names)
+
+    def region(self, roi):
+        """Get the cached FrameRegion for a RegionOfInterest of this frame."""
+        with self._lock:
+            if roi not in self._regions:
+                self._regions[roi] = FrameRegion(self, roi)
+            return self._regions[roi]
+
+
+class FrameRegion(Frame):
+    """A Frame restricted to a region of interest of its parent.
+
+    bgr is a view into the parent's decoded image, so color conversion,
+    thresholding and morphology only ever touch the pixels in the region.
+    Use to_full to map coordinates back into the parent frame.
+    """
+
+    def __init__(self, parent, roi):
+        Frame.__init__(
+            self, parent.msg, parent._bridge, parent._segmenter, parent._tracer
+        )
+        self.parent = parent
+        self.roi = roi
+        self.top, self.bottom, self.left, self.right = roi.bounds(parent.shape)
+
+    @property
+    def bgr(self):
+        with self._lock:
+            if self._bgr is None:
+                self._bgr = self.parent.bgr[
+                    self.top : self.bottom, self.left : self.right
+                ]
+            return self._bgr
+
+    def to_full(self, x, y):
+        """Convert region pixel coordinates to parent frame coordinates."""
+        return x + self.left, y + self.top
+
+
+class FrameCache(object):
+    """Decode each image message once, no matter how many consumers ask.
+
+    Frames are keyed by the message header (frame id, sequence and stamp) and
+    the least recently used frame is dropped once max_frames are held.
+    """
+
+    def __init__(self, segmenter=None, max_frames=4, tracer=None):
+        self.segmenter = segmenter
+        self.max_frames = max_frames
+        self.tracer = tracer
+        self._bridge = cv_bridge.CvBridge()
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(msg):
+        header = msg.header
+        if header.seq == 0 and header.stamp.secs == 0 and header.stamp.nsecs == 0:
+            # Unstamped message; the cached frame keeps msg alive so its id
+            # cannot be reused while the entry exists.
+            return ("id", id(msg))
+        return (header.frame_id, header.seq, header.stamp.secs, header.stamp.nsecs)
+
+    def get(self, msg):
+        key = self.key(msg)
+        with self._lock:
+            frame = self._frames.pop(key, None)
+            if frame is None:
+                frame = Frame(msg, self._bridge, self.segmenter, self.tracer)
+            self._frames[key] = frame
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+        return frame
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import threading
 
 import rospy, cv2, cv_bridge, numpy
 import smach, smach_ros
@@ -10,12 +11,23 @@ from sensor_msgs.msg import Image
 from comp2.msg import Centroid
 from time import time
 from image_processing import get_white_mask
+from latency_tracer import get_tracer
+from topic_cache import subscribe
 from utils import display_count, simple_turn
 from config_globals import *
 
 
 class Drive(smach.State):
-    def __init__(self, rate, pub_node, outcomes):
+    """Base for states that steer from line centroids.
+
+    The callbacks keep self.twist up to date. A state's loop checks its exit
+    conditions, calls publish_twist() and then wait_for_update(). With
+    DRIVE_EVENT_DRIVEN the wait ends as soon as a centroid comes in, so each
+    frame reaches the wheels straight away instead of at the next tick of
+    the shared rate.
+    """
+
+    def __init__(self, rate, pub_node, outcomes, event_driven=DRIVE_EVENT_DRIVEN):
         smach.State.__init__(self, outcomes=outcomes)  # ["stop", "exit"])
         self.rate = rate
         self.vel_pub = pub_node
@@ -25,10 +37,17 @@ class Drive(smach.State):
         self.path_centroid = Centroid()
         self.stop_centroid = Centroid()
         self.speed = SPEED
+        self.event_driven = event_driven
+        self.updated = threading.Event()
+        self.centroid_time = 0
+        self.centroid_stamp = None  # camera stamp of a centroid not yet driven on
+        self.publish_time = 0
+        self.tracer = get_tracer()
 
     def red_line_callback(self, msg):
         self.stop_distance = msg.cy
         self.stop_centroid = msg
+        self.updated.set()
 
     def image_callback(self, msg):
         curr_err = msg.err
@@ -38,6 +57,46 @@ class Drive(smach.State):
         self.twist.linear.x = self.speed
         self.twist.angular.z = (-float(curr_err) / 200) + (-float(delta_err) / 250)
         self.prev_err = curr_err
+        self.centroid_time = rospy.get_time()
+        self.centroid_stamp = msg.header.stamp
+        self.tracer.since("receive", msg.header.stamp)
+        self.updated.set()
+
+    def publish_twist(self):
+        """Publish self.twist, rate limited and under a watchdog if event driven.
+
+        An update that comes too soon after the last publish is not dropped:
+        this sleeps out the interval and returns with updated set, so the
+        caller's loop checks its exit condition again and then publishes. The
+        watchdog publishes a stop instead when no centroid has arrived for
+        DRIVE_WATCHDOG_TIMEOUT seconds.
+        """
+        now = rospy.get_time()
+        if self.event_driven:
+            wait = self.publish_time + 1.0 / DRIVE_MAX_RATE_HZ - now
+            if wait > 0:
+                rospy.sleep(wait)
+                self.updated.set()
+                return
+            self.publish_time = now
+            if now - self.centroid_time > DRIVE_WATCHDOG_TIMEOUT:
+                self.vel_pub.publish(Twist())
+                return
+        self.vel_pub.publish(self.twist)
+
+        # Trace each centroid once, on the first twist built from it
+        stamp, self.centroid_stamp = self.centroid_stamp, None
+        if stamp is not None:
+            self.tracer.record("state_loop", now - self.centroid_time)
+            self.tracer.since("cmd_vel", stamp)
+
+    def wait_for_update(self):
+        """Wait for the next centroid or red line message, or the next rate tick."""
+        if not self.event_driven:
+            self.rate.sleep()
+            return
+        self.updated.wait(DRIVE_WATCHDOG_TIMEOUT)
+        self.updated.clear()
 
 
 class Driver(Drive):
@@ -47,12 +106,8 @@ class Driver(Drive):
 
     def execute(self, userdata):
         self.stop_distance = -1
-        stop_sub = rospy.Subscriber(
-            "red_line_distance", Centroid, self.red_line_callback
-        )
-        image_sub = rospy.Subscriber(
-            "white_line_centroid", Centroid, self.image_callback
-        )
+        stop_sub = subscribe("red_line_distance", Centroid, self.red_line_callback)
+        image_sub = subscribe("white_line_centroid", Centroid, self.image_callback)
 
         while not rospy.is_shutdown():
 
@@ -62,8 +117,8 @@ class Driver(Drive):
 
                 return "advance"
 
-            self.vel_pub.publish(self.twist)
-            self.rate.sleep()
+            self.publish_twist()
+            self.wait_for_update()
 
         stop_sub.unregister()
         image_sub.unregister()
@@ -78,9 +133,7 @@ class Advancer(Drive):
     def execute(self, userdata):
         prev_stop_err = 0
         self.twist = Twist()
-        red_line_sub = rospy.Subscriber(
-            "red_line_distance", Centroid, self.red_line_callback
-        )
+        red_line_sub = subscribe("red_line_distance", Centroid, self.red_line_callback)
         for _ in range(0, 4):
             twist = Twist()
 
@@ -102,48 +155,29 @@ class Advancer(Drive):
 
 
 class AtLine(smach.State):
-    def __init__(self, rate, light_pubs, sound_pub, initial_line=0):
+    def __init__(
+        self, rate, light_pubs, sound_pub, next_states, initial_line, lap_line
+    ):
+        """
+        :param next_states: outcome for each red line number, from the course
+        :param lap_line: red line that ends a lap and starts the count again
+        """
         smach.State.__init__(
-            self,
-            outcomes=[
-                "drive",
-                "turn_left_1",
-                "turn_left_2_start",
-                "turn_left_2_end",
-                "off_ramp",
-                "turn_left_3_1",
-                "turn_left_3_2",
-                "turn_left_3_3",
-                "exit",
-            ],
+            self, outcomes=sorted(set(next_states.values()) | set(["exit"]))
         )
         self.rate = rate
         self.red_line_num = initial_line
         self.light_pubs = light_pubs
         self.sound_pub = sound_pub
-
-        # IMPORTANT: These states currently assume that the red line at location2
-        # is counted twice (for both directions)
-        self.next_states = {
-            1: "drive",
-            2: "turn_left_1",
-            3: "drive",
-            4: "turn_left_2_start",
-            5: "turn_left_2_end",
-            6: "off_ramp",
-            7: "drive",
-            8: "turn_left_3_1",
-            9: "turn_left_3_2",
-            10: "turn_left_3_3",
-            11: "exit",
-        }
+        self.next_states = next_states
+        self.lap_line = lap_line
 
     def execute(self, userdata):
         self.red_line_num += 1
         print("RED LINE NUMBER: ", self.red_line_num)
         display_count(0, self.light_pubs)
 
-        if self.red_line_num == 11:
+        if self.red_line_num == self.lap_line:
             display_count(2, self.light_pubs)
             sound_msg = Sound()
             sound_msg.value = Sound.ON
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+"""A* paths on the course map and a pure pursuit follower for short hops.
+
+Goals a short drive away are planned in process and followed by publishing
+cmd_vel directly, which skips move_base's global planning and recovery
+behaviours. Longer or unplannable goals are left to move_base.
+
+    ./grid_planner.py 8 7                 # plan between two waypoints
+    ./grid_planner.py 8 7 --simulate      # and follow it with a kinematic model
+"""
+import argparse
+import heapq
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import rospy
+import tf
+from geometry_msgs.msg import Twist
+from tf.transformations import euler_from_quaternion
+
+from config_globals import *
+from occupancy_map import NEIGHBOURS, get_course_grid
+from tf_service import get_tf_service
+from turn_controller import TurnController
+
+_short_hops = None
+_short_hops_lock = threading.Lock()
+
+
+class GridPlanner(object):
+    """A* over the traversable cells of an OccupancyGrid.
+
+    Each step costs its length times a weight that grows as the cells get
+    close to an obstacle, so paths keep to the middle of corridors. The
+    weights are at least 1, so the octile distance to the goal stays an
+    admissible heuristic; it is computed for the whole map at once and kept
+    for the last few goals, as the same waypoints are planned to again.
+    """
+
+    def __init__(
+        self,
+        grid,
+        clearance_weight=GRID_CLEARANCE_WEIGHT,
+        cost_scaling=MAP_COST_SCALING,
+        heuristic_cache=8,
+    ):
+        self.grid = grid
+        self.width = grid.width + 2
+        self.heuristic_cache = heuristic_cache
+        self._heuristics = OrderedDict()
+
+        # Pad with a blocked border so neighbours never need a bounds check
+        self.passable = np.pad(grid.traversable, 1, mode="constant").ravel().tolist()
+        excess = np.maximum(grid.clearance - grid.robot_radius, 0)
+        weight = 1 + clearance_weight * np.exp(-cost_scaling * excess)
+        self.weight = np.pad(weight, 1, mode="edge").ravel().tolist()
+        self.steps = [(dr * self.width + dc, length) for dr, dc, length in NEIGHBOURS]
+
+    def index(self, cell):
+        return (cell[0] + 1) * self.width + cell[1] + 1
+
+    def cell(self, index):
+        return index // self.width - 1, index % self.width - 1
+
+    def heuristic(self, goal):
+        """Octile distance in cells from every (padded, flat) cell to goal."""
+        if goal in self._heuristics:
+            self._heuristics[goal] = self._heuristics.pop(goal)
+            return self._heuristics[goal]
+        rows, cols = np.indices((self.grid.height + 2, self.width))
+        dy = np.abs(rows - 1 - goal[0])
+        dx = np.abs(cols - 1 - goal[1])
+        distance = dx + dy + (math.sqrt(2) - 2) * np.minimum(dx, dy)
+        self._heuristics[goal] = distance.ravel().tolist()
+        while len(self._heuristics) > self.heuristic_cache:
+            self._heuristics.popitem(last=False)
+        return self._heuristics[goal]
+
+    def plan_cells(self, start, goal, max_expansions=None):
+        """Cells from start to goal inclusive, or None if there is no path."""
+        start = self.grid.nearest_traversable(*start)
+        goal = self.grid.nearest_traversable(*goal)
+        heuristic = self.heuristic(goal)
+        passable, weight, steps = self.passable, self.weight, self.steps
+        source, target = self.index(start), self.index(goal)
+
+        costs = {source: 0.0}
+        parents = {source: None}
+        closed = set()
+        queue = [(heuristic[source], source)]
+        while queue:
+            _, node = heapq.heappop(queue)
+            if node == target:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            if max_expansions is not None and len(closed) > max_expansions:
+                return None
+            cost = costs[node]
+            for step, length in steps:
+                neighbour = node + step
+                if not passable[neighbour] or neighbour in closed:
+                    continue
+                new_cost = cost + length * 0.5 * (weight[node] + weight[neighbour])
+                if new_cost < costs.get(neighbour, float("inf")):
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = node
+                    heapq.heappush(queue, (new_cost + heuristic[neighbour], neighbour))
+        else:
+            return None
+
+        path = []
+        node = target
+        while node is not None:
+            path.append(self.cell(node))
+            node = parents[node]
+        return path[::-1]
+
+    def plan(self, start, goal, max_expansions=None):
+        """(N, 2) map points from start to goal (x, y), or None."""
+        cells = self.plan_cells(
+            self.grid.world_to_cell(*start),
+            self.grid.world_to_cell(*goal),
+            max_expansions,
+        )
+        if cells is None:
+            return None
+        path = np.array([self.grid.cell_to_world(*cell) for cell in cells])
+        path[0], path[-1] = start, goal
+        return path
+
+
+def path_length(path):
+    return float(np.hypot(*np.diff(path, axis=0).T).sum()) if len(path) > 1 else 0.0
+
+
+class PurePursuit(object):
+    """Follow a path of map points by steering at a point lookahead ahead.
+
+    command() is the control law on its own, given the robot pose, so it can
+    be run against a simulated robot; follow() runs it on the robot with
+    the pose from tf and publishes cmd_vel.
+    """
+
+    def __init__(
+        self,
+        twist_pub,
+        listen=None,
+        global_frame="map",
+        base_frame="base_footprint",
+        lookahead=GRID_LOOKAHEAD,
+        speed=GRID_SPEED,
+        min_speed=GRID_MIN_SPEED,
+        slow_radius=GRID_SLOW_RADIUS,
+        max_turn_speed=GRID_MAX_TURN_SPEED,
+        goal_tolerance=GRID_GOAL_TOLERANCE,
+        rate_hz=GRID_RATE_HZ,
+    ):
+        """
+        :param listen: TfService for the robot pose, the shared one if None
+        """
+        self.twist_pub = twist_pub
+        self.listen = listen
+        self.global_frame = global_frame
+        self.base_frame = base_frame
+        self.lookahead = lookahead
+        self.speed = speed
+        self.min_speed = min_speed
+        self.slow_radius = slow_radius
+        self.max_turn_speed = max_turn_speed
+        self.goal_tolerance = goal_tolerance
+        self.rate_hz = rate_hz
+        self.path = None
+        self.progress = 0
+
+    def start(self, path):
+        self.path = np.asarray(path, dtype=float)
+        self.progress = 0
+
+    def command(self, x, y, yaw):
+        """(linear, angular) speeds towards the path, or None at the goal."""
+        offsets = self.path[self.progress :] - (x, y)
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        if distances[-1] < self.goal_tolerance:
+            return None
+        closest = int(np.argmin(distances))
+        self.progress += closest
+        ahead = np.flatnonzero(distances[closest:] >= self.lookahead)
+        dx, dy = offsets[closest + ahead[0]] if len(ahead) else offsets[-1]
+
+        # Target in the robot frame
+        forward = math.cos(yaw) * dx + math.sin(yaw) * dy
+        left = -math.sin(yaw) * dx + math.cos(yaw) * dy
+        bearing = math.atan2(left, forward)
+        if abs(bearing) > math.pi / 3:
+            turn = max(-self.max_turn_speed, min(self.max_turn_speed, 2 * bearing))
+            return 0.0, turn
+
+        curvature = 2 * left / (forward ** 2 + left ** 2)
+        linear = self.speed * min(1.0, distances[-1] / self.slow_radius)
+        linear = max(linear, self.min_speed)
+        angular = linear * curvature
+        if abs(angular) > self.max_turn_speed:
+            angular = math.copysign(self.max_turn_speed, angular)
+            linear = angular / curvature
+        return linear, angular
+
+    def robot_pose(self):
+        """(x, y, yaw) of the robot in global_frame, or None if tf has none."""
+        if self.listen is None:
+            self.listen = get_tf_service()
+        try:
+            (x, y, _), rotation = self.listen.lookup(self.global_frame, self.base_frame)
+        except (
+            tf.LookupException,
+            tf.ConnectivityException,
+            tf.ExtrapolationException,
+        ):
+            return None
+        return x, y, euler_from_quaternion(rotation)[2]
+
+    def follow(self, path, yaw=None, timeout=GRID_TIMEOUT):
+        """Drive along path, then turn to yaw (radians) if given.
+
+        Returns True at the goal, False on timeout or shutdown.
+        """
+        self.start(path)
+        rate = rospy.Rate(self.rate_hz)
+        deadline = rospy.get_time() + timeout
+        arrived = False
+        while not rospy.is_shutdown() and rospy.get_time() < deadline:
+            pose = self.robot_pose()
+            speeds = (0.0, 0.0) if pose is None else self.command(*pose)
+            if speeds is None:
+                arrived = True
+                break
+            twist = Twist()
+            twist.linear.x, twist.angular.z = speeds
+            self.twist_pub.publish(twist)
+            rate.sleep()
+
+        self.twist_pub.publish(Twist())
+        if not arrived or yaw is None:
+            return arrived
+        pose = self.robot_pose()
+        if pose is None:
+            return False
+        turn = math.degrees(yaw - pose[2])
+        return TurnController(self.twist_pub).turn(turn)
+
+
+class ShortHopDriver(object):
+    """Drive to map poses with a GridPlanner and PurePursuit when close by."""
+
+    def __init__(self, planner, follower, max_distance=GRID_HOP_MAX_DISTANCE):
+        self.planner = planner
+        self.follower = follower
+        self.max_distance = max_distance
+
+    def drive_to(self, pose):
+        """Drive to a map frame Pose if it is a short hop away.
+
+        Returns False without moving if it is not (or no path was found),
+        and False if following the path failed, so the caller can fall back
+        to move_base from wherever the robot is.
+        """
+        start = self.follower.robot_pose()
+        if start is None:
+            return False
+        goal = (pose.position.x, pose.position.y)
+        if math.hypot(goal[0] - start[0], goal[1] - start[1]) > self.max_distance:
+            return False
+        path = self.planner.plan(start[:2], goal)
+        if path is None or path_length(path) > self.max_distance:
+            return False
+        q = pose.orientation
+        yaw = euler_from_quaternion((q.x, q.y, q.z, q.w))[2]
+        return self.follower.follow(path, yaw)
+
+
+def get_short_hop_driver(twist_pub):
+    """The process-wide short hop driver, built on first use on twist_pub."""
+    global _short_hops
+    with _short_hops_lock:
+        if _short_hops is None:
+            _short_hops = ShortHopDriver(
+                GridPlanner(get_course_grid()), PurePursuit(twist_pub)
+            )
+        return _short_hops
+
+
+def simulate(follower, path, start, dt=0.05, steps=2000):
+    """Run follower on a unicycle model from start (x, y, yaw); the final pose."""
+    x, y, yaw = start
+    follower.start(path)
+    for _ in range(steps):
+        speeds = follower.command(x, y, yaw)
+        if speeds is None:
+            break
+        linear, angular = speeds
+        yaw += angular * dt
+        x += linear * math.cos(yaw) * dt
+        y += linear * math.sin(yaw) * dt
+    return x, y, yaw
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("start", help="waypoint name")
+    parser.add_argument("goal", help="waypoint name")
+    parser.add_argument(
+        "--simulate", action="store_true", help="follow the path with a model robot"
+    )
+    args = parser.parse_args()
+
+    start, goal = WAYPOINT_MAP[args.start], WAYPOINT_MAP[args.goal]
+    planner = GridPlanner(get_course_grid())
+    began = time.time()
+    path = planner.plan(
+        (start.position.x, start.position.y), (goal.position.x, goal.position.y)
+    )
+    took = time.time() - began
+    if path is None:
+        print("No path from %s to %s" % (args.start, args.goal))
+        return
+    print(
+        "%d points, %.2f m, planned in %.1f ms"
+        % (len(path), path_length(path), took * 1000)
+    )
+
+    if args.simulate:
+        q = start.orientation
+        yaw = euler_from_quaternion((q.x, q.y, q.z, q.w))[2]
+        x, y, _ = simulate(PurePursuit(None), path, (path[0][0], path[0][1], yaw))
+        print("Stopped %.3f m from the goal" % math.hypot(x - path[-1][0], y - path[-1][1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,46 @@ import cv_bridge
 from sensor_msgs.msg import Image
 from enum import Enum
 
+from blob_stats import BlobStats
+from color_segmenter import ColorSegmenter, ColorSpec
+from frame_cache import FrameCache, RegionOfInterest
+from latency_tracer import get_tracer
+from shape_classifier import ShapeClassifier
+from topic_cache import wait_for_message
 from config_globals import *
 
+
+def profile_spec(color, denoise=0, fill=0):
+    """ColorSpec for a color class of the active venue profile."""
+    bounds = COLOR_PROFILE.colors[color]
+    return ColorSpec(
+        bounds.upper,
+        bounds.lower,
+        denoise=denoise,
+        fill=fill,
+        hue_scale=bounds.hue_scale,
+    )
+
+
+# Built once from the active profile, so the segmenter tables cost nothing per frame
+COLOR_SPECS = {
+    "red": profile_spec("red", denoise=3, fill=6),
+    "red_image_det": profile_spec("red_image_det", denoise=3, fill=6),
+    "white": profile_spec("white", denoise=3, fill=6),
+    "white_line": profile_spec("white", denoise=2, fill=6),
+    "green": profile_spec("green", denoise=2, fill=3),
+}
+SEGMENTER = ColorSegmenter(COLOR_SPECS)
+FRAME_CACHE = FrameCache(SEGMENTER, tracer=get_tracer())
+
+# One persistent classifier per (mask_func, topic, mass_threshold, approx_factor)
+SHAPE_CLASSIFIERS = {}
+
+# Band of the usb_cam image the line trackers follow
+WHITE_LINE_ROI = RegionOfInterest(top=0.6, height=200)
+# Band of the rgb camera image Detect1 counts red objects in
+RED_COUNT_ROI = RegionOfInterest(top=0.7)
+
 def threshold_hsv_360(hsv, h_max, h_min, s_max, s_min, v_max, v_min, denoise=0, fill=0):
     """Taken from:
     
@@ -29,11 +67,14 @@ def threshold_hsv_360(hsv, h_max, h_min, s_max, s_min, v_max, v_min, denoise=0,
     return mask
 
 
-def hsv_bound(image, upper_bound, lower_bound, denoise=0, fill=0):
+def hsv_bound(image, upper_bound, lower_bound, denoise=0, fill=0, roi=None):
     """Create a mask exposing only regions fall within bounds.
     
-    Basically just a wrapper for threshold_hsv_360.
+    Basically just a wrapper for threshold_hsv_360. When a RegionOfInterest is
+    given only that band is thresholded and the mask covers just the band.
     """
+    if roi is not None:
+        image = roi.slice(image)
     return threshold_hsv_360(
         image,
         upper_bound[0],
@@ -54,9 +95,11 @@ def detect_shape(mask, canvas=None, threshold=100, approx_factor=0.03):
     """
     detected_shapes = []
     moments = []
-    _, contours, _ = cv2.findContours(mask, 1, 2)
+    # [-2] picks the contours on both the OpenCV 3 and 4 return signatures
+    contours = cv2.findContours(mask, 1, 2)[-2]
     for cnt in contours:
-        if cv2.moments(cnt)["m00"] > threshold:
+        moment = cv2.moments(cnt)
+        if moment["m00"] > threshold:
             approx = cv2.approxPolyDP(
                 cnt, approx_factor * cv2.arcLength(cnt, True), True
             )
@@ -64,21 +107,21 @@ def detect_shape(mask, canvas=None, threshold=100, approx_factor=0.03):
                 if canvas != None:
                     cv2.drawContours(canvas, [cnt], 0, (0, 255, 0), -1)
                 detected_shapes.append(Shapes.triangle)
-                moments.append(cv2.moments(cnt))
+                moments.append(moment)
 
             elif len(approx) == 4:
                 if canvas != None:
                     cv2.drawContours(canvas, [cnt], 0, (0, 0, 255), -1)
                 detected_shapes.append(Shapes.square)
-                moments.append(cv2.moments(cnt))
+                moments.append(moment)
             elif len(approx) >= 5:
                 if canvas != None:
                     cv2.drawContours(canvas, [cnt], 0, (0, 255, 255), -1)
                 detected_shapes.append(Shapes.circle)
-                moments.append(cv2.moments(cnt))
+                moments.append(moment)
             else:
                 detected_shapes.append(Shapes.unknown)
-                moments.append(cv2.moments(cnt))
+                moments.append(moment)
     if canvas != None:
         cv2.imshow("shape", canvas)
         cv2.waitKey(1)
@@ -96,60 +139,31 @@ def study_shapes(
     topic="/camera/rgb/image_raw",
     approx_factor=0.03,
 ):
-    if rate is None:
-        rate = rospy.Rate(20)
-
-    sample_count = 1
-    square_count = 0
-    triangle_count = 0
-    circle_count = 0
-    print("start study")
-
-    while not rospy.is_shutdown():
-        mask = mask_func(topic=topic)
-        shapes, _ = detect_shape(
-            mask, threshold=mass_threshold, approx_factor=approx_factor
-        )
+    """Decide which shape is in view of the camera on topic.
 
-        if len(shapes) == 1:
-            if shapes[0] == Shapes.square:
-                print(
-                    "square confidence: " + str(float(square_count) / float(sample_count))
-                )
-                square_count += 1
-            elif shapes[0] == Shapes.triangle:
-                print(
-                    "triangle confidence: "
-                    + str(float(triangle_count) / float(sample_count))
-                )
-                triangle_count += 1
-            elif shapes[0] == Shapes.circle:
-                print(
-                    "circle confidence: " + str(float(circle_count) / float(sample_count))
-                )
-                circle_count += 1
-
-        if min_samples <= sample_count < max_samples:
-            if float(square_count) / float(sample_count) > confidence:
-                return Shapes.square
-            elif float(triangle_count) / float(sample_count) > confidence:
-                return Shapes.triangle
-            elif float(circle_count) / float(sample_count) > confidence:
-                return Shapes.circle
-        elif max_samples <= sample_count:
-            return Shapes.unknown
-
-        print(
-            str(sample_count)
-            + " / ["
-            + str(min_samples)
-            + ", "
-            + str(max_samples)
-            + "]"
+    Uses a ShapeClassifier that stays subscribed between calls and stops as
+    soon as its sequential test is decisive. min_samples is where the old
+    majority vote starts to apply; rate is no longer used since the
+    classifier runs at the camera's frame rate.
+    """
+    key = (mask_func, topic, mass_threshold, approx_factor)
+    if key not in SHAPE_CLASSIFIERS:
+        SHAPE_CLASSIFIERS[key] = ShapeClassifier(
+            mask_func,
+            lambda mask: detect_shape(
+                mask, threshold=mass_threshold, approx_factor=approx_factor
+            )[0],
+            topic,
         )
-        sample_count += 1
 
+    print("start study")
+    shape = SHAPE_CLASSIFIERS[key].classify(
+        max_samples=max_samples,
+        confidence=confidence,
+        fallback_samples=min_samples,
+    )
     print("stop study")
+    return shape
 
 
 def lowest_object_coord(mask, threshold=100):
@@ -157,29 +171,20 @@ def lowest_object_coord(mask, threshold=100):
     
     Note: The lowest object corresponds to the largest y coord
     """
-    _, contours, _ = cv2.findContours(mask, 1, 2)
-    moments = [cv2.moments(c) for c in contours if cv2.moments(c)["m00"] > threshold]
-    lowest_y = -1
-    lowest_coord = (0, lowest_y)
-    for m in moments:
-        x, y = int(m["m10"] / m["m00"]), int(m["m01"] / m["m00"])
-        if y > lowest_y:
-            lowest_y = y
-            lowest_coord = (x, y)
+    lowest_coord = BlobStats(mask).lowest(threshold)
+    if lowest_coord is None:
+        return (0, -1)
     return lowest_coord
 
 
 def count_objects(mask, threshold=700, canvas=None):
     """Count the number of distinct objects in the boolean image."""
-    _, contours, _ = cv2.findContours(mask, 1, 2)
-    moments = [cv2.moments(cont) for cont in contours]
-    big_moments = [m for m in moments if m["m00"] > threshold]
+    blobs = BlobStats(mask)
+    big_blobs = blobs.above(threshold)
     if canvas != None:
-        for moment in big_moments:
-            cx = int(moment["m10"] / moment["m00"])
-            cy = int(moment["m01"] / moment["m00"])
-            cv2.circle(canvas, (cx, cy), 20, (0, 0, 255), -1)
-    return len(big_moments)
+        for index in big_blobs:
+            cv2.circle(canvas, blobs.coord(index), 20, (0, 0, 255), -1)
+    return len(big_blobs)
 
 
 def detect_green_shape(image=None):
@@ -193,58 +198,56 @@ def detect_green_shape(image=None):
 
 def right_most_object_coord(mask, threshold=100):
     """Find the coordinates for the right most object in the mask."""
-    _, contours, _ = cv2.findContours(mask, 1, 2)
-    moments = [cv2.moments(c) for c in contours if cv2.moments(c)["m00"] > threshold]
-    right_most_x = -1
-    right_most_coord = (right_most_x, 0)
-    for m in moments:
-        x, y = int(m["m10"] / m["m00"]), int(m["m01"] / m["m00"])
-        if x > right_most_x:
-            right_most_x = x
-            right_most_coord = (x, y)
+    right_most_coord = BlobStats(mask).right_most(threshold)
+    if right_most_coord is None:
+        return (-1, 0)
     return right_most_coord
 
 
-def get_hsv_image(image=None, topic="camera/rgb/image_raw"):
+def get_frame(image=None, topic="camera/rgb/image_raw"):
+    """Get the shared, decode-once Frame for an image message.
+
+    Waits for the next message on topic when no image is given.
+    """
     if image is None:
-        image = rospy.wait_for_message(topic, Image, timeout=0.4)
-    bridge = cv_bridge.CvBridge()
-    image = bridge.imgmsg_to_cv2(image, desired_encoding="bgr8")
-    return cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        image = wait_for_message(topic, Image, timeout=0.4)
+    return FRAME_CACHE.get(image)
+
+
+def get_hsv_image(image=None, topic="camera/rgb/image_raw"):
+    return get_frame(image=image, topic=topic).hsv
+
+
+def get_masks(names, image=None, topic="camera/rgb/image_raw"):
+    """Get several color masks for the same frame with one HSV conversion.
+
+    Returns a dict keyed by the names in COLOR_SPECS. The masks are shared
+    with every other consumer of the frame, so copy before editing them.
+    """
+    return get_frame(image=image, topic=topic).masks(names)
 
 
 def get_red_mask(image=None, topic="camera/rgb/image_raw"):
-    return hsv_bound(
-        get_hsv_image(image=image, topic=topic), RED_UPPER, RED_LOWER, 3, 6
-    )
+    return get_masks(["red"], image=image, topic=topic)["red"]
 
 
 def get_red_mask_image_det(image=None, topic="camera/rgb/image_raw"):
-    return hsv_bound(
-        get_hsv_image(image=image, topic=topic), RED_UPPER_IMG, RED_LOWER_IMG, 3, 6
-    )
+    return get_masks(["red_image_det"], image=image, topic=topic)["red_image_det"]
 
 
 def get_white_mask(image=None, topic="camera/rgb/image_raw"):
-    return hsv_bound(
-        get_hsv_image(image=image, topic=topic), WHITE_UPPER, WHITE_LOWER, 3, 6
-    )
+    return get_masks(["white"], image=image, topic=topic)["white"]
 
 
 def get_green_mask(image=None, topic="camera/rgb/image_raw"):
-    # return hsv_bound(get_hsv_image(image=image), GREEN_UPPER, GREEN_LOWER, 3, 6)
-    hsv = get_hsv_image(image=image)
-    mask = cv2.inRange(hsv, np.array(GREEN_LOWER_180), np.array(GREEN_UPPER_180))
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
-    return mask
+    return get_masks(["green"], image=image, topic=topic)["green"]
 
 
 def image_testing_callback(msg):
-    bridge = cv_bridge.CvBridge()
-    image = bridge.imgmsg_to_cv2(msg, desired_encoding="bgr8")
-    red_mask = get_red_mask(image=msg)
-    green_mask = get_green_mask(image=msg)
+    image = get_frame(image=msg).bgr.copy()
+    masks = get_masks(["red", "green"], image=msg)
+    red_mask = masks["red"]
+    green_mask = masks["green"]
     comb_mask = red_mask | green_mask
 
     all_shapes, all_moments = detect_shape(mask=comb_mask, canvas=image, threshold=1000)
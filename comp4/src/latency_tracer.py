@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""Latency histograms for the camera to cmd_vel pipeline.
+
+Centroid messages carry the stamp of the camera frame they came from, so
+each node on the way can record how old the frame is, or how long its own
+step took, under a stage name:
+
+    decode      image message to BGR array (frame_cache)
+    threshold   HSV conversion and color mask (frame_cache)
+    moments     centroid or blob position from the mask (trackers)
+    publish     frame capture to centroid publish (trackers)
+    receive     frame capture to centroid arriving in a Drive state
+    state_loop  centroid arriving to the Twist built from it being published
+    cmd_vel     frame capture to that Twist being published
+
+A node that calls start_reporting() publishes its histograms as
+diagnostic_msgs/DiagnosticArray and writes them to a YAML file on shutdown.
+"""
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import rospy
+import yaml
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+from config_globals import LATENCY_DUMP_DIR, LATENCY_REPORT_PERIOD
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+class LatencyHistogram(object):
+    """Latency counts in log spaced bins, ten a decade from 0.1 ms to 10 s."""
+
+    EDGES = np.logspace(-4, 1, 51)  # seconds
+
+    def __init__(self):
+        self.edges = self.EDGES.tolist()
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def percentile(self, percent):
+        """Upper edge of the bin holding the percentile, in seconds."""
+        if not self.count:
+            return 0.0
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, percent / 100.0 * self.count))
+        if index >= len(self.edges):
+            return self.maximum
+        return min(self.edges[index], self.maximum)
+
+    def summary(self):
+        """Count and mean, percentile and maximum latencies in milliseconds."""
+        mean = self.total / self.count if self.count else 0.0
+        return OrderedDict(
+            [
+                ("count", self.count),
+                ("mean_ms", round(mean * 1000, 3)),
+                ("p50_ms", round(self.percentile(50) * 1000, 3)),
+                ("p90_ms", round(self.percentile(90) * 1000, 3)),
+                ("p99_ms", round(self.percentile(99) * 1000, 3)),
+                ("max_ms", round(self.maximum * 1000, 3)),
+            ]
+        )
+
+
+class LatencyTracer(object):
+    """Per-stage latency histograms for one process."""
+
+    def __init__(self):
+        self.histograms = OrderedDict()
+        self._lock = threading.Lock()
+        self.diagnostics_pub = None
+        self.timer = None
+
+    def record(self, stage, seconds):
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = LatencyHistogram()
+            self.histograms[stage].add(max(seconds, 0.0))
+
+    def since(self, stage, stamp):
+        """Record the age of a header stamp; unstamped (zero) times are skipped."""
+        if stamp.is_zero():
+            return
+        self.record(stage, rospy.get_time() - stamp.to_sec())
+
+    @contextmanager
+    def timed(self, stage):
+        """Record how long the body of a with block takes."""
+        start = time.time()
+        yield
+        self.record(stage, time.time() - start)
+
+    def summary(self):
+        with self._lock:
+            return OrderedDict(
+                (stage, histogram.summary())
+                for stage, histogram in self.histograms.items()
+            )
+
+    def diagnostics(self):
+        array = DiagnosticArray()
+        array.header.stamp = rospy.Time.now()
+        for stage, summary in self.summary().items():
+            status = DiagnosticStatus()
+            status.level = DiagnosticStatus.OK
+            status.name = "%s: latency %s" % (rospy.get_name(), stage)
+            status.message = "p50 %.1f ms, p99 %.1f ms" % (
+                summary["p50_ms"],
+                summary["p99_ms"],
+            )
+            status.values = [KeyValue(key, str(value)) for key, value in summary.items()]
+            array.status.append(status)
+        return array
+
+    def dump(self, path):
+        """Write the summaries and raw bin counts to a YAML file."""
+        with self._lock:
+            stages = dict(
+                (
+                    stage,
+                    dict(
+                        histogram.summary(),
+                        bin_edges_ms=[edge * 1000 for edge in histogram.edges],
+                        bin_counts=list(histogram.counts),
+                    ),
+                )
+                for stage, histogram in self.histograms.items()
+            )
+        with open(path, "w") as dump_file:
+            yaml.safe_dump(
+                {"node": rospy.get_name(), "stages": stages},
+                dump_file,
+                default_flow_style=None,
+            )
+
+    def start_reporting(self, topic="/diagnostics", period=LATENCY_REPORT_PERIOD):
+        """Publish diagnostics every period seconds and dump on shutdown."""
+        self.diagnostics_pub = rospy.Publisher(topic, DiagnosticArray, queue_size=1)
+        self.timer = rospy.Timer(
+            rospy.Duration(period),
+            lambda event: self.diagnostics_pub.publish(self.diagnostics()),
+        )
+        path = os.path.join(
+            os.path.expanduser(LATENCY_DUMP_DIR),
+            "latency_%s.yaml" % rospy.get_name().strip("/").replace("/", "_"),
+        )
+        rospy.on_shutdown(lambda: self._dump_at_shutdown(path))
+
+    def _dump_at_shutdown(self, path):
+        try:
+            self.dump(path)
+        except (IOError, OSError) as e:
+            rospy.logwarn("Could not write latency histograms: %s" % e)
+
+
+def get_tracer():
+    """Return the process-wide LatencyTracer."""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = LatencyTracer()
+        return _tracer
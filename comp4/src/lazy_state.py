@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import threading
+import traceback
+
+import rospy
+import smach
+
+
+class LazyState(smach.State):
+    """Stand in for a state that is only built when it is first needed.
+
+    The outcomes and userdata keys are given up front so the state machine
+    can be put together without building anything. The wrapped state is
+    built on first entry, or earlier in the background by warm_up(); entry
+    waits for a build that is already under way.
+    """
+
+    def __init__(self, factory, outcomes, input_keys=[], output_keys=[]):
+        """
+        :param factory: callable with no arguments that returns the state
+        """
+        smach.State.__init__(
+            self, outcomes=outcomes, input_keys=input_keys, output_keys=output_keys
+        )
+        self.factory = factory
+        self._state = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        """Return the wrapped state, building it now if it has not been."""
+        with self._lock:
+            if self._state is None:
+                state = self.factory()
+                declared = set(self.get_registered_outcomes())
+                extra = set(state.get_registered_outcomes()) - declared
+                if extra:
+                    raise smach.InvalidStateError(
+                        "Lazy state declares outcomes %s but %s also has %s"
+                        % (
+                            sorted(declared),
+                            type(state).__name__,
+                            sorted(extra),
+                        )
+                    )
+                self._state = state
+            return self._state
+
+    def execute(self, userdata):
+        return self.build().execute(userdata)
+
+    def request_preempt(self):
+        smach.State.request_preempt(self)
+        if self._state is not None:
+            self._state.request_preempt()
+
+    def service_preempt(self):
+        smach.State.service_preempt(self)
+        if self._state is not None:
+            self._state.service_preempt()
+
+    def recall_preempt(self):
+        smach.State.recall_preempt(self)
+        if self._state is not None:
+            self._state.recall_preempt()
+
+
+def warm_up(tasks):
+    """Run each callable in its own daemon thread and return the threads.
+
+    A task that raises is logged and otherwise ignored; for a LazyState.build
+    the error comes back when the state is entered and built again.
+    """
+
+    def run(task):
+        try:
+            task()
+        except Exception:
+            rospy.logwarn("Warm up failed:\n" + traceback.format_exc())
+
+    threads = []
+    for task in tasks:
+        thread = threading.Thread(target=run, args=(task,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    return threads
@@ -11,8 +11,11 @@ from image_processing import (
     count_objects,
     detect_shape,
     get_red_mask_image_det,
+    get_frame,
+    RED_COUNT_ROI,
 )
 
+from topic_cache import wait_for_message
 from utils import display_count, simple_turn
 
 class Detect1(smach.State):
@@ -25,13 +28,8 @@ class Detect1(smach.State):
     def execute(self, userdata):
         max_count = 0
         for _ in range(7):
-            image = rospy.wait_for_message("camera/rgb/image_raw", Image)
-            red_mask = get_red_mask_image_det(image)
-            h, w = red_mask.shape
-            search_top = h * 0.7
-            search_bot = h
-            red_mask[0:search_top, 0:w] = 0
-            red_mask[search_bot:h, 0:w] = 0
+            image = wait_for_message("camera/rgb/image_raw", Image)
+            red_mask = get_frame(image).region(RED_COUNT_ROI).mask("red_image_det")
             count = count_objects(red_mask)
             max_count = max(count, max_count)
 
@@ -57,7 +55,7 @@ if __name__ == "__main__":
     rate = rospy.Rate(10)
     while not rospy.is_shutdown():
         print("Wait for image")
-        image = rospy.wait_for_message("camera/rgb/image_raw", Image)
+        image = wait_for_message("camera/rgb/image_raw", Image)
         red_mask = get_red_mask_image_det(image)
         canvas = cv_bridge.CvBridge().imgmsg_to_cv2(image, desired_encoding="bgr8")
         shapes, moments = detect_shape(red_mask, canvas)
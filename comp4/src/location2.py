@@ -14,6 +14,7 @@ from image_processing import (
     get_red_mask,
     get_red_mask_image_det,
     get_green_mask,
+    get_masks,
     detect_shape,
     detect_green_shape,
     study_shapes,
@@ -21,6 +22,7 @@ from image_processing import (
 )
 import cv_bridge
 import cv2
+from topic_cache import subscribe, wait_for_message
 from utils import display_count, simple_turn
 from config_globals import *
 
@@ -36,9 +38,7 @@ class DriveToObjects(Drive):
 
     def execute(self, userdata):
         global g2_the_shape
-        white_line_sub = rospy.Subscriber(
-            "white_line_centroid", Centroid, self.image_callback
-        )
+        white_line_sub = subscribe("white_line_centroid", Centroid, self.image_callback)
 
         while not rospy.is_shutdown():
 
@@ -55,8 +55,8 @@ class DriveToObjects(Drive):
                 white_line_sub.unregister()
                 return "detect2"
 
-            self.vel_pub.publish(self.twist)
-            self.rate.sleep()
+            self.publish_twist()
+            self.wait_for_update()
 
         return "exit"
 
@@ -69,12 +69,8 @@ class DriveFromObjects(Drive):
         self.stop_distance = -1
         prev_err = 0
 
-        stop_sub = rospy.Subscriber(
-            "red_line_distance", Centroid, self.red_line_callback
-        )
-        image_sub = rospy.Subscriber(
-            "white_line_centroid", Centroid, self.image_callback
-        )
+        stop_sub = subscribe("red_line_distance", Centroid, self.red_line_callback)
+        image_sub = subscribe("white_line_centroid", Centroid, self.image_callback)
 
         while not rospy.is_shutdown():
 
@@ -128,10 +124,9 @@ class Detect2(smach.State):
         count_tally = {1: 0, 2: 0, 3: 0}
 
         for _ in range(30):
-            image = rospy.wait_for_message("camera/rgb/image_raw", Image)
-            red_mask = get_red_mask_image_det(image)
-            green_mask = get_green_mask(image)
-            shape_mask = red_mask | green_mask
+            image = wait_for_message("camera/rgb/image_raw", Image)
+            masks = get_masks(["red_image_det", "green"], image=image)
+            shape_mask = masks["red_image_det"] | masks["green"]
             count = count_objects(shape_mask, threshold=1000)
             if count in count_tally:
                 count_tally[count] += 1
@@ -25,9 +25,14 @@ from nav_msgs.msg import Odometry
 from image_processing import study_shapes, get_red_mask, get_red_mask_image_det
 
 from sensor_msgs.msg import Joy
-from move_base_msgs.msg import MoveBaseAction, MoveBaseGoal
 from kobuki_msgs.msg import Led, Sound
-from utils import display_count, broadcast_box_sides, wait_for_odom_angle, extract_angle, standardize_theta, simple_turn
+from grid_planner import get_short_hop_driver
+from route_planner import get_route_planner, pose_position
+from tf_service import get_tf_service
+from topic_cache import get_topic_cache, subscribe
+from marker_tracker import MarkerTracker
+from turn_controller import wrap_angle
+from utils import display_count, box_side_broadcaster, wait_for_odom_angle, extract_angle, simple_turn
 from config_globals import *
 
 from location2 import get_the_shape
@@ -41,7 +46,7 @@ class DriverRamp(Drive):
         self.path_centroid = Centroid()
 
         self.stop_distance = -1
-        white_line_sub = rospy.Subscriber(
+        white_line_sub = subscribe(
             "white_line_ramp_centroid", Centroid, self.image_callback
         )
         pose_pub = rospy.Publisher(
@@ -67,8 +72,8 @@ class DriverRamp(Drive):
                 white_line_sub.unregister()
                 return "start"
 
-            self.vel_pub.publish(self.twist)
-            self.rate.sleep()
+            self.publish_twist()
+            self.wait_for_update()
 
         for _ in range(0, 4):
             twist = Twist()
@@ -83,26 +88,24 @@ class DriverRamp(Drive):
         return "exit"
     
 
-class BoxSurvey(smach.State):
+class BoxSurvey(NavState):
     def __init__(self, rate, pub_node, led_nodes, sound_node):
-        smach.State.__init__(self, outcomes=["tag_scan_1", "exit"])
-        self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
-        self.client.wait_for_server()
+        super(BoxSurvey, self).__init__(
+            ["tag_scan_1", "exit"], short_hops=get_short_hop_driver(pub_node)
+        )
         self.pub_node = pub_node
         self.led_nodes = led_nodes
         self.sound_node = sound_node
         self.rate = rate
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
-        self.listen = tf.TransformListener()
-        self.br = tf.TransformBroadcaster()
+        self.tracker = MarkerTracker(confirm_hits=BOX_MARKER_CONFIRM_HITS)
+        self.box_id = None  # fixed once the survey has picked the box marker
+        self.listen = get_tf_service()
+        self.box_sides = box_side_broadcaster(self.listen)
 
     def execute(self, user_data):
         self.reset_vars()
 
-        self.ar_sub = rospy.Subscriber(
-            MARKER_POSE_TOPIC, AlvarMarkers, self.ar_callback, queue_size=1
-        )
+        self.ar_sub = subscribe(MARKER_POSE_TOPIC, AlvarMarkers, self.ar_callback)
         self.drive_to_vantage_point()
         self.record_box()
         self.ar_sub.unregister()
@@ -113,32 +116,30 @@ class BoxSurvey(smach.State):
         global g4_box_right_side
         global g4_box_id
         global g4_target_location
-        
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
+
+        self.tracker.reset()
+        self.box_id = None
         g4_box_id = -1
         g4_box_left_side = None
         g4_box_right_side = None
         g4_target_location = Pose()
 
     def drive_to_vantage_point(self):
-        goal_pose = MoveBaseGoal()
-        goal_pose.target_pose.header.frame_id = "map"
-        goal_pose.target_pose.pose = WAYPOINT_MAP["box_vantage"]
-        self.client.send_goal(goal_pose)
-        self.client.wait_for_result()
+        self.move_to_map_pose(WAYPOINT_MAP["box_vantage"])
 
     def record_box(self):
         global g4_box_left_side
         global g4_box_right_side
+        global g4_box_id
 
-        while (
-            self.ar_focus_id == -1 or self.target_repetitions < 4
-        ) and not rospy.is_shutdown():
+        while self.tracker.best_confirmed() is None and not rospy.is_shutdown():
             twist = Twist()
             twist.angular.x = 0.2
             self.pub_node.publish(twist)
             self.rate.sleep()
+        self.box_id = self.tracker.best_confirmed()
+        if self.box_id is not None:
+            g4_box_id = self.box_id
 
         display_count(2, self.led_nodes, color_primary=Led.RED)
         sound_msg = Sound()
@@ -146,117 +147,87 @@ class BoxSurvey(smach.State):
         self.sound_node.publish(sound_msg)
 
         rospy.sleep(2)
-        g4_box_left_side = self.listen.lookupTransform(
-            "/map", "box_left", rospy.Time(0)
-        )
-        g4_box_right_side = self.listen.lookupTransform(
-            "/map", "box_right", rospy.Time(0)
-        )
+        g4_box_left_side = self.listen.lookup("map", "box_left")
+        g4_box_right_side = self.listen.lookup("map", "box_right")
 
     def ar_callback(self, msg):
         global g4_box_id
-        global g4_box_left_side
-        global g4_box_right_side
 
-        if not msg.markers:
-            self.ar_focus_id = -1
-            self.target_repetitions = 0
-            return
+        self.tracker.update(msg)
+        # The box sides follow the same marker that ends the survey
+        box_id = self.box_id
+        if box_id is None:
+            box_id = self.tracker.best_confirmed()
+        if box_id is not None and any(m.id == box_id for m in msg.markers):
+            self.box_sides.update("ar_marker_" + str(box_id))
+            g4_box_id = box_id
 
-        for marker in msg.markers:
-            if marker.id == self.ar_focus_id:
-                self.target_repetitions = self.target_repetitions + 1
-                broadcast_box_sides(self.br, self.listen, "ar_marker_" + str(marker.id))
-                g4_box_id = self.ar_focus_id
 
-            else:
-                self.ar_focus_id = marker.id
-                self.target_repetitions = 0
+class TagScan(NavState):
+    """Drive to one of TAG_SCAN_POINTS and turn on the spot to find the tag.
 
-            break
+    The route planner picks which scan point to try first from where amcl
+    has the robot: TagScan1 scans that one and TagScan2 the other.
+    """
 
-
-class TagScan1(smach.State):
-    def __init__(self, rate, pub_node, led_nodes, sound_node):
-        smach.State.__init__(
-            self,
-            outcomes=["tag_scan_2", "found_tag", "exit"],
+    def __init__(self, rate, pub_node, led_nodes, sound_node, outcomes):
+        super(TagScan, self).__init__(
+            outcomes,
             output_keys=["push_start_tf"],
+            short_hops=get_short_hop_driver(pub_node),
         )
         self.rate = rate
         self.pub_node = pub_node
         self.led_nodes = led_nodes
         self.sound_node = sound_node
-        self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
-        self.client.wait_for_server()
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
-        self.found_target = False
-        self.listen = tf.TransformListener()
-
-    def execute(self, user_data):
-        self.reset_vars()
-
-        self.ar_sub = rospy.Subscriber(
-            MARKER_POSE_TOPIC, AlvarMarkers, self.ar_callback, queue_size=1
-        )
-
-        self.drive_to_scan_point()
-        self.scan()
-
-        if self.because_i_still_havent_found_what_im_looking_for():
-            self.ar_sub.unregister()
-            return "tag_scan_2"
-        else:
-            user_data.push_start_tf = "box_left"
+        self.tracker = MarkerTracker(confirm_hits=MARKER_CONFIRM_HITS)
+        self.listen = get_tf_service()
+        self.amcl = get_topic_cache("amcl_pose", PoseWithCovarianceStamped)
+        self.planner = get_route_planner()
+
+    def scan_point(self, user_data, point):
+        """Scan from point and return whether a tag was found there."""
+        turn_speed, sweep, push_start_tf, next_point = TAG_SCAN_POINTS[point]
+        self.tracker.reset()
+        self.ar_sub = subscribe(MARKER_POSE_TOPIC, AlvarMarkers, self.tracker.update)
+        self.drive_to(point)
+        found = self.scan(turn_speed, sweep)
+        self.ar_sub.unregister()
 
+        if found:
+            user_data.push_start_tf = push_start_tf
             self.indicate_tag_found()
-            self.drive_to_neutral_point()
-            self.ar_sub.unregister()
-            return "found_tag"
+            if next_point is not None:
+                self.drive_to(next_point)
+        return found
 
-    def reset_vars(self):
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
-        self.found_target = False
-
-
-    def drive_to_scan_point(self):
-        goal_pose = MoveBaseGoal()
-        goal_pose.target_pose.header.frame_id = "map"
-        goal_pose.target_pose.pose = WAYPOINT_MAP["scan_east"]
-        self.client.send_goal(goal_pose)
-        self.client.wait_for_result()
-
-    def drive_to_neutral_point(self):
-        goal_pose = MoveBaseGoal()
-        goal_pose.target_pose.header.frame_id = "map"
-        goal_pose.target_pose.pose = WAYPOINT_MAP["scan_west"]
-        self.client.send_goal(goal_pose)
-        self.client.wait_for_result()
-
-    def scan(self):
+    def drive_to(self, waypoint):
+        self.move_to_map_pose(WAYPOINT_MAP[waypoint])
+
+    def scan(self, turn_speed, sweep):
+        """Turn until a target marker is confirmed or sweep degrees have passed."""
         global g4_target_location
         start_angle = wait_for_odom_angle()
-        while (
-            self.ar_focus_id not in set([1, 2, 3, 4, 5]) or self.target_repetitions < 3
-        ) and not rospy.is_shutdown():
-            if abs(wait_for_odom_angle() - start_angle) > 104:
-                return
+        target_id = self.confirmed_target()
+        while target_id is None and not rospy.is_shutdown():
+            if abs(wrap_angle(wait_for_odom_angle() - start_angle)) > sweep:
+                return False
             twist = Twist()
-            twist.angular.z = 0.3
+            twist.angular.z = turn_speed
             self.pub_node.publish(twist)
             self.rate.sleep()
+            target_id = self.confirmed_target()
 
-        print("FOUND MARKER ID: ", self.ar_focus_id)
-        ar_trans, ar_rot = self.listen.lookupTransform(
-            "odom", "ar_marker_" + str(self.ar_focus_id), rospy.Time(0)
-        )
+        if target_id is None:
+            return False
+
+        print("FOUND MARKER ID: ", target_id)
+        ar_trans, ar_rot = self.listen.lookup("odom", "ar_marker_" + str(target_id))
         g4_target_location.position = Point(*ar_trans)
         g4_target_location.orientation = Quaternion(*ar_rot)
 
         print "TARGET POSITION: " + str(g4_target_location.position)
-        self.found_target = True
+        return True
 
     def indicate_tag_found(self):
         display_count(2, self.led_nodes)
@@ -264,126 +235,57 @@ class TagScan1(smach.State):
         sound_msg.value = Sound.ON
         self.sound_node.publish(sound_msg)
 
-    def because_i_still_havent_found_what_im_looking_for(self):
-        return not self.found_target
-
-    def ar_callback(self, msg):
-        if not msg.markers:
-            self.target_repetitions = 0
-            return
-
-        for marker in msg.markers:
-            if marker.id != g4_box_id:
-                if marker.id == self.ar_focus_id:
-                    self.target_repetitions = self.target_repetitions + 1
-                else:
-                    self.ar_focus_id = marker.id
-                    self.target_repetitions = 0
-                break
+    def confirmed_target(self):
+        """A confirmed target marker id other than the box's, or None."""
+        return self.tracker.best_confirmed(
+            [i for i in TARGET_MARKER_IDS if i != g4_box_id]
+        )
 
 
-class TagScan2(smach.State):
+class TagScan1(TagScan):
     def __init__(self, rate, pub_node, led_nodes, sound_node):
-        smach.State.__init__(
-            self,
-            outcomes=["tag_scan_1", "found_tag", "exit"],
-            output_keys=["push_start_tf"],
+        super(TagScan1, self).__init__(
+            rate, pub_node, led_nodes, sound_node, ["tag_scan_2", "found_tag", "exit"]
         )
-        self.rate = rate
-        self.pub_node = pub_node
-        self.led_nodes = led_nodes
-        self.sound_node = sound_node
-        self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
-        self.client.wait_for_server()
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
-        self.found_target = False
-        self.listen = tf.TransformListener()
 
     def execute(self, user_data):
-        self.reset_vars()
+        global g4_tag_scan_order
 
-        self.ar_sub = rospy.Subscriber(
-            MARKER_POSE_TOPIC, AlvarMarkers, self.ar_callback, queue_size=1
+        amcl_pose = self.amcl.latest()
+        start = pose_position(amcl_pose) if amcl_pose else "box_vantage"
+        points = list(TAG_SCAN_POINTS)
+        g4_tag_scan_order = self.planner.order(
+            start, points, [1.0 / len(points)] * len(points)
         )
+        print "TAG SCAN ORDER: " + str(g4_tag_scan_order)
 
-        self.drive_to_scan_point()
-        self.scan()
-        user_data.push_start_tf = "box_right"
-        self.indicate_tag_found()
-
-        self.ar_sub.unregister()
-        return "found_tag"
+        if self.scan_point(user_data, g4_tag_scan_order[0]):
+            return "found_tag"
+        return "tag_scan_2"
 
-    def reset_vars(self):
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
-        self.found_target = False
-
-    def drive_to_scan_point(self):
-        goal_pose = MoveBaseGoal()
-        goal_pose.target_pose.header.frame_id = "map"
-        goal_pose.target_pose.pose = WAYPOINT_MAP["scan_west"]
-        self.client.send_goal(goal_pose)
-        self.client.wait_for_result()
-
-    def scan(self, max_error=3):
-        global g4_target_location
-        target_theta = standardize_theta(wait_for_odom_angle()-150)
-        while (
-            self.ar_focus_id not in set([1, 2, 3, 4, 5]) or self.target_repetitions < 3
-        ) and not rospy.is_shutdown():
-            if abs(target_theta - wait_for_odom_angle()) < max_error:
-                print "NOT FOUND - ASSUMING WAYPOINT 3"
-                g4_target_location = WAYPOINT_MAP["3"]
-                self.found_target = True
-                return
-            twist = Twist()
-            twist.angular.z = -0.3
-            self.pub_node.publish(twist)
-            self.rate.sleep()
 
-        print("FOUND MARKER ID: ", self.ar_focus_id)
-        ar_trans, ar_rot = self.listen.lookupTransform(
-            "odom", "ar_marker_" + str(self.ar_focus_id), rospy.Time(0)
+class TagScan2(TagScan):
+    def __init__(self, rate, pub_node, led_nodes, sound_node):
+        super(TagScan2, self).__init__(
+            rate, pub_node, led_nodes, sound_node, ["tag_scan_1", "found_tag", "exit"]
         )
-        g4_target_location.position = Point(*ar_trans)
-        g4_target_location.orientation = Quaternion(*ar_rot)
-        self.found_target = True
-
-    def because_i_still_havent_found_what_im_looking_for(self):
-        return not self.found_target
 
-    def indicate_tag_found(self):
-        display_count(2, self.led_nodes)
-        sound_msg = Sound()
-        sound_msg.value = Sound.ON
-        self.sound_node.publish(sound_msg)
-
-    def ar_callback(self, msg):
-        if not msg.markers:
-            self.target_repetitions = 0
-            return
+    def execute(self, user_data):
+        global g4_target_location
 
-        for marker in msg.markers:
-            if marker.id != g4_box_id:
-                if marker.id == self.ar_focus_id:
-                    self.target_repetitions = self.target_repetitions + 1
-                else:
-                    self.ar_focus_id = marker.id
-                    self.target_repetitions = 0
-                break
+        point = g4_tag_scan_order[-1] if g4_tag_scan_order else "scan_west"
+        if not self.scan_point(user_data, point):
+            fallback_point, fallback_side = TAG_SCAN_FALLBACK
+            print "NOT FOUND - ASSUMING WAYPOINT " + fallback_point
+            g4_target_location = WAYPOINT_MAP[fallback_point]
+            user_data.push_start_tf = fallback_side
+            self.indicate_tag_found()
+        return "found_tag"
 
 
-class Push(smach.State):
+class Push(NavState):
     def __init__(self, rate, pub_node, led_nodes, sound_node):
-        smach.State.__init__(
-            self,
-            outcomes=["on_ramp", "exit"],
-            input_keys=["push_start_tf"],
-        )
-        self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
-        self.client.wait_for_server()
+        super(Push, self).__init__(["on_ramp", "exit"], input_keys=["push_start_tf"])
         self.rate = rate
         self.pub_node = pub_node
         self.led_nodes = led_nodes
@@ -392,17 +294,14 @@ class Push(smach.State):
         self.kp = -0.01
         self.distance_to_target = 1000
         self.reference = 0
-        self.listen = tf.TransformListener()
-        self.br = tf.TransformBroadcaster()
+        self.listen = get_tf_service()
+        self.box_sides = box_side_broadcaster(self.listen)
 
     def execute(self, user_data):
         self.reset_vars()
 
-        self.ar_sub = rospy.Subscriber(
-            MARKER_POSE_TOPIC, AlvarMarkers, self.ar_callback, queue_size=1
-        )
-        odom_sub = rospy.Subscriber("odom", Odometry, self.odom_callback)
-        rospy.wait_for_message("odom", Odometry)
+        self.ar_sub = subscribe(MARKER_POSE_TOPIC, AlvarMarkers, self.ar_callback)
+        odom_sub = subscribe("odom", Odometry, self.odom_callback)
         if self.drive_to_push_point(user_data.push_start_tf):
             self.reference = wait_for_odom_angle()
             self.push_to_goal()
@@ -419,12 +318,10 @@ class Push(smach.State):
         self.reference = 0
 
     def drive_to_push_point(self, target_frame_id):
-        goal = MoveBaseGoal()
-        goal.target_pose.header.frame_id = target_frame_id
-        goal.target_pose.pose.position = Point(0, 0, 0)
-        goal.target_pose.pose.orientation = Quaternion(0, 0, 0, 1)
-        self.client.send_goal(goal)
-        result = self.client.wait_for_result()
+        goal = self.move_to_relative_point(
+            Point(0, 0, 0), Quaternion(0, 0, 0, 1), target_frame_id
+        )
+        result = goal.done()
 
         display_count(2, self.led_nodes, Led.GREEN, Led.RED)
 
@@ -458,35 +355,35 @@ class Push(smach.State):
         self.curr_error = theta - self.reference
 
     def ar_callback(self, msg):
-        global g4_box_id
-        if not msg.markers:
-            self.ar_focus_id = -1
-            self.target_repetitions = 0
-            return
-
         for marker in msg.markers:
             if marker.id == g4_box_id:
-                broadcast_box_sides(self.br, self.listen, "ar_marker_" + str(marker.id))
+                self.box_sides.update("ar_marker_" + str(marker.id))
 
 
-class ShapeScan(smach.State):
+class ShapeScan(NavState):
     def __init__(self, rate, pub_node, led_nodes, sound_node):
-        smach.State.__init__(self, outcomes=["done", "exit"])
+        super(ShapeScan, self).__init__(
+            ["done", "exit"], short_hops=get_short_hop_driver(pub_node)
+        )
         self.rate = rate
         self.pub_node = pub_node
         self.led_nodes = led_nodes
         self.sound_node = sound_node
-        self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
-        self.client.wait_for_server()
+        self.amcl = get_topic_cache("amcl_pose", PoseWithCovarianceStamped)
+        self.planner = get_route_planner()
+        self.planner.costs  # path lengths between waypoints, before the run
 
     def execute(self, userdata):
-        for spot_num in range(8, 5, -1):
-            parking_spot = MoveBaseGoal()
-            parking_spot.target_pose.header.frame_id = "map"
-            parking_spot.target_pose.pose = WAYPOINT_MAP[str(spot_num)]
+        amcl_pose = self.amcl.latest()
+        start = pose_position(amcl_pose) if amcl_pose else "off_ramp"
+        chance = 1.0 / len(SHAPE_SCAN_SPOTS)
+        spots = self.planner.order(
+            start, SHAPE_SCAN_SPOTS, [chance] * len(SHAPE_SCAN_SPOTS)
+        )
+        print "SHAPE SCAN ORDER: " + str(spots)
 
-            self.client.send_goal(parking_spot)
-            self.client.wait_for_result()
+        for spot in spots:
+            self.move_to_map_pose(WAYPOINT_MAP[spot])
 
             msg = Twist()
             msg.linear.x = -0.2
@@ -520,27 +417,14 @@ class ShapeScan(smach.State):
         return "done"
 
 
-class OnRamp(smach.State):
+class OnRamp(NavState):
     def __init__(self, rate):
-        smach.State.__init__(self, outcomes=["drive"])
-        self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
-        self.client.wait_for_server()
+        super(OnRamp, self).__init__(["drive"])
         self.rate = rate
 
     def execute(self, userdata):
-        pose_prepare = MoveBaseGoal()
-        pose_prepare.target_pose.header.frame_id = "map"
-        pose_prepare.target_pose.pose = WAYPOINT_MAP["scan_westest"]
-
-        self.client.send_goal(pose_prepare)
-        self.client.wait_for_result()
-
-        pose_ramp = MoveBaseGoal()
-        pose_ramp.target_pose.header.frame_id = "map"
-        pose_ramp.target_pose.pose = WAYPOINT_MAP["on_ramp"]
-
-        self.client.send_goal(pose_ramp)
-        self.client.wait_for_result()
-
+        self.move_through_map_poses(
+            [WAYPOINT_MAP["scan_westest"], WAYPOINT_MAP["on_ramp"]]
+        )
         return "drive"
 
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import threading
+
+import numpy as np
+import rospy
+
+
+class MarkerTracker(object):
+    """Track every AR marker id seen on an AlvarMarkers topic at once.
+
+    Per-id state lives in flat arrays indexed by marker id: the last
+    position, the number of consecutive messages the id appeared in (its
+    streak), an exponentially smoothed confidence and a velocity estimate.
+    Asking whether an id is confirmed, or for its latest pose, is a single
+    array lookup, and every marker in a message counts, not only the first.
+
+    A marker missing from a message loses its streak, so an empty message
+    resets everything, like the per-state repetition counters it replaces.
+    """
+
+    def __init__(self, confirm_hits=4, decay=0.6, max_id=32, ignore=()):
+        """
+        :param confirm_hits: consecutive sightings before an id is confirmed
+        :param decay: weight of the old confidence in each update
+        :param max_id: ids at or above this are dropped
+        :param ignore: ids never tracked (e.g. the box marker)
+        """
+        self.confirm_hits = confirm_hits
+        self.decay = decay
+        self.max_id = max_id
+        self.ignore = set(ignore)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.positions = np.zeros((self.max_id, 3))
+            self.velocities = np.zeros((self.max_id, 3))
+            self.stamps = np.zeros(self.max_id)
+            self.streaks = np.zeros(self.max_id, dtype=int)
+            self.confidence = np.zeros(self.max_id)
+            self.markers = [None] * self.max_id
+
+    def update(self, msg):
+        """Feed one AlvarMarkers message; use as (or from) the subscriber callback."""
+        stamp = msg.header.stamp.to_sec() or rospy.get_time()
+        seen = np.zeros(self.max_id, dtype=bool)
+
+        with self._lock:
+            for marker in msg.markers:
+                marker_id = marker.id
+                if marker_id >= self.max_id or marker_id in self.ignore:
+                    continue
+                position = marker.pose.pose.position
+                position = np.array([position.x, position.y, position.z])
+                dt = stamp - self.stamps[marker_id]
+                if self.streaks[marker_id] > 0 and dt > 0:
+                    self.velocities[marker_id] = (
+                        position - self.positions[marker_id]
+                    ) / dt
+                else:
+                    self.velocities[marker_id] = 0
+                self.positions[marker_id] = position
+                self.stamps[marker_id] = stamp
+                self.markers[marker_id] = marker
+                seen[marker_id] = True
+
+            self.streaks = np.where(seen, self.streaks + 1, 0)
+            self.confidence *= self.decay
+            self.confidence[seen] += 1 - self.decay
+
+    def streak(self, marker_id):
+        """Consecutive messages marker_id has appeared in, up to the latest."""
+        if not 0 <= marker_id < self.max_id:
+            return 0
+        return int(self.streaks[marker_id])
+
+    def is_confirmed(self, marker_id):
+        return self.streak(marker_id) >= self.confirm_hits
+
+    def confirmed(self, candidates=None):
+        """Confirmed ids, most confident first, optionally limited to candidates."""
+        confirmed = self.streaks >= self.confirm_hits
+        if candidates is not None:
+            wanted = np.zeros(self.max_id, dtype=bool)
+            wanted[[i for i in candidates if 0 <= i < self.max_id]] = True
+            confirmed &= wanted
+        ids = np.flatnonzero(confirmed)
+        return [int(i) for i in ids[np.argsort(-self.confidence[ids], kind="mergesort")]]
+
+    def best_confirmed(self, candidates=None):
+        """The most confident confirmed id, or None."""
+        ids = self.confirmed(candidates)
+        return ids[0] if ids else None
+
+    def marker(self, marker_id):
+        """Latest AlvarMarker seen for an id, or None."""
+        if not 0 <= marker_id < self.max_id:
+            return None
+        return self.markers[marker_id]
+
+    def predicted_position(self, marker_id, stamp=None):
+        """Last position moved on by the velocity estimate up to stamp (seconds)."""
+        if stamp is None:
+            return self.positions[marker_id].copy()
+        dt = stamp - self.stamps[marker_id]
+        return self.positions[marker_id] + self.velocities[marker_id] * dt
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+import functools
+import math
+import threading
+
+import actionlib
+import rospy
+from actionlib_msgs.msg import GoalStatus
+from geometry_msgs.msg import Pose
+from move_base_msgs.msg import MoveBaseAction, MoveBaseGoal
+
+from config_globals import NAV_HANDOFF_RADIUS, NAV_HANDOFF_RATE_HZ
+
+TERMINAL_STATES = (
+    GoalStatus.PREEMPTED,
+    GoalStatus.SUCCEEDED,
+    GoalStatus.ABORTED,
+    GoalStatus.REJECTED,
+    GoalStatus.RECALLED,
+    GoalStatus.LOST,
+)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class NavGoal(object):
+    """Handle on one move_base goal, in the style of a future.
+
+    A goal replaced by a newer one on the same client finishes as PREEMPTED,
+    or as SUCCEEDED if a route handed off from it within its handoff radius.
+    """
+
+    def __init__(self, client, pose, frame):
+        self.client = client
+        self.pose = pose
+        self.frame = frame
+        self.state = GoalStatus.PENDING
+        self.result = None
+        self.position = None  # robot (x, y) from the latest feedback
+        self.handed_off = False
+        self._done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def msg(self):
+        goal = MoveBaseGoal()
+        # The stamp stays zero so move_base uses the latest transform; frames
+        # such as the box sides are only broadcast now and then
+        goal.target_pose.header.frame_id = self.frame
+        goal.target_pose.pose = self.pose
+        return goal
+
+    def done(self):
+        return self._done.is_set()
+
+    def succeeded(self):
+        return self.state == GoalStatus.SUCCEEDED
+
+    def wait(self, timeout=None):
+        """Block until the goal finishes; True if it did within timeout."""
+        deadline = None if timeout is None else rospy.get_time() + timeout
+        while not self._done.is_set() and not rospy.is_shutdown():
+            remaining = 0.1
+            if deadline is not None:
+                remaining = min(remaining, deadline - rospy.get_time())
+                if remaining <= 0:
+                    break
+            self._done.wait(remaining)
+        return self._done.is_set()
+
+    def cancel(self):
+        self.client.cancel(self)
+
+    def add_done_callback(self, callback):
+        """Call callback(goal) when the goal finishes, or now if it has."""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def distance_remaining(self):
+        """Metres from the last feedback position to the goal, or None.
+
+        Only known for goals in the frame move_base reports feedback in (map).
+        """
+        if self.position is None or self.frame != self.client.global_frame:
+            return None
+        return math.hypot(
+            self.pose.position.x - self.position[0],
+            self.pose.position.y - self.position[1],
+        )
+
+    def _finish(self, state, result=None):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.state = state
+            self.result = result
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+class NavRoute(object):
+    """Goals sent one after another through a NavClient.
+
+    The next goal is sent as soon as the robot is within handoff_radius of
+    the current one, so move_base carries on without stopping at each
+    intermediate pose. The route stops early if a goal fails.
+    """
+
+    def __init__(self, client, poses, frame, handoff_radius):
+        self.client = client
+        self.poses = list(poses)
+        self.frame = frame
+        self.handoff_radius = handoff_radius
+        self.goals = []
+        self._cancelled = False
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        rate = rospy.Rate(NAV_HANDOFF_RATE_HZ)
+        try:
+            for i, pose in enumerate(self.poses):
+                if self._cancelled or rospy.is_shutdown():
+                    break
+                goal = self.client.send(pose, self.frame)
+                self.goals.append(goal)
+                if i == len(self.poses) - 1:
+                    goal.wait()
+                    break
+                while not goal.done() and not self._cancelled:
+                    remaining = goal.distance_remaining()
+                    if remaining is not None and remaining < self.handoff_radius:
+                        goal.handed_off = True
+                        break
+                    rate.sleep()
+                if goal.done() and not goal.succeeded():
+                    break
+        except rospy.ROSInterruptException:
+            pass
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def succeeded(self):
+        return len(self.goals) == len(self.poses) and self.goals[-1].succeeded()
+
+    def wait(self, timeout=None):
+        """Block until the last goal finishes or the route stops early."""
+        deadline = None if timeout is None else rospy.get_time() + timeout
+        while not self._done.is_set() and not rospy.is_shutdown():
+            remaining = 0.1
+            if deadline is not None:
+                remaining = min(remaining, deadline - rospy.get_time())
+                if remaining <= 0:
+                    break
+            self._done.wait(remaining)
+        return self._done.is_set()
+
+    def cancel(self):
+        self._cancelled = True
+        if self.goals:
+            self.goals[-1].cancel()
+
+
+class NavClient(object):
+    """A move_base action client shared by every state in the process.
+
+    The server connection is waited for once, when the first goal is sent,
+    instead of in each state's constructor. Goals return NavGoal handles
+    straight away, and routes of several poses are pipelined with NavRoute.
+    move_base works on one goal at a time, so sending a goal replaces the
+    current one.
+    """
+
+    def __init__(self, action="move_base", global_frame="map"):
+        self.action = action
+        self.global_frame = global_frame
+        self.client = actionlib.SimpleActionClient(action, MoveBaseAction)
+        self.current = None
+        self._connected = False
+        self._lock = threading.RLock()
+
+    def connect(self, timeout=None):
+        """Wait for the action server (forever by default); True if connected."""
+        with self._lock:
+            if not self._connected:
+                self._connected = self.client.wait_for_server(
+                    rospy.Duration(timeout or 0)
+                )
+            return self._connected
+
+    def send(self, pose, frame="map"):
+        """Send a Pose in frame as the new goal and return its NavGoal."""
+        self.connect()
+        goal = NavGoal(self, pose, frame)
+        with self._lock:
+            previous, self.current = self.current, goal
+            self.client.send_goal(
+                goal.msg(),
+                done_cb=functools.partial(self._done_cb, goal),
+                feedback_cb=functools.partial(self._feedback_cb, goal),
+            )
+        if previous is not None:
+            previous._finish(
+                GoalStatus.SUCCEEDED if previous.handed_off else GoalStatus.PREEMPTED
+            )
+        return goal
+
+    def send_relative(self, position, orientation, frame):
+        return self.send(Pose(position, orientation), frame)
+
+    def follow_route(self, poses, frame="map", handoff_radius=NAV_HANDOFF_RADIUS):
+        """Start driving through poses in order and return the NavRoute."""
+        return NavRoute(self, poses, frame, handoff_radius).start()
+
+    def cancel(self, goal=None):
+        """Cancel goal, or whatever goal is current."""
+        with self._lock:
+            if goal is None or goal is self.current:
+                self.client.cancel_goal()
+
+    def _done_cb(self, goal, state, result):
+        goal._finish(state, result)
+
+    def _feedback_cb(self, goal, feedback):
+        position = feedback.base_position.pose.position
+        goal.position = (position.x, position.y)
+
+
+def get_nav_client(action="move_base"):
+    """Return the process-wide client for a move_base action server."""
+    with _clients_lock:
+        if action not in _clients:
+            _clients[action] = NavClient(action)
+        return _clients[action]
@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+"""Analysis of a map_server occupancy grid: clearance, costs and path lengths.
+
+The PGM is memory mapped. The clearance (Euclidean distance transform) and
+inflated cost layers are cached as .npy files next to the map, keyed by a
+hash of the map and the inflation settings, so later runs map them straight
+from disk.
+
+    ./occupancy_map.py                      # check WAYPOINT_MAP clearance
+    ./occupancy_map.py --map ../../comp3/data/map.yaml --waypoints w.npy
+"""
+import argparse
+import hashlib
+import heapq
+import math
+import os
+import threading
+
+import cv2
+import numpy as np
+import yaml
+
+from config_globals import (
+    MAP_COST_SCALING,
+    MAP_INFLATION_RADIUS,
+    MAP_ROBOT_RADIUS,
+    WAYPOINT_MAP,
+)
+from waypoint_db import WaypointDB
+
+_course_grid = None
+_course_grid_lock = threading.Lock()
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+except ImportError:
+    dijkstra = None
+
+MAP_YAML = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "data", "map.yaml"
+)
+
+# costmap_2d cell values
+FREE_SPACE = 0
+INSCRIBED_INFLATED_OBSTACLE = 253
+LETHAL_OBSTACLE = 254
+NO_INFORMATION = 255
+
+# 8-connected moves as (row, col, length in cells)
+NEIGHBOURS = [
+    (dr, dc, math.hypot(dr, dc))
+    for dr in (-1, 0, 1)
+    for dc in (-1, 0, 1)
+    if dr or dc
+]
+
+
+def read_pgm(path):
+    """Memory map a binary (P5) PGM as a (height, width) uint8 array."""
+    tokens = []
+    with open(path, "rb") as pgm:
+        while len(tokens) < 4:
+            line = pgm.readline()
+            if not line:
+                raise IOError("truncated PGM header in " + path)
+            tokens += line.split(b"#")[0].split()
+        offset = pgm.tell()
+    if tokens[0] != b"P5" or int(tokens[3]) > 255:
+        raise IOError("only 8 bit binary PGM maps are supported: " + path)
+    width, height = int(tokens[1]), int(tokens[2])
+    return np.memmap(
+        path, dtype=np.uint8, mode="r", offset=offset, shape=(height, width)
+    )
+
+
+class OccupancyGrid(object):
+    """A map_server map (YAML plus PGM) as NumPy arrays.
+
+    Row 0 of the arrays is the top of the image, which is the largest y in
+    the map frame, as map_server reads it. Cells that are not free (occupied
+    or unknown) count as obstacles for clearance.
+    """
+
+    def __init__(
+        self,
+        image,
+        resolution,
+        origin,
+        negate=0,
+        occupied_thresh=0.65,
+        free_thresh=0.196,
+        robot_radius=MAP_ROBOT_RADIUS,
+        inflation_radius=MAP_INFLATION_RADIUS,
+        cost_scaling=MAP_COST_SCALING,
+        cache_prefix=None,
+    ):
+        """
+        :param cache_prefix: path prefix for cached layers, or None to not cache
+        """
+        self.resolution = resolution
+        self.origin = origin
+        self.height, self.width = image.shape
+        occupancy = image / 255.0 if negate else (255 - image) / 255.0
+        self.free = occupancy < free_thresh
+        self.occupied = occupancy > occupied_thresh
+        self.robot_radius = robot_radius
+        self.inflation_radius = inflation_radius
+        self.cost_scaling = cost_scaling
+        self.cache_prefix = cache_prefix
+        self._clearance = None
+        self._cost = None
+        self._graph = None
+
+    @classmethod
+    def load(cls, yaml_path=MAP_YAML, cache=True, **kwargs):
+        with open(yaml_path, "rb") as yaml_file:
+            info_bytes = yaml_file.read()
+        info = yaml.safe_load(info_bytes)
+        image_path = os.path.join(os.path.dirname(yaml_path), info["image"])
+        image = read_pgm(image_path)
+
+        grid = cls(
+            image,
+            info["resolution"],
+            info["origin"],
+            info.get("negate", 0),
+            info.get("occupied_thresh", 0.65),
+            info.get("free_thresh", 0.196),
+            **kwargs
+        )
+        if cache:
+            key = hashlib.sha1(info_bytes)
+            key.update(np.ascontiguousarray(image).tobytes())
+            key.update(
+                repr(
+                    (grid.robot_radius, grid.inflation_radius, grid.cost_scaling)
+                ).encode("ascii")
+            )
+            grid.cache_prefix = "%s.%s" % (image_path, key.hexdigest()[:16])
+        return grid
+
+    def _cached(self, name, compute):
+        """Map a cached layer from disk, or compute it and try to cache it."""
+        if self.cache_prefix is None:
+            return compute()
+        path = "%s.%s.npy" % (self.cache_prefix, name)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode="r")
+        layer = compute()
+        temp_path = "%s.%s.%d.npy" % (self.cache_prefix, name, os.getpid())
+        try:
+            np.save(temp_path, layer)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            pass  # read only install: keep the layer in memory only
+        return layer
+
+    @property
+    def clearance(self):
+        """Metres from each free cell to the nearest non-free cell (0 if not free)."""
+        if self._clearance is None:
+            self._clearance = self._cached("clearance", self._compute_clearance)
+        return self._clearance
+
+    def _compute_clearance(self):
+        distances = cv2.distanceTransform(
+            self.free.astype(np.uint8), cv2.DIST_L2, cv2.DIST_MASK_PRECISE
+        )
+        return distances * np.float32(self.resolution)
+
+    @property
+    def cost(self):
+        """costmap_2d style inflated cost of each cell (0 to 255)."""
+        if self._cost is None:
+            self._cost = self._cached("cost", self._compute_cost)
+        return self._cost
+
+    def _compute_cost(self):
+        clearance = self.clearance
+        cost = np.full(self.free.shape, NO_INFORMATION, dtype=np.uint8)
+        cost[self.free] = FREE_SPACE
+        inflated = self.free & (clearance <= self.inflation_radius)
+        decay = np.exp(-self.cost_scaling * (clearance[inflated] - self.robot_radius))
+        cost[inflated] = (INSCRIBED_INFLATED_OBSTACLE - 1) * decay
+        cost[self.free & (clearance <= self.robot_radius)] = INSCRIBED_INFLATED_OBSTACLE
+        cost[self.occupied] = LETHAL_OBSTACLE
+        return cost
+
+    @property
+    def traversable(self):
+        """Cells the robot centre can be in without touching an obstacle."""
+        return self.clearance > self.robot_radius
+
+    def world_to_cell(self, x, y):
+        col = int(math.floor((x - self.origin[0]) / self.resolution))
+        row = self.height - 1 - int(math.floor((y - self.origin[1]) / self.resolution))
+        return row, col
+
+    def cell_to_world(self, row, col):
+        x = self.origin[0] + (col + 0.5) * self.resolution
+        y = self.origin[1] + (self.height - row - 0.5) * self.resolution
+        return x, y
+
+    def in_bounds(self, row, col):
+        return 0 <= row < self.height and 0 <= col < self.width
+
+    def clearance_at(self, x, y):
+        """Metres of clearance at a map point, 0 off the map."""
+        row, col = self.world_to_cell(x, y)
+        return float(self.clearance[row, col]) if self.in_bounds(row, col) else 0.0
+
+    def cost_at(self, x, y):
+        row, col = self.world_to_cell(x, y)
+        return int(self.cost[row, col]) if self.in_bounds(row, col) else NO_INFORMATION
+
+    def is_clear(self, x, y, radius=None):
+        """True if a circle of radius (the robot by default) at (x, y) is free."""
+        if radius is None:
+            radius = self.robot_radius
+        return self.clearance_at(x, y) > radius
+
+    def nearest_traversable(self, row, col):
+        """The traversable cell closest to (row, col), which may be the cell itself."""
+        traversable = self.traversable
+        if self.in_bounds(row, col) and traversable[row, col]:
+            return row, col
+        rows, cols = np.nonzero(traversable)
+        closest = np.argmin((rows - row) ** 2 + (cols - col) ** 2)
+        return int(rows[closest]), int(cols[closest])
+
+    def traversable_cell(self, x, y):
+        return self.nearest_traversable(*self.world_to_cell(x, y))
+
+    def path_lengths(self, sources, targets):
+        """Shortest 8-connected path lengths in metres through traversable cells.
+
+        sources and targets are lists of traversable (row, col) cells; the
+        result has one row per source and one column per target, inf where
+        unreachable.
+        """
+        if dijkstra is not None:
+            return self._path_lengths_scipy(sources, targets)
+        # Pad with a blocked border so neighbours never need a bounds check
+        traversable = np.pad(self.traversable, 1, mode="constant").ravel().tolist()
+        return np.array(
+            [
+                self._path_lengths_heap(traversable, source, targets)
+                for source in sources
+            ]
+        ).reshape(len(sources), len(targets))
+
+    def _path_lengths_heap(self, traversable, source, targets):
+        width = self.width + 2
+        steps = [(dr * width + dc, length) for dr, dc, length in NEIGHBOURS]
+
+        def index(cell):
+            return (cell[0] + 1) * width + cell[1] + 1
+
+        wanted = set(index(target) for target in targets)
+        settled = {}
+        queue = [(0.0, index(source))]
+        while queue and wanted:
+            distance, node = heapq.heappop(queue)
+            if node in settled:
+                continue
+            settled[node] = distance
+            wanted.discard(node)
+            for step, length in steps:
+                neighbour = node + step
+                if traversable[neighbour] and neighbour not in settled:
+                    heapq.heappush(queue, (distance + length, neighbour))
+
+        return [
+            settled.get(index(target), np.inf) * self.resolution for target in targets
+        ]
+
+    def _path_lengths_scipy(self, sources, targets):
+        graph, nodes = self.graph()
+        distances = dijkstra(
+            graph, indices=[nodes[source] for source in sources]
+        ).reshape(len(sources), -1)
+        columns = [nodes[target] for target in targets]
+        return distances[:, columns] * self.resolution
+
+    def graph(self):
+        """Sparse graph of traversable cells, and each cell's node (-1 if none)."""
+        if self._graph is None:
+            rows, cols = np.nonzero(self.traversable)
+            nodes = -np.ones(self.free.shape, dtype=int)
+            nodes[rows, cols] = np.arange(len(rows))
+            heads, tails, weights = [], [], []
+            for dr, dc, length in NEIGHBOURS:
+                r, c = rows + dr, cols + dc
+                inside = (r >= 0) & (r < self.height) & (c >= 0) & (c < self.width)
+                r, c = r[inside], c[inside]
+                neighbour = nodes[r, c]
+                linked = neighbour >= 0
+                heads.append(nodes[rows[inside], cols[inside]][linked])
+                tails.append(neighbour[linked])
+                weights.append(np.full(linked.sum(), length))
+            graph = csr_matrix(
+                (np.concatenate(weights), (np.concatenate(heads), np.concatenate(tails))),
+                shape=(len(rows), len(rows)),
+            )
+            self._graph = (graph, nodes)
+        return self._graph
+
+
+def get_course_grid():
+    """The comp4 course map, loaded on first use and shared by the planners."""
+    global _course_grid
+    with _course_grid_lock:
+        if _course_grid is None:
+            _course_grid = OccupancyGrid.load()
+        return _course_grid
+
+
+def check_waypoints(grid, waypoints, min_clearance=None):
+    """[(name, clearance)] for waypoints the robot would not fit at."""
+    if min_clearance is None:
+        min_clearance = grid.robot_radius
+    tight = []
+    for name in waypoints:
+        position = waypoints[name].position
+        clearance = grid.clearance_at(position.x, position.y)
+        if clearance <= min_clearance:
+            tight.append((name, clearance))
+    return tight
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--map", default=MAP_YAML, help="map_server YAML file")
+    parser.add_argument("--waypoints", help="waypoint store (default WAYPOINT_MAP)")
+    parser.add_argument(
+        "--min-clearance", type=float, help="metres (default the robot radius)"
+    )
+    args = parser.parse_args()
+
+    grid = OccupancyGrid.load(args.map)
+    waypoints = WaypointDB.load(args.waypoints) if args.waypoints else WAYPOINT_MAP
+    for name in waypoints:
+        position = waypoints[name].position
+        print(
+            "%-14s clearance %.2f m  cost %3d"
+            % (
+                name,
+                grid.clearance_at(position.x, position.y),
+                grid.cost_at(position.x, position.y),
+            )
+        )
+    tight = check_waypoints(grid, waypoints, args.min_clearance)
+    if tight:
+        print("Too close to an obstacle: " + ", ".join(name for name, _ in tight))
+
+
+if __name__ == "__main__":
+    main()
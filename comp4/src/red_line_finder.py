@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 from math import atan
-from image_processing import get_red_mask, lowest_object_coord
+from image_processing import get_frame, lowest_object_coord
+from latency_tracer import get_tracer
 import rospy, cv2, cv_bridge, numpy
 import numpy as np
 
@@ -12,30 +13,39 @@ from config_globals import *
 
 
 class RedLineFinder:
-    def __init__(self):
-        self.bridge = cv_bridge.CvBridge()
-        self.image_sub = rospy.Subscriber(
-            "usb_cam/image_raw", Image, self.image_callback
-        )
+    def __init__(self, subscribe=True):
         self.red_line_pub = rospy.Publisher(
             "red_line_distance", Centroid, queue_size="1"
         )
+        if subscribe:
+            self.image_sub = rospy.Subscriber(
+                "usb_cam/image_raw", Image, self.image_callback
+            )
+        self.tracer = get_tracer()
 
     def image_callback(self, msg):
-        mask = get_red_mask(msg)
-        cx, cy = lowest_object_coord(mask)
+        self.process(get_frame(msg))
+
+    def process(self, frame):
+        mask = frame.mask("red")
+        with self.tracer.timed("moments"):
+            cx, cy = lowest_object_coord(mask)
         height, width = mask.shape
 
         centroid_msg = Centroid()
         centroid_msg.cx = cx
         centroid_msg.cy = cy
         centroid_msg.err = cx - width / 2
+        centroid_msg.header.stamp = frame.msg.header.stamp
+        centroid_msg.header.frame_id = frame.msg.header.frame_id
 
         self.red_line_pub.publish(centroid_msg)
+        self.tracer.since("publish", frame.msg.header.stamp)
 
 
 if __name__ == "__main__":
     rospy.init_node("red_line_finder")
     follower = RedLineFinder()
+    get_tracer().start_reporting()
     rospy.spin()
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+import threading
+
+import numpy as np
+
+from config_globals import WAYPOINT_MAP
+from occupancy_map import get_course_grid
+
+_planner = None
+_planner_lock = threading.Lock()
+
+
+class RoutePlanner(object):
+    """Visiting orders for map waypoints, costed by path length on the map.
+
+    The travel cost between every pair of waypoints is worked out once, with
+    one shortest path search per waypoint over the map cells the robot fits
+    in. Orders are then an exact Held-Karp search over the spots to visit,
+    which is instant for the handful of spots a state ever considers.
+    """
+
+    def __init__(self, grid, waypoints):
+        """
+        :param grid: OccupancyGrid of the course
+        :param waypoints: mapping of name to Pose in the map frame
+        """
+        self.grid = grid
+        self.names = list(waypoints)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.cells = [
+            grid.traversable_cell(waypoints[name].position.x, waypoints[name].position.y)
+            for name in self.names
+        ]
+        self._costs = None
+
+    @property
+    def costs(self):
+        """(N, N) path lengths in metres between waypoints, in self.names order."""
+        if self._costs is None:
+            self._costs = self.grid.path_lengths(self.cells, self.cells)
+        return self._costs
+
+    def costs_from(self, start):
+        """Path length from start to every waypoint; start is a name or (x, y)."""
+        if start in self.index:
+            return self.costs[self.index[start]]
+        cell = self.grid.traversable_cell(*start)
+        return self.grid.path_lengths([cell], self.cells)[0]
+
+    def order(self, start, spots, probabilities=None):
+        """Order to visit spots from start in, minimising the expected distance.
+
+        probabilities[i] is the chance the search ends at spots[i] (what is
+        being looked for is there), so the legs after it are never driven.
+        Without probabilities every spot is visited and the order is the
+        shortest open tour.
+        """
+        count = len(spots)
+        if count == 0:
+            return []
+        indices = [self.index[spot] for spot in spots]
+        first_leg = self.costs_from(start)[indices]
+        legs = self.costs[np.ix_(indices, indices)]
+        if probabilities is None:
+            probabilities = np.zeros(count)
+
+        # remaining[visited] is the chance the search is still going after
+        # visiting that subset of spots, which weights the next leg.
+        remaining = [
+            1.0 - sum(p for i, p in enumerate(probabilities) if visited >> i & 1)
+            for visited in range(1 << count)
+        ]
+
+        best = {}
+        for i in range(count):
+            best[(1 << i, i)] = (first_leg[i], None)
+        for visited in range(1, 1 << count):
+            weight = remaining[visited]
+            for last in range(count):
+                if (visited, last) not in best:
+                    continue
+                cost = best[(visited, last)][0]
+                for spot in range(count):
+                    if visited >> spot & 1:
+                        continue
+                    key = (visited | 1 << spot, spot)
+                    total = cost + weight * legs[last, spot] if weight > 0 else cost
+                    if key not in best or total < best[key][0]:
+                        best[key] = (total, last)
+
+        visited = (1 << count) - 1
+        last = min(range(count), key=lambda i: best[(visited, i)][0])
+        route = []
+        while last is not None:
+            route.append(spots[last])
+            visited, last = visited & ~(1 << last), best[(visited, last)][1]
+        return route[::-1]
+
+    def best_next(self, start, spots, probabilities=None):
+        """The spot to drive to first, or None if there are none."""
+        route = self.order(start, spots, probabilities)
+        return route[0] if route else None
+
+
+def get_route_planner():
+    """The planner for the comp4 map and WAYPOINT_MAP, built on first use."""
+    global _planner
+    with _planner_lock:
+        if _planner is None:
+            _planner = RoutePlanner(get_course_grid(), WAYPOINT_MAP)
+        return _planner
+
+
+def pose_position(pose_msg):
+    """(x, y) of a PoseWithCovarianceStamped, e.g. from amcl_pose."""
+    position = pose_msg.pose.pose.position
+    return position.x, position.y
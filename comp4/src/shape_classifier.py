@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+import math
+import threading
+from collections import deque
+
+import rospy
+from sensor_msgs.msg import Image
+
+from config_globals import *
+
+CANDIDATE_SHAPES = [Shapes.square, Shapes.triangle, Shapes.circle]
+
+
+class ShapeClassifier(object):
+    """Vote on the shape in view from a persistent camera subscription.
+
+    The subscriber stays up for the life of the process. Frames are only
+    classified while a classify call is waiting, so there is no cost between
+    parking spots and no subscription setup when a study starts.
+
+    Each frame is one vote: the detected shape when exactly one shape is
+    seen, otherwise unknown. Every candidate shape runs its own sequential
+    probability ratio test ("this shape shows up with probability p_match"
+    against "only with probability p_other"), so a clear view is decided
+    after a handful of frames instead of a fixed sample count.
+    """
+
+    def __init__(self, mask_func, shape_func, topic):
+        self.mask_func = mask_func
+        self.shape_func = shape_func
+        self.topic = topic
+        self._votes = deque()
+        self._condition = threading.Condition()
+        self._listening = False
+        self.image_sub = rospy.Subscriber(
+            topic, Image, self.image_callback, queue_size=1, buff_size=2 ** 24
+        )
+
+    def image_callback(self, msg):
+        if not self._listening:
+            return
+        shapes = self.shape_func(self.mask_func(image=msg))
+        vote = shapes[0] if len(shapes) == 1 else Shapes.unknown
+        with self._condition:
+            self._votes.append(vote)
+            self._condition.notify_all()
+
+    def reset(self, window=None):
+        """Drop all votes; only the newest window votes are kept from now on."""
+        with self._condition:
+            self._votes = deque(maxlen=window)
+
+    def histogram(self):
+        """Return a dict of shape -> number of votes since the last reset."""
+        with self._condition:
+            votes = list(self._votes)
+        return dict((shape, votes.count(shape)) for shape in set(votes))
+
+    def log_likelihood_ratios(self, p_match, p_other):
+        """Return the SPRT statistic of every candidate shape and the vote count."""
+        with self._condition:
+            votes = list(self._votes)
+        hit = math.log(p_match / p_other)
+        miss = math.log((1 - p_match) / (1 - p_other))
+        ratios = {}
+        for shape in CANDIDATE_SHAPES:
+            hits = votes.count(shape)
+            ratios[shape] = hits * hit + (len(votes) - hits) * miss
+        return ratios, len(votes)
+
+    def decide(
+        self,
+        min_samples=SHAPE_SPRT_MIN_SAMPLES,
+        max_samples=100,
+        confidence=0.5,
+        fallback_samples=20,
+        p_match=SHAPE_SPRT_P_MATCH,
+        p_other=SHAPE_SPRT_P_OTHER,
+        error_rate=SHAPE_SPRT_ERROR_RATE,
+    ):
+        """Return a shape, Shapes.unknown, or None if the evidence is not in yet.
+
+        A shape is accepted once its test crosses the upper bound. A few
+        blurred frames are enough to reject every candidate, so that only
+        gives unknown from fallback_samples on. From there the old rule (vote
+        share above confidence) also decides, and max_samples votes without a
+        decision gives unknown.
+        """
+        ratios, sample_count = self.log_likelihood_ratios(p_match, p_other)
+        if sample_count < min_samples:
+            return None
+
+        accept = math.log((1 - error_rate) / error_rate)
+        reject = -accept
+        best_shape = max(ratios, key=ratios.get)
+        if ratios[best_shape] >= accept:
+            return best_shape
+        if sample_count < fallback_samples:
+            return None
+
+        counts = self.histogram()
+        for shape in CANDIDATE_SHAPES:
+            if float(counts.get(shape, 0)) / sample_count > confidence:
+                return shape
+        if all(ratio <= reject for ratio in ratios.values()):
+            return Shapes.unknown
+        if sample_count >= max_samples:
+            return Shapes.unknown
+        return None
+
+    def classify(
+        self, timeout=1.0, deadline=SHAPE_CLASSIFY_TIMEOUT, **decide_kwargs
+    ):
+        """Block until decide has an answer, starting from a fresh histogram.
+
+        Gives unknown if there is no answer within deadline seconds, such as
+        when the camera stops publishing.
+        """
+        self.reset(window=decide_kwargs.get("max_samples", 100))
+        self._listening = True
+        end = rospy.get_time() + deadline
+        try:
+            with self._condition:
+                while not rospy.is_shutdown():
+                    shape = self.decide(**decide_kwargs)
+                    if shape is not None:
+                        print("shape decided: " + str(shape))
+                        print(self.histogram())
+                        return shape
+                    remaining = end - rospy.get_time()
+                    if remaining <= 0:
+                        print("shape study timed out")
+                        break
+                    self._condition.wait(min(timeout, remaining))
+        finally:
+            self._listening = False
+        return Shapes.unknown
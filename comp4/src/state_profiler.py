@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""Per-state timing for smach state machines.
+
+    profiler = StateProfiler(output_dir, profile_states=["BOX_SURVEY"])
+    profiler.instrument(state_machine)
+    state_machine.execute()
+    profiler.close()
+
+Each execution of a top level state is logged with its entry and exit
+times, wall and CPU time and outcome. close() writes the run to
+output_dir as timeline.csv, one row per execution, and summary.yaml,
+totals per state and per lap, and logs the states that took the most
+time. States named in profile_states, or every state for "all", are also
+run under cProfile, one .prof file per execution, for pstats or snakeviz.
+
+CPU time is for the whole process, so it includes subscriber and other
+background threads running while the state does.
+"""
+import cProfile
+import csv
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import rospy
+import yaml
+
+from config_globals import STATE_PROFILE_DIR
+
+TIMELINE_FIELDS = ["lap", "state", "start", "end", "wall", "cpu", "outcome"]
+
+
+def cpu_time():
+    """User and system CPU seconds used by the process."""
+    times = os.times()
+    return times[0] + times[1]
+
+
+class StateProfiler(object):
+    """Records each execution of the states in a state machine."""
+
+    def __init__(self, output_dir, profile_states=(), lap_state=None):
+        """
+        :param profile_states: labels to run under cProfile, or "all"
+        :param lap_state: label whose every entry starts a new lap
+        """
+        self.output_dir = output_dir
+        self.profile_states = profile_states
+        self.lap_state = lap_state
+        self.lap = 0
+        self.timeline = []
+        self.start_time = time.time()
+        self._executions = {}  # label -> number of executions so far
+        self._lock = threading.Lock()
+
+    def instrument(self, state_machine):
+        """Wrap the execute method of each state in state_machine."""
+        for label, state in state_machine.get_children().items():
+            state.execute = self._wrap(label, state.execute)
+        return state_machine
+
+    def _profiled(self, label):
+        return self.profile_states == "all" or label in self.profile_states
+
+    def _wrap(self, label, execute):
+        def timed_execute(userdata):
+            with self._lock:
+                if label == self.lap_state:
+                    self.lap += 1
+                lap = self.lap
+                count = self._executions.get(label, 0) + 1
+                self._executions[label] = count
+
+            profile = cProfile.Profile() if self._profiled(label) else None
+            outcome = None
+            start, start_cpu = time.time(), cpu_time()
+            try:
+                if profile is None:
+                    outcome = execute(userdata)
+                else:
+                    outcome = profile.runcall(execute, userdata)
+                return outcome
+            finally:
+                end, end_cpu = time.time(), cpu_time()
+                with self._lock:
+                    self.timeline.append(
+                        OrderedDict(
+                            [
+                                ("lap", lap),
+                                ("state", label),
+                                ("start", round(start - self.start_time, 3)),
+                                ("end", round(end - self.start_time, 3)),
+                                ("wall", round(end - start, 3)),
+                                ("cpu", round(end_cpu - start_cpu, 3)),
+                                ("outcome", outcome),
+                            ]
+                        )
+                    )
+                if profile is not None:
+                    self._dump_profile(profile, "%s_%d.prof" % (label, count))
+
+        return timed_execute
+
+    def _dump_profile(self, profile, name):
+        try:
+            self._make_output_dir()
+            profile.dump_stats(os.path.join(self.output_dir, name))
+        except (IOError, OSError) as e:
+            rospy.logwarn("Could not write profile %s: %s" % (name, e))
+
+    def _make_output_dir(self):
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+    def summary(self):
+        """Totals per state, slowest first, and wall time per lap."""
+        with self._lock:
+            timeline = list(self.timeline)
+        states = {}
+        laps = OrderedDict()
+        for row in timeline:
+            totals = states.setdefault(
+                row["state"], {"count": 0, "wall": 0.0, "cpu": 0.0, "max_wall": 0.0}
+            )
+            totals["count"] += 1
+            totals["wall"] += row["wall"]
+            totals["cpu"] += row["cpu"]
+            totals["max_wall"] = max(totals["max_wall"], row["wall"])
+            laps[row["lap"]] = laps.get(row["lap"], 0.0) + row["wall"]
+
+        run_time = sum(laps.values())
+        by_wall = []
+        for state in sorted(states, key=lambda s: -states[s]["wall"]):
+            totals = states[state]
+            by_wall.append(
+                OrderedDict(
+                    [
+                        ("state", state),
+                        ("count", totals["count"]),
+                        ("wall", round(totals["wall"], 3)),
+                        ("mean_wall", round(totals["wall"] / totals["count"], 3)),
+                        ("max_wall", round(totals["max_wall"], 3)),
+                        ("cpu", round(totals["cpu"], 3)),
+                        ("share", round(totals["wall"] / run_time, 3) if run_time else 0.0),
+                    ]
+                )
+            )
+        return OrderedDict(
+            [
+                ("run_time", round(run_time, 3)),
+                ("laps", dict((lap, round(wall, 3)) for lap, wall in laps.items())),
+                ("states", by_wall),
+            ]
+        )
+
+    def report(self, top=5):
+        """Lines naming the states that took the most wall time."""
+        summary = self.summary()
+        lines = ["State times for %.1f s run:" % summary["run_time"]]
+        for totals in summary["states"][:top]:
+            lines.append(
+                "  %-20s %7.1f s %4.0f%%  %3d runs  max %5.1f s  cpu %5.1f s"
+                % (
+                    totals["state"],
+                    totals["wall"],
+                    totals["share"] * 100,
+                    totals["count"],
+                    totals["max_wall"],
+                    totals["cpu"],
+                )
+            )
+        return lines
+
+    def close(self):
+        """Write timeline.csv and summary.yaml and log the slowest states."""
+        try:
+            self._make_output_dir()
+            with self._lock:
+                timeline = list(self.timeline)
+            with open(os.path.join(self.output_dir, "timeline.csv"), "w") as f:
+                writer = csv.DictWriter(f, TIMELINE_FIELDS)
+                writer.writeheader()
+                writer.writerows(timeline)
+            with open(os.path.join(self.output_dir, "summary.yaml"), "w") as f:
+                yaml.safe_dump(yaml_safe(self.summary()), f, default_flow_style=False)
+        except (IOError, OSError) as e:
+            rospy.logwarn("Could not write state profile: %s" % e)
+        for line in self.report():
+            rospy.loginfo(line)
+
+
+def yaml_safe(value):
+    """Turn OrderedDicts into dicts, which safe_dump can write."""
+    if isinstance(value, dict):
+        return dict((key, yaml_safe(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [yaml_safe(item) for item in value]
+    return value
+
+
+def from_params(default_dir=STATE_PROFILE_DIR):
+    """StateProfiler configured from ~profile params, or None if disabled.
+
+    ~profile turns timing on, ~profile_states is a list of state labels (or
+    "all") to run under cProfile and ~profile_lap_state names the state
+    that starts each lap. Output goes to a new directory for each run under
+    ~profile_dir.
+    """
+    if not rospy.get_param("~profile", False):
+        return None
+    output_dir = os.path.join(
+        os.path.expanduser(rospy.get_param("~profile_dir", default_dir)),
+        "%s_%s"
+        % (
+            rospy.get_name().strip("/").replace("/", "_"),
+            time.strftime("%Y-%m-%d_%H-%M-%S"),
+        ),
+    )
+    return StateProfiler(
+        output_dir,
+        profile_states=rospy.get_param("~profile_states", []),
+        lap_state=rospy.get_param("~profile_lap_state", "") or None,
+    )
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+import threading
+from collections import defaultdict
+
+import numpy as np
+import rospy
+import tf2_ros
+from tf.transformations import quaternion_matrix
+
+_service = None
+_service_lock = threading.Lock()
+
+
+class _Listener(tf2_ros.TransformListener):
+    """TransformListener that reports the child frames of each message."""
+
+    def __init__(self, buffer, on_update):
+        self.on_update = on_update
+        tf2_ros.TransformListener.__init__(self, buffer)
+
+    def callback(self, data):
+        tf2_ros.TransformListener.callback(self, data)
+        self.on_update(data.transforms)
+
+    def static_callback(self, data):
+        tf2_ros.TransformListener.static_callback(self, data)
+        self.on_update(data.transforms)
+
+
+class TfService(object):
+    """One tf2 buffer for the whole process, with cached latest lookups.
+
+    The result of a latest (time 0) lookup is kept along with the chain of
+    frames it went through, and dropped as soon as a transform for any of
+    those frames comes in. Frames that rarely move, such as the box sides
+    in the map, are then a dictionary lookup instead of a buffer walk.
+
+    lookupTransform matches tf.TransformListener, so this can be passed
+    anywhere a listener is used for lookups.
+    """
+
+    def __init__(self, cache_time=10.0):
+        self.buffer = tf2_ros.Buffer(rospy.Duration(cache_time))
+        self._lock = threading.Lock()
+        self._cache = {}  # (target, source) -> (translation, rotation)
+        self._dependents = defaultdict(set)  # frame -> cached (target, source)
+        self._updates = 0
+        self._frame_updates = {}  # frame -> value of _updates when last set
+        self.listener = _Listener(self.buffer, self._invalidate)
+
+    def _invalidate(self, transforms):
+        with self._lock:
+            for transform in transforms:
+                frame = transform.child_frame_id.lstrip("/")
+                self._updates += 1
+                self._frame_updates[frame] = self._updates
+                for key in self._dependents.pop(frame, ()):
+                    self._cache.pop(key, None)
+
+    def _chain(self, target, source):
+        """Frames the transform from source to target goes through, or None."""
+        try:
+            return self.buffer._chain(target, rospy.Time(0), source, rospy.Time(0), target)
+        except (tf2_ros.TransformException, AttributeError):
+            return None
+
+    def lookup(self, target, source, time=None):
+        """(translation, rotation) lists of source in target, as tf returns.
+
+        Raises the tf2 (and so tf) Lookup, Connectivity and Extrapolation
+        exceptions like a TransformListener.
+        """
+        target, source = target.lstrip("/"), source.lstrip("/")
+        latest = time is None or time.is_zero()
+        key = (target, source)
+        if latest:
+            with self._lock:
+                cached = self._cache.get(key)
+                updates = self._updates
+            if cached is not None:
+                return list(cached[0]), list(cached[1])
+
+        transform = self.buffer.lookup_transform(
+            target, source, rospy.Time(0) if latest else time
+        ).transform
+        result = (
+            [transform.translation.x, transform.translation.y, transform.translation.z],
+            [
+                transform.rotation.x,
+                transform.rotation.y,
+                transform.rotation.z,
+                transform.rotation.w,
+            ],
+        )
+        if latest:
+            self._store(key, result, updates)
+        return list(result[0]), list(result[1])
+
+    def _store(self, key, result, updates):
+        chain = self._chain(*key)
+        if not chain:
+            return
+        with self._lock:
+            # A transform on the chain that came in during the lookup may or
+            # may not be in the result, so it is not safe to keep
+            if any(self._frame_updates.get(frame, 0) > updates for frame in chain):
+                return
+            self._cache[key] = result
+            for frame in chain:
+                self._dependents[frame].add(key)
+
+    def lookupTransform(self, target, source, time):
+        return self.lookup(target, source, time)
+
+    def lookup_many(self, target, sources, time=None):
+        """Look up several frames in target at once.
+
+        Returns (N, 3) translations, (N, 4) rotations and an (N,) mask of the
+        frames that were found; rows for the others are NaN.
+        """
+        translations = np.full((len(sources), 3), np.nan)
+        rotations = np.full((len(sources), 4), np.nan)
+        found = np.zeros(len(sources), dtype=bool)
+        for i, source in enumerate(sources):
+            try:
+                translations[i], rotations[i] = self.lookup(target, source, time)
+            except tf2_ros.TransformException:
+                continue
+            found[i] = True
+        return translations, rotations, found
+
+    def transform_points(self, target, source, points, time=None):
+        """Transform an (N, 3) array of points in source into target."""
+        translation, rotation = self.lookup(target, source, time)
+        target_from_source = quaternion_matrix(rotation)[:3, :3]
+        return np.asarray(points, dtype=float).dot(target_from_source.T) + translation
+
+
+def get_tf_service():
+    """Return the process-wide TfService, created on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TfService()
+        return _service
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+import threading
+
+import rospy
+
+# Messages at most this old (seconds) are replayed to a new subscribe() route
+REPLAY_AGE = 0.1
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class TopicRoute(object):
+    """A callback attached to a TopicCache, in place of a rospy.Subscriber."""
+
+    def __init__(self, cache, callback):
+        self.cache = cache
+        self.callback = callback
+
+    def unregister(self):
+        """Stop routing messages to the callback; the subscription stays up."""
+        self.cache.remove_route(self)
+
+
+class TopicCache(object):
+    """Hold the latest message on a topic from one long-lived subscriber.
+
+    Waiting on the cache costs nothing but a condition variable, unlike
+    rospy.wait_for_message which sets up and tears down a subscriber (and its
+    connection) on every call.
+
+    States attach callbacks as routes while they run, so entering or leaving
+    a state never touches the subscription itself.
+    """
+
+    def __init__(self, topic, msg_type):
+        self.topic = topic
+        self.msg_type = msg_type
+        self._condition = threading.Condition()
+        self._dispatch_lock = threading.RLock()
+        self._latest = None
+        self._received = None
+        self._count = 0
+        self._routes = ()
+        self.sub = rospy.Subscriber(topic, msg_type, self.callback, queue_size=1)
+
+    def callback(self, msg):
+        with self._dispatch_lock:
+            with self._condition:
+                self._latest = msg
+                self._received = rospy.get_time()
+                self._count += 1
+                self._condition.notify_all()
+            for route in self._routes:
+                route.callback(msg)
+
+    def add_route(self, callback, replay_age=REPLAY_AGE):
+        """Call callback with every message from now on until unregistered.
+
+        The latest message is passed on straight away if it arrived in the
+        last replay_age seconds (never if None), as a fresh subscriber would
+        otherwise wait for it.
+        """
+        route = TopicRoute(self, callback)
+        with self._dispatch_lock:
+            self._routes += (route,)
+            if (
+                replay_age is not None
+                and self._latest is not None
+                and rospy.get_time() - self._received <= replay_age
+            ):
+                callback(self._latest)
+        return route
+
+    def remove_route(self, route):
+        with self._dispatch_lock:
+            self._routes = tuple(other for other in self._routes if other is not route)
+
+    def latest(self):
+        """Return the newest message without blocking, or None if none yet."""
+        return self._latest
+
+    def _wait(self, ready, timeout):
+        deadline = None if timeout is None else rospy.get_time() + timeout
+        with self._condition:
+            while not ready():
+                if rospy.is_shutdown():
+                    raise rospy.ROSInterruptException("rospy shutdown")
+                remaining = 0.1
+                if deadline is not None:
+                    remaining = min(remaining, deadline - rospy.get_time())
+                    if remaining <= 0:
+                        raise rospy.ROSException(
+                            "timeout exceeded while waiting for message on topic %s"
+                            % self.topic
+                        )
+                self._condition.wait(remaining)
+            return self._latest
+
+    def wait_for_next(self, timeout=None):
+        """Block until a message arrives after this call and return it."""
+        with self._condition:
+            count = self._count
+        return self._wait(lambda: self._count > count, timeout)
+
+    def wait_for_newer(self, stamp, timeout=None):
+        """Block until the latest message is stamped after stamp and return it.
+
+        Returns straight away if the cached message is already newer.
+        """
+        return self._wait(
+            lambda: self._latest is not None and self._latest.header.stamp > stamp,
+            timeout,
+        )
+
+
+def get_topic_cache(topic, msg_type):
+    """Return the process-wide cache for a topic, subscribing on first use."""
+    name = rospy.resolve_name(topic)
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TopicCache(topic, msg_type)
+        return _caches[name]
+
+
+def subscribe(topic, msg_type, callback, replay_age=REPLAY_AGE):
+    """Drop-in replacement for rospy.Subscriber backed by a TopicCache.
+
+    Returns a TopicRoute; its unregister() detaches the callback but keeps
+    the subscription for the next state that needs the topic.
+    """
+    return get_topic_cache(topic, msg_type).add_route(callback, replay_age)
+
+
+def wait_for_message(topic, msg_type, timeout=None):
+    """Drop-in replacement for rospy.wait_for_message backed by a TopicCache."""
+    return get_topic_cache(topic, msg_type).wait_for_next(timeout)
+
+
+def latest_message(topic, msg_type):
+    """Return the newest message on topic, or None if nothing has arrived."""
+    return get_topic_cache(topic, msg_type).latest()
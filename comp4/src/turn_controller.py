@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import math
+
+import rospy
+from geometry_msgs.msg import Twist
+from nav_msgs.msg import Odometry
+
+from config_globals import *
+from topic_cache import get_topic_cache
+
+
+def wrap_angle(angle):
+    """Wrap an angle in degrees into [-180, 180)."""
+    return (angle + 180.0) % 360.0 - 180.0
+
+
+def odom_heading(odom):
+    """Yaw of an Odometry message in degrees."""
+    q = odom.pose.pose.orientation
+    return math.degrees(
+        math.atan2(2.0 * (q.w * q.z + q.x * q.y), 1.0 - 2.0 * (q.y * q.y + q.z * q.z))
+    )
+
+
+class TurnController(object):
+    """Turn in place by a relative angle with a closed, fixed rate loop.
+
+    The commanded yaw rate follows a trapezoidal profile: it ramps up at
+    max_accel, is capped at max_speed, and is held under sqrt(2 * a * error)
+    so the robot can always brake before the target. Inside that envelope a
+    PD term on the heading error does the final approach. The turn ends once
+    the error and the measured yaw rate have both stayed small for a few
+    cycles, instead of when the robot first crosses the tolerance.
+
+    Odometry comes from the shared topic cache, so there is no subscriber
+    setup per turn or per loop iteration.
+    """
+
+    def __init__(
+        self,
+        twist_pub,
+        max_speed=TURN_MAX_SPEED,
+        max_accel=TURN_MAX_ACCEL,
+        kp=TURN_KP,
+        kd=TURN_KD,
+        min_speed=TURN_MIN_SPEED,
+        rate_hz=TURN_RATE_HZ,
+    ):
+        self.twist_pub = twist_pub
+        self.max_speed = max_speed
+        self.max_accel = max_accel
+        self.kp = kp
+        self.kd = kd
+        self.min_speed = min_speed
+        self.rate_hz = rate_hz
+        self.odom = get_topic_cache("odom", Odometry)
+
+    def latest_odom(self):
+        odom = self.odom.latest()
+        if odom is None:
+            odom = self.odom.wait_for_next()
+        return odom
+
+    def heading(self):
+        return odom_heading(self.latest_odom())
+
+    def turn(
+        self,
+        angle,
+        tolerance=TURN_TOLERANCE,
+        settle_speed=TURN_SETTLE_SPEED,
+        settle_cycles=TURN_SETTLE_CYCLES,
+        timeout=TURN_TIMEOUT,
+    ):
+        """Turn by angle degrees (positive is counter clockwise).
+
+        Returns True once settled on the target, False on timeout or shutdown.
+        """
+        target = wrap_angle(self.heading() + angle)
+        return self.turn_to(target, tolerance, settle_speed, settle_cycles, timeout)
+
+    def turn_to(
+        self,
+        target,
+        tolerance=TURN_TOLERANCE,
+        settle_speed=TURN_SETTLE_SPEED,
+        settle_cycles=TURN_SETTLE_CYCLES,
+        timeout=TURN_TIMEOUT,
+    ):
+        """Turn to an absolute odom heading in degrees."""
+        rate = rospy.Rate(self.rate_hz)
+        dt = 1.0 / self.rate_hz
+        deadline = rospy.get_time() + timeout
+        command = 0.0
+        prev_error = None
+        settled = 0
+
+        while not rospy.is_shutdown() and rospy.get_time() < deadline:
+            odom = self.latest_odom()
+            error = math.radians(wrap_angle(target - odom_heading(odom)))
+            yaw_rate = odom.twist.twist.angular.z
+
+            if abs(error) < math.radians(tolerance) and abs(yaw_rate) < settle_speed:
+                settled += 1
+                if settled >= settle_cycles:
+                    self.twist_pub.publish(Twist())
+                    return True
+            else:
+                settled = 0
+
+            derivative = 0.0 if prev_error is None else (error - prev_error) / dt
+            prev_error = error
+            pd = self.kp * error + self.kd * derivative
+
+            envelope = min(self.max_speed, math.sqrt(2 * self.max_accel * abs(error)))
+            desired = max(-envelope, min(envelope, pd))
+            if abs(error) >= math.radians(tolerance) and abs(desired) < self.min_speed:
+                desired = math.copysign(self.min_speed, error)
+
+            step = self.max_accel * dt
+            command = max(command - step, min(command + step, desired))
+
+            twist = Twist()
+            twist.angular.z = command
+            self.twist_pub.publish(twist)
+            rate.sleep()
+
+        self.twist_pub.publish(Twist())
+        return False
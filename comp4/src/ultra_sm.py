@@ -1,17 +1,22 @@
 #!/usr/bin/env python
 import general_states
 import rospy
-import smach
 import smach_ros
 
-from location1 import Detect1
-from location2 import DriveToObjects, DriveFromObjects, Detect2
-from location3 import Detect3
-from location4 import DriverRamp, BoxSurvey, TagScan1, TagScan2, Push, OnRamp, ShapeScan
-
-from general_states import Driver, Advancer, AtLine, Turn
+from ar_track_alvar_msgs.msg import AlvarMarkers
+from comp2.msg import Centroid
+from config_globals import COURSE_FILE, MARKER_POSE_TOPIC
+from course_compiler import load_course
 from geometry_msgs.msg import Twist
 from kobuki_msgs.msg import Led, Sound
+from nav_msgs.msg import Odometry
+from latency_tracer import get_tracer
+from lazy_state import warm_up
+from nav_client import get_nav_client
+from route_planner import get_route_planner
+from state_profiler import from_params as state_profiler_from_params
+from tf_service import get_tf_service
+from topic_cache import get_topic_cache
 from time import time
 
 
@@ -20,20 +25,15 @@ def main():
     if rospy.has_param("~initial_line"):
         initial_line = rospy.get_param("~initial_line")
 
-    after_box_scan = "PUSH"
+    options = []
     if rospy.get_param("~skip_push"):
-        after_box_scan = "ON_RAMP"
-
-    print after_box_scan
+        options.append("skip_push")
+    course = load_course(rospy.get_param("~course", COURSE_FILE), options)
+    for label in course.unreachable:
+        rospy.logwarn("%s is unreachable in this course" % label)
 
     sound_pub = rospy.Publisher("/mobile_base/commands/sound", Sound, queue_size=1)
 
-    state_machine = smach.StateMachine(outcomes=["complete", "exit"])
-    state_introspection_server = smach_ros.IntrospectionServer(
-        "server_name", state_machine, "/SM_ROOT"
-    )
-    state_introspection_server.start()
-
     cmd_vel_pub = rospy.Publisher("cmd_vel", Twist, queue_size=1)
 
     light_pubs = []
@@ -41,178 +41,56 @@ def main():
     light_pubs.append(rospy.Publisher("/mobile_base/commands/led2", Led, queue_size=1))
 
     rate = rospy.Rate(10)
+    get_tracer().start_reporting()
+
+    # States route these topics through the topic cache while they run; the
+    # subscriptions are made once here and kept for the whole run
+    for topic, msg_type in [
+        ("red_line_distance", Centroid),
+        ("white_line_centroid", Centroid),
+        ("white_line_ramp_centroid", Centroid),
+        (MARKER_POSE_TOPIC, AlvarMarkers),
+        ("odom", Odometry),
+    ]:
+        get_topic_cache(topic, msg_type)
+
+    # Location 4 states are lazy in the course, so they are built on first
+    # entry or in the background below
+    state_machine, lazy_states = course.build(
+        {
+            "rate": rate,
+            "cmd_vel_pub": cmd_vel_pub,
+            "sound_pub": sound_pub,
+            "light_pubs": light_pubs,
+            "initial_line": initial_line,
+        }
+    )
+    state_introspection_server = smach_ros.IntrospectionServer(
+        "server_name", state_machine, "/SM_ROOT"
+    )
+    state_introspection_server.start()
 
-    with state_machine:
-        smach.StateMachine.add(
-            "DRIVE",
-            Driver(rate, cmd_vel_pub, sound_pub),
-            transitions={"advance": "ADVANCE", "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "ADVANCE",
-            Advancer(rate, cmd_vel_pub),
-            transitions={"at_line": "AT_LINE", "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "AT_LINE",
-            AtLine(rate, light_pubs=light_pubs, sound_pub=sound_pub, initial_line=initial_line),
-            transitions={
-                "drive": "DRIVE",
-                "turn_left_1": "TURN_LEFT_1",
-                "turn_left_2_start": "TURN_LEFT_2_START",
-                "turn_left_2_end": "TURN_LEFT_2_END",
-                "off_ramp": "OFF_RAMP",
-                "turn_left_3_1": "TURN_LEFT_3_1",
-                "turn_left_3_2": "TURN_LEFT_3_2",
-                "turn_left_3_3": "TURN_LEFT_3_3",
-                "exit": "exit",
-            },
-        )
-
-        #63
-        smach.StateMachine.add(
-            "TURN_LEFT_1",
-            Turn(cmd_vel_pub, 60, "detect1"),
-            transitions={"detect1": "DETECT1"},
-        )
-
-        smach.StateMachine.add(
-            "DETECT1",
-            Detect1(rate, sound_pub, light_pubs),
-            transitions={"turn_right": "TURN_RIGHT_1", "exit": "exit"},
-        )
-
-        # -84
-        smach.StateMachine.add(
-            "TURN_RIGHT_1",
-            Turn(cmd_vel_pub, -60, "drive"),
-            transitions={"drive": "DRIVE"},
-        )
-
-        smach.StateMachine.add(
-            "TURN_LEFT_2_START",
-            Turn(cmd_vel_pub, 64, "drive_to_objects"),
-            transitions={"drive_to_objects": "DRIVE_TO_OBJECTS"},
-        )
-
-        smach.StateMachine.add(
-            "DRIVE_TO_OBJECTS",
-            DriveToObjects(rate, cmd_vel_pub),
-            transitions={"detect2": "DETECT2", "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "DETECT2",
-            Detect2(rate, sound_pub, light_pubs),
-            transitions={"turn_180": "TURN_180", "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "TURN_180",
-            Turn(cmd_vel_pub, 130, "drive_from_objects"),
-            transitions={"drive_from_objects": "DRIVE_FROM_OBJECTS"},
-        )
-
-        smach.StateMachine.add(
-            "DRIVE_FROM_OBJECTS",
-            DriveFromObjects(rate, cmd_vel_pub),
-            transitions={"advance": "ADVANCE", "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "TURN_LEFT_2_END",
-            Turn(cmd_vel_pub, 43, "drive"),
-            transitions={"drive": "DRIVE"},
-        )
-
-        smach.StateMachine.add(
-            "OFF_RAMP",
-            DriverRamp(rate, cmd_vel_pub),
-            transitions={"start": "SHAPE_SCAN", "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "SHAPE_SCAN",
-            ShapeScan(rate, cmd_vel_pub, light_pubs, sound_pub),
-            transitions={"done": "BOX_SURVEY", "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "BOX_SURVEY",
-            BoxSurvey(rate, cmd_vel_pub, light_pubs, sound_pub),
-            transitions={"tag_scan_1": "TAG_SCAN_1", "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "TAG_SCAN_1",
-            TagScan1(rate, cmd_vel_pub, light_pubs, sound_pub),
-            transitions={"tag_scan_2": "TAG_SCAN_2", "found_tag": after_box_scan, "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "TAG_SCAN_2",
-            TagScan2(rate, cmd_vel_pub, light_pubs, sound_pub),
-            transitions={"tag_scan_1": "TAG_SCAN_1", "found_tag": after_box_scan, "exit": "exit"},
-        )
-
-        smach.StateMachine.add(
-            "PUSH",
-            Push(rate, cmd_vel_pub, light_pubs, sound_pub),
-            transitions={"on_ramp": "ON_RAMP", "exit": "exit"},
-        )
-
-        smach.StateMachine.add("ON_RAMP", OnRamp(rate), transitions={"drive": "DRIVE"})
-    
-        smach.StateMachine.add(
-            "TURN_LEFT_3_1",
-            Turn(cmd_vel_pub, 65, "detect3"),
-            transitions={"detect3": "DETECT3"},
-        )
-
-        smach.StateMachine.add(
-            "TURN_RIGHT_3_1",
-            Turn(cmd_vel_pub, -68, "drive"),
-            transitions={"drive": "DRIVE"},
-        )
-
-        smach.StateMachine.add(
-            "TURN_LEFT_3_2",
-            Turn(cmd_vel_pub, 70, "detect3"),
-            transitions={"detect3": "DETECT3"},
-        )
-
-        smach.StateMachine.add(
-            "TURN_RIGHT_3_2",
-            Turn(cmd_vel_pub, -70, "drive"),
-            transitions={"drive": "DRIVE"},
-        )
-
-        smach.StateMachine.add(
-            "TURN_LEFT_3_3",
-            Turn(cmd_vel_pub, 73, "detect3"),
-            transitions={"detect3": "DETECT3"},
-        )
-
-        smach.StateMachine.add(
-            "TURN_RIGHT_3_3",
-            Turn(cmd_vel_pub, -69, "drive"),
-            transitions={"drive": "DRIVE"},
-        )
-
-        smach.StateMachine.add(
-            "DETECT3",
-            Detect3(rate, cmd_vel_pub, sound_pub, light_pubs),
-            transitions={
-                "turn_right_3_1": "TURN_RIGHT_3_1",
-                "turn_right_3_2": "TURN_RIGHT_3_2",
-                "turn_right_3_3": "TURN_RIGHT_3_3",
-                "exit": "exit",
-            },
-        )
-
-    state_machine.execute()
+    if rospy.get_param("~warm_up", True):
+        # Each dependency gets its own thread, so startup waits on the slowest
+        warm_up(
+            [
+                get_nav_client().connect,
+                get_tf_service,
+                lambda: get_route_planner().costs,
+            ]
+            + [state.build for state in lazy_states]
+        )
+
+    # With ~profile set, time every state (see state_profiler.py)
+    profiler = state_profiler_from_params()
+    if profiler is not None:
+        profiler.instrument(state_machine)
+
+    try:
+        state_machine.execute()
+    finally:
+        if profiler is not None:
+            profiler.close()
     state_introspection_server.stop()
 
 
@@ -1,9 +1,8 @@
-import actionlib
 import rospy
 import smach
 
-from move_base_msgs.msg import MoveBaseAction, MoveBaseGoal
 from geometry_msgs.msg import Twist
+from nav_client import get_nav_client
 
 
 class DriveState(smach.State):
@@ -19,12 +18,21 @@ class DriveState(smach.State):
 
 
 class NavState(smach.State):
-    """A state that uses the nav stack to control the robot."""
+    """A state that uses the nav stack to control the robot.
 
-    def __init__(self, outcomes):
-        smach.State.__init__(self, outcomes=outcomes)
-        self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
-        self.client.wait_for_server()
+    Goals go through the process-wide NavClient, so states share one
+    move_base connection and nothing blocks on it at construction. With a
+    short hop driver (see grid_planner), map goals close by are driven to
+    without move_base, which is still used for everything else and whenever
+    the driver declines or fails a goal.
+    """
+
+    def __init__(self, outcomes, input_keys=[], output_keys=[], short_hops=None):
+        smach.State.__init__(
+            self, outcomes=outcomes, input_keys=input_keys, output_keys=output_keys
+        )
+        self.nav = get_nav_client()
+        self.short_hops = short_hops
 
     def execute(self, userdata):
         raise NotImplementedError()
@@ -34,11 +42,35 @@ class NavState(smach.State):
 
         :param positin: <Point> A position relative to the relative_frame coord frame
         :param orientation: <Quaternion> Orientation relative to relative_frame
+        :returns: the NavGoal, finished if block is True
         """
-        goal = MoveBaseGoal()
-        goal.target_pose.header.frame_id = relative_frame
-        goal.target_pose.pose.position = position
-        goal.target_pose.pose.orientation = orientation
-        self.client.send_goal(goal)
+        goal = self.nav.send_relative(position, orientation, relative_frame)
         if block:
-            self.client.wait_for_result()
+            goal.wait()
+        return goal
+
+    def move_to_map_pose(self, pose, block=True):
+        """Navigate to a Pose in the map frame.
+
+        Returns whether a blocking move reached the goal, or the NavGoal of
+        a non-blocking one.
+        """
+        if block and self.short_hops is not None and self.short_hops.drive_to(pose):
+            return True
+        goal = self.nav.send(pose, "map")
+        if not block:
+            return goal
+        goal.wait()
+        return goal.succeeded()
+
+    def move_through_map_poses(self, poses, block=True):
+        """Drive through poses without stopping at each one (see NavRoute).
+
+        Returns whether a blocking route reached the last pose, or the
+        NavRoute.
+        """
+        route = self.nav.follow_route(poses, "map")
+        if not block:
+            return route
+        route.wait()
+        return route.succeeded()
@@ -6,9 +6,12 @@ from geometry_msgs.msg import Twist
 from nav_msgs.msg import Odometry
 from rospy import ROSException
 from ros_numpy import numpify
-from tf.transformations import decompose_matrix, quaternion_from_euler
-import tf
+from tf.transformations import decompose_matrix
 from kobuki_msgs.msg import Led
+from box_geometry import BoxSideBroadcaster
+from topic_cache import wait_for_message
+from turn_controller import TurnController, wrap_angle
+from config_globals import *
 
 
 def interpolate_map(value, orig_1, orig_2, map_1, map_2):
@@ -31,18 +34,32 @@ def extract_angle(pose):
 
 
 def wait_for_odom_angle(timeout=None):
-    odom = rospy.wait_for_message("odom", Odometry, timeout=timeout)
+    odom = wait_for_message("odom", Odometry, timeout=timeout)
     pose = numpify(odom.pose.pose)
     _, _, angles, _, _ = decompose_matrix(pose)
     theta = angles[2] * 180 / 3.14159
     return theta
 
 
-def simple_turn(angle, twist_pub, max_error=10, angular_scale=2.2):
-    """"""
+def simple_turn(angle, twist_pub, max_error=None, angular_scale=TURN_MAX_SPEED):
+    """Turn by angle degrees at angular_scale rad/s.
+
+    By default this is the original open loop turn, which stops once within
+    max_error (10) degrees and lets momentum carry the rest; the course turn
+    angles are tuned for that. With TURN_USE_CONTROLLER set, the turn settles
+    on the target within max_error (TURN_TOLERANCE) using TurnController.
+    """
+    if TURN_USE_CONTROLLER:
+        TurnController(twist_pub, max_speed=angular_scale).turn(
+            angle, tolerance=TURN_TOLERANCE if max_error is None else max_error
+        )
+        return
+
+    if max_error is None:
+        max_error = 10
     theta = wait_for_odom_angle()
     direction = np.sign(angle)
-    target_theta = standardize_theta(theta + angle)
+    target_theta = wrap_angle(theta + angle)
 
     while abs(target_theta - theta) > max_error:
         out_twist = Twist()
@@ -90,63 +107,6 @@ def angle_ramp(desired_angle, current_angle, scale=0.3, ramp_denominator=90):
     return rotation_direction * rotation_ramp * scale
 
 
-def standardize_theta(angle):
-    target_theta = angle
-    if angle >= 180:
-        target_theta = angle % 360 - 360
-    if angle < -180:
-        target_theta = angle % -360 + 360
-    return target_theta
-
-
-def broadcast_box_sides(
-    br,
-    listen,
-    relative_frame_name,
-    box_frame_prefix="box",
-    side_offset_from_middle=0.7,
-    middle_offset_from_relative=(0, 0, -0.23),
-    relative_rotation=(0, 0, 1, 0),
-    global_frame="map"
-):
-    # Publish a frame to the middle, relative to some other frame
-    br.sendTransform(
-        middle_offset_from_relative,
-        relative_rotation,
-        rospy.Time.now(),
-        box_frame_prefix + "_middle",
-        relative_frame_name,
-    )
-
-    try:
-        box_trans, box_rot = listen.lookupTransform(
-            global_frame, box_frame_prefix + "_middle", rospy.Time(0)
-        )
-
-        # Find the sides of the box
-        front_trans = map(sum, zip(box_trans, (-side_offset_from_middle, 0, 0.010)))
-        back_trans = map(sum, zip(box_trans, (side_offset_from_middle, 0, 0.010)))
-        right_trans = map(sum, zip(box_trans, (0.38, -side_offset_from_middle, 0.010)))
-        left_trans = map(sum, zip(box_trans, (0.02, side_offset_from_middle, 0.010)))
-        # Publish frames to the sides of the box relative to odom
-        br.sendTransform(
-            front_trans, (0, 0, 0, 1), rospy.Time.now(), "box_front", global_frame
-        )
-        br.sendTransform(back_trans, (0, 0, 1, 0), rospy.Time.now(), "box_back", global_frame)
-        br.sendTransform(
-            right_trans,
-            quaternion_from_euler(0, 0, 110 * (3.14159 / 180)),   #(0, 0, 0.70710678, 0.70710678),
-            rospy.Time.now(),
-            "box_right",
-            global_frame,
-        )
-        br.sendTransform(
-            left_trans,
-            (0, 0, -0.70710678, 0.70710678),
-            rospy.Time.now(),
-            "box_left",
-            global_frame,
-        )
-    except tf.ExtrapolationException as e:
-        print(e)
-        pass
+def box_side_broadcaster(listen):
+    """Broadcaster for the box_middle and box side frames, relative to map."""
+    return BoxSideBroadcaster(listen, BOX_SIDES, global_frame="map")
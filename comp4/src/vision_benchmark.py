@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+"""Benchmark the comp4 vision pipeline offline, without a ROS master.
+
+Frames come from a directory of images, a rosbag, or are drawn
+synthetically. Every stage is timed per frame and reported as frames per
+second with p50/p99 latency. On Python 3 a second pass uses tracemalloc
+to record, per frame, the net allocations (blocks still alive after the
+call) and the peak bytes allocated.
+
+    ./vision_benchmark.py --images ../../TurtlebotPhotos
+    ./vision_benchmark.py --bag run.bag --topic /usb_cam/image_raw --json out.json
+    ./vision_benchmark.py --synthetic 200 --baseline out.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import cv2
+import cv_bridge
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from frame_cache import FrameCache
+from image_processing import (
+    COLOR_SPECS,
+    SEGMENTER,
+    WHITE_LINE_ROI,
+    count_objects,
+    detect_shape,
+    hsv_bound,
+    lowest_object_coord,
+    right_most_object_coord,
+    threshold_hsv_360,
+)
+from red_line_finder import RedLineFinder
+from white_line_ramp import WhiteLineRampTracker
+from white_line_tracker import WhiteLineTracker
+from config_globals import *
+
+FRAME_SIZE = (640, 480)
+
+
+class NullPublisher(object):
+    """Stands in for a rospy.Publisher so detectors run without a node."""
+
+    def __init__(self):
+        self.count = 0
+
+    def publish(self, msg):
+        self.count += 1
+
+
+def load_image_dir(path, limit):
+    names = sorted(
+        name
+        for pattern in ("*.png", "*.jpg", "*.JPG", "*.jpeg", "*.bmp")
+        for name in glob.glob(os.path.join(path, pattern))
+    )[:limit]
+    return [cv2.resize(cv2.imread(name), FRAME_SIZE) for name in names]
+
+
+def load_bag(path, topic, limit):
+    import rosbag
+
+    bridge = cv_bridge.CvBridge()
+    frames = []
+    with rosbag.Bag(path) as bag:
+        for _, msg, _ in bag.read_messages(topics=[topic]):
+            frames.append(bridge.imgmsg_to_cv2(msg, desired_encoding="bgr8"))
+            if len(frames) >= limit:
+                break
+    return frames
+
+
+def synthetic_frames(count, seed=0):
+    """Draw course-like frames: a white line, a red stop line and some shapes."""
+    random = np.random.RandomState(seed)
+    frames = []
+    for _ in range(count):
+        image = np.full((FRAME_SIZE[1], FRAME_SIZE[0], 3), 90, np.uint8)
+        image += random.randint(0, 20, image.shape).astype(np.uint8)
+        x = random.randint(200, 440)
+        cv2.line(
+            image, (x, 480), (x + random.randint(-80, 80), 250), (255, 255, 255), 30
+        )
+        y = random.randint(260, 470)
+        cv2.rectangle(image, (0, y), (640, y + 25), (0, 0, 220), -1)
+        for _ in range(random.randint(1, 4)):
+            cx, cy = random.randint(60, 580), random.randint(40, 220)
+            color = (0, 0, 220) if random.rand() < 0.5 else (40, 200, 40)
+            kind = random.randint(3)
+            if kind == 0:
+                cv2.circle(image, (cx, cy), 30, color, -1)
+            elif kind == 1:
+                cv2.rectangle(image, (cx - 30, cy - 30), (cx + 30, cy + 30), color, -1)
+            else:
+                points = np.array(
+                    [[cx, cy - 35], [cx - 35, cy + 30], [cx + 35, cy + 30]]
+                )
+                cv2.fillPoly(image, [points], color)
+        frames.append(image)
+    return frames
+
+
+def to_messages(frames):
+    bridge = cv_bridge.CvBridge()
+    messages = []
+    for seq, image in enumerate(frames):
+        msg = bridge.cv2_to_imgmsg(image, encoding="bgr8")
+        msg.header.seq = seq + 1
+        msg.header.stamp.secs = seq + 1
+        messages.append(msg)
+    return messages
+
+
+def build_cases(frames):
+    """Return (name, setup, run) triples.
+
+    setup(frame_index) prepares inputs outside the timed region and returns
+    the argument passed to run.
+    """
+    hsvs = [cv2.cvtColor(image, cv2.COLOR_BGR2HSV) for image in frames]
+    red_masks = [hsv_bound(hsv, RED_UPPER, RED_LOWER, 3, 6) for hsv in hsvs]
+    white_masks = [
+        hsv_bound(hsv, WHITE_UPPER, WHITE_LOWER, 2, 6, roi=WHITE_LINE_ROI)
+        for hsv in hsvs
+    ]
+    messages = to_messages(frames)
+
+    trackers = []
+    for tracker_class, attribute in (
+        (WhiteLineTracker, "centroid_pub"),
+        (WhiteLineRampTracker, "ramp_centroid_pub"),
+        (RedLineFinder, "red_line_pub"),
+    ):
+        tracker = tracker_class(subscribe=False)
+        setattr(tracker, attribute, NullPublisher())
+        trackers.append(tracker)
+
+    def run_server(msg):
+        frame = FrameCache(SEGMENTER).get(msg)
+        for tracker in trackers:
+            tracker.process(frame)
+
+    return [
+        (
+            "cvtColor BGR2HSV",
+            lambda i: frames[i],
+            lambda image: cv2.cvtColor(image, cv2.COLOR_BGR2HSV),
+        ),
+        (
+            "threshold_hsv_360 (red)",
+            lambda i: hsvs[i],
+            lambda hsv: threshold_hsv_360(
+                hsv,
+                RED_UPPER[0],
+                RED_LOWER[0],
+                RED_UPPER[1],
+                RED_LOWER[1],
+                RED_UPPER[2],
+                RED_LOWER[2],
+                3,
+                6,
+            ),
+        ),
+        (
+            "ColorSegmenter (%d colors)" % len(COLOR_SPECS),
+            lambda i: hsvs[i],
+            lambda hsv: SEGMENTER.segment(hsv),
+        ),
+        ("detect_shape (red)", lambda i: red_masks[i], lambda mask: detect_shape(mask)),
+        (
+            "count_objects (red)",
+            lambda i: red_masks[i],
+            lambda mask: count_objects(mask),
+        ),
+        (
+            "lowest_object_coord (red)",
+            lambda i: red_masks[i],
+            lambda mask: lowest_object_coord(mask),
+        ),
+        (
+            "right_most_object_coord (white band)",
+            lambda i: white_masks[i],
+            lambda mask: right_most_object_coord(mask),
+        ),
+        ("vision server, all plugins", lambda i: messages[i], run_server),
+    ]
+
+
+def time_case(setup, run, count, repeat):
+    latencies = []
+    for _ in range(repeat):
+        for index in range(count):
+            arg = setup(index)
+            start = time.time()
+            run(arg)
+            latencies.append(time.time() - start)
+    return np.array(latencies)
+
+
+def trace_case(setup, run, count):
+    """Return (allocations, peak bytes) per frame, or (None, None)."""
+    if tracemalloc is None:
+        return None, None
+    allocations = []
+    peaks = []
+    tracemalloc.start()
+    for index in range(count):
+        arg = setup(index)
+        before = tracemalloc.take_snapshot()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        run(arg)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        allocations.append(
+            sum(max(0, stat.count_diff) for stat in after.compare_to(before, "lineno"))
+        )
+        peaks.append(max(0, peak - base))
+    tracemalloc.stop()
+    return float(np.mean(allocations)), float(np.mean(peaks))
+
+
+def run_benchmarks(frames, repeat, trace):
+    results = OrderedDict()
+    for name, setup, run in build_cases(frames):
+        run(setup(0))  # warm up
+        latencies = time_case(setup, run, len(frames), repeat)
+        allocations, peak = (
+            trace_case(setup, run, len(frames)) if trace else (None, None)
+        )
+        results[name] = {
+            "fps": 1.0 / latencies.mean(),
+            "p50_ms": 1000 * np.percentile(latencies, 50),
+            "p99_ms": 1000 * np.percentile(latencies, 99),
+            "allocations": allocations,
+            "peak_kib": None if peak is None else peak / 1024.0,
+        }
+    return results
+
+
+def print_results(results, baseline=None):
+    header = "%-38s %9s %9s %9s %8s %9s" % (
+        "stage",
+        "fps",
+        "p50 ms",
+        "p99 ms",
+        "allocs",
+        "peak KiB",
+    )
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        allocations = (
+            "-" if result["allocations"] is None else "%.0f" % result["allocations"]
+        )
+        peak = "-" if result["peak_kib"] is None else "%.0f" % result["peak_kib"]
+        line = "%-38s %9.1f %9.2f %9.2f %8s %9s" % (
+            name,
+            result["fps"],
+            result["p50_ms"],
+            result["p99_ms"],
+            allocations,
+            peak,
+        )
+        if baseline and name in baseline:
+            change = result["p50_ms"] / baseline[name]["p50_ms"] - 1
+            line += "  %+.0f%%" % (100 * change)
+        print(line)
+
+
+def regressions(results, baseline, tolerance):
+    return [
+        name
+        for name, result in results.items()
+        if name in baseline
+        and result["p50_ms"] > baseline[name]["p50_ms"] * (1 + tolerance)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="directory of images")
+    source.add_argument("--bag", help="rosbag with camera images")
+    source.add_argument("--synthetic", type=int, help="number of frames to draw")
+    parser.add_argument(
+        "--topic", default="/usb_cam/image_raw", help="image topic in the bag"
+    )
+    parser.add_argument("--limit", type=int, default=300, help="maximum frames to load")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="timed passes over the frames"
+    )
+    parser.add_argument(
+        "--no-trace", action="store_true", help="skip the allocation pass"
+    )
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against a previous --json file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed p50 slowdown against the baseline before failing",
+    )
+    args = parser.parse_args()
+
+    if args.images:
+        frames = load_image_dir(args.images, args.limit)
+    elif args.bag:
+        frames = load_bag(args.bag, args.topic, args.limit)
+    else:
+        frames = synthetic_frames(min(args.synthetic, args.limit))
+    if not frames:
+        sys.exit("no frames loaded")
+    print("%d frames of %dx%d" % (len(frames), frames[0].shape[1], frames[0].shape[0]))
+
+    results = run_benchmarks(frames, args.repeat, not args.no_trace)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+
+    if baseline:
+        slower = regressions(results, baseline, args.tolerance)
+        if slower:
+            sys.exit("slower than baseline: " + ", ".join(slower))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+import rospy
+
+from sensor_msgs.msg import Image
+
+from image_processing import get_frame
+from latency_tracer import get_tracer
+from red_line_finder import RedLineFinder
+from white_line_ramp import WhiteLineRampTracker
+from white_line_tracker import WhiteLineTracker
+
+# Detectors that can run inside the server, by name. Each one takes
+# subscribe=False and exposes process(frame), publishing on its usual topic.
+PLUGINS = {
+    "white_line": WhiteLineTracker,
+    "white_line_ramp": WhiteLineRampTracker,
+    "red_line": RedLineFinder,
+}
+DEFAULT_PLUGINS = ["white_line", "white_line_ramp", "red_line"]
+
+
+class VisionServer:
+    """Subscribe to the camera once and run every detector on the same frame.
+
+    All plugins share the decoded image, HSV conversion and color labels
+    through the frame cache, so each frame is deserialised and converted once.
+    """
+
+    def __init__(self, plugin_names=DEFAULT_PLUGINS, image_topic="usb_cam/image_raw"):
+        self.plugins = [PLUGINS[name](subscribe=False) for name in plugin_names]
+        # Only ever work on the newest frame; the large buffer stops rospy
+        # from queueing partial images behind a slow callback.
+        self.image_sub = rospy.Subscriber(
+            image_topic, Image, self.image_callback, queue_size=1, buff_size=2 ** 24
+        )
+
+    def image_callback(self, msg):
+        frame = get_frame(msg)
+        for plugin in self.plugins:
+            plugin.process(frame)
+
+
+if __name__ == "__main__":
+    rospy.init_node("vision_server")
+    server = VisionServer(
+        plugin_names=rospy.get_param("~plugins", DEFAULT_PLUGINS),
+        image_topic=rospy.get_param("~image_topic", "usb_cam/image_raw"),
+    )
+    get_tracer().start_reporting()
+    rospy.spin()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""Named map waypoints stored as a NumPy structured array.
+
+The store is a .npy file of (name, position, orientation) records that is
+memory mapped on load, with a spatial index over the x, y positions for
+nearest and within-radius queries. Text files with one "x,y,z;qx,qy,qz,qw"
+waypoint per line, as written by waypoint_finder, can be compiled into the
+same format; a line may start with a name, as in the --dump output.
+
+    ./waypoint_db.py --dump waypoints.npy
+    ./waypoint_db.py --compile waypoints_active.txt waypoints_active.npy
+"""
+import argparse
+import os
+
+import numpy as np
+from geometry_msgs.msg import Point, Pose, Quaternion
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+WAYPOINT_DTYPE = np.dtype(
+    [("name", "S24"), ("position", "<f8", (3,)), ("orientation", "<f8", (4,))]
+)
+
+
+def _name(raw):
+    return raw.decode("ascii") if isinstance(raw, bytes) else raw
+
+
+class WaypointDB(Mapping):
+    """Read-only mapping of waypoint name to Pose, with spatial queries.
+
+    Each lookup builds a new Pose, so callers are free to modify what they
+    get back without changing the store.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.positions = np.asarray(records["position"])
+        self.orientations = np.asarray(records["orientation"])
+        self.names = [_name(raw) for raw in records["name"]]
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.tree = cKDTree(self.positions[:, :2]) if cKDTree and len(self) else None
+
+    @classmethod
+    def from_poses(cls, poses):
+        """Build a store from {name: Pose}, keeping the iteration order."""
+        records = np.zeros(len(poses), dtype=WAYPOINT_DTYPE)
+        for i, (name, pose) in enumerate(poses.items()):
+            records[i]["name"] = name.encode("ascii")
+            records[i]["position"] = (pose.position.x, pose.position.y, pose.position.z)
+            records[i]["orientation"] = (
+                pose.orientation.x,
+                pose.orientation.y,
+                pose.orientation.z,
+                pose.orientation.w,
+            )
+        return cls(records)
+
+    @classmethod
+    def from_text(cls, path):
+        """Compile a text file; unnamed waypoints are named by their index."""
+        with open(path) as waypoint_file:
+            lines = [line.split() for line in waypoint_file.read().splitlines()]
+        lines = [fields for fields in lines if fields]
+        records = np.zeros(len(lines), dtype=WAYPOINT_DTYPE)
+        for i, fields in enumerate(lines):
+            name = fields[0] if len(fields) > 1 else str(i)
+            translation, orientation = fields[-1].split(";")
+            records[i]["name"] = name.encode("ascii")
+            records[i]["position"] = [float(axis) for axis in translation.split(",")]
+            records[i]["orientation"] = [float(axis) for axis in orientation.split(",")]
+        return cls(records)
+
+    @classmethod
+    def load(cls, path):
+        """Memory map a .npy store, or compile a text file."""
+        if path.endswith(".npy"):
+            return cls(np.load(path, mmap_mode="r"))
+        return cls.from_text(path)
+
+    def save(self, path):
+        np.save(path, np.asarray(self.records, dtype=WAYPOINT_DTYPE))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        return self.pose_at(self.index[name])
+
+    def pose_at(self, i):
+        return Pose(
+            Point(*self.positions[i].tolist()),
+            Quaternion(*self.orientations[i].tolist()),
+        )
+
+    def nearest(self, x, y, k=1, candidates=None):
+        """Names of the k waypoints closest to (x, y) in the plane, closest first.
+
+        candidates limits the search to some waypoint names.
+        """
+        if candidates is not None:
+            indices = np.array([self.index[name] for name in candidates], dtype=int)
+            distances = np.hypot(*(self.positions[indices, :2] - (x, y)).T)
+            order = indices[np.argsort(distances, kind="mergesort")[:k]]
+        elif self.tree is not None:
+            _, order = self.tree.query((x, y), k=min(k, len(self)))
+            order = np.atleast_1d(order)
+        else:
+            distances = np.hypot(*(self.positions[:, :2] - (x, y)).T)
+            order = np.argsort(distances, kind="mergesort")[:k]
+        return [self.names[i] for i in order]
+
+    def within(self, x, y, radius):
+        """Names of every waypoint within radius metres of (x, y)."""
+        if self.tree is not None:
+            indices = sorted(self.tree.query_ball_point((x, y), radius))
+        else:
+            distances = np.hypot(*(self.positions[:, :2] - (x, y)).T)
+            indices = np.flatnonzero(distances <= radius)
+        return [self.names[i] for i in indices]
+
+
+class LazyWaypointMap(Mapping):
+    """A WaypointDB that only maps its file the first time it is used."""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = WaypointDB.load(self.path)
+        return self._db
+
+    def __len__(self):
+        return len(self.db)
+
+    def __iter__(self):
+        return iter(self.db)
+
+    def __contains__(self, name):
+        return name in self.db
+
+    def __getitem__(self, name):
+        return self.db[name]
+
+    def nearest(self, x, y, k=1, candidates=None):
+        return self.db.nearest(x, y, k, candidates)
+
+    def within(self, x, y, radius):
+        return self.db.within(x, y, radius)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--dump", metavar="STORE", help="print a store as text")
+    action.add_argument(
+        "--compile",
+        nargs=2,
+        metavar=("TEXT", "STORE"),
+        help="compile a waypoint_finder text file into a .npy store",
+    )
+    args = parser.parse_args()
+
+    if args.dump:
+        db = WaypointDB.load(args.dump)
+        for name, position, orientation in zip(db.names, db.positions, db.orientations):
+            print(
+                "%-14s %s;%s"
+                % (
+                    name,
+                    ",".join(repr(float(v)) for v in position),
+                    ",".join(repr(float(v)) for v in orientation),
+                )
+            )
+    else:
+        text, store = args.compile
+        WaypointDB.from_text(text).save(store)
+        print("Wrote %s" % os.path.abspath(store))
+
+
+if __name__ == "__main__":
+    main()
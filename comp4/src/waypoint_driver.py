@@ -7,9 +7,9 @@ from geometry_msgs.msg import (
     Point,
     Quaternion,
 )
-from ast import literal_eval
 import actionlib
 from move_base_msgs.msg import MoveBaseAction, MoveBaseGoal
+from waypoint_db import WaypointDB
 
 WAYPOINT_FILE_NAME = "waypoints_active.txt"
 
@@ -17,27 +17,14 @@ if __name__ == "__main__":
     rospy.init_node("Waypoint driver")
     pose_pub = rospy.Publisher("initialpose", PoseWithCovarianceStamped, queue_size=1)
 
-    # Load waypointfile
-    with open(WAYPOINT_FILE_NAME, "r") as waypointfile:
-        waypoints = waypointfile.read().splitlines()
-
+    # Load the waypoints, a .npy store or a waypoint_finder text file
+    waypoints = WaypointDB.load(WAYPOINT_FILE_NAME)
+    waypoint_objects = [
+        (pose.position, pose.orientation) for pose in waypoints.values()
+    ]
     print("\n".join(waypoints))
     print()
 
-    # Convert the waypoints to a list of position, oritinations
-    waypoint_objects = []
-    for waypoint in waypoints:
-        translation_str, orientation_str = tuple(waypoint.split(";"))
-        print([float(axis) for axis in translation_str.split(",")], orientation_str)
-
-        waypoint_objects.append(
-            (
-                Point(*[float(axis) for axis in translation_str.split(",")]),
-                Quaternion(*[float(axis) for axis in orientation_str.split(",")]),
-            )
-        )
-    print(waypoints)
-
     # Send the first on as the initial position
     rospy.loginfo("Sending initial pose...")
     initial_pose_cov_stamp = PoseWithCovarianceStamped()
@@ -7,6 +7,8 @@ from time import sleep
 import datetime
 import os
 
+from waypoint_db import WaypointDB
+
 TEMP_FILE_NAME = "temp_file"
 FILE_NAME_PREFIX = "waypoints"
 FILE_NAME_SUFFIX = ".txt"
@@ -52,3 +54,4 @@ if __name__ == "__main__":
     )
     print("Writing to " + filename)
     os.rename(TEMP_FILE_NAME, filename)
+    WaypointDB.from_text(filename).save(filename[: -len(FILE_NAME_SUFFIX)] + ".npy")
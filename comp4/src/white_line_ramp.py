@@ -8,43 +8,49 @@ from sensor_msgs.msg import Image
 
 from image_processing import (
     right_most_object_coord,
-    hsv_bound,
-    WHITE_UPPER,
-    WHITE_LOWER,
+    get_frame,
+    WHITE_LINE_ROI,
 )
+from latency_tracer import get_tracer
 
 class WhiteLineRampTracker:
-    def __init__(self):
-        self.bridge = cv_bridge.CvBridge()
-        self.image_sub = rospy.Subscriber(
-            "usb_cam/image_raw", Image, self.image_callback
-        )
+    def __init__(self, subscribe=True):
         self.ramp_centroid_pub = rospy.Publisher(
             "white_line_ramp_centroid", Centroid, queue_size="1"
         )
+        if subscribe:
+            self.image_sub = rospy.Subscriber(
+                "usb_cam/image_raw", Image, self.image_callback
+            )
+        self.tracer = get_tracer()
 
     def image_callback(self, msg):
-        image = self.bridge.imgmsg_to_cv2(msg, desired_encoding="bgr8")
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        mask = hsv_bound(hsv, WHITE_UPPER, WHITE_LOWER, denoise=2, fill=6)
+        self.process(get_frame(msg))
 
-        h, w, d = image.shape
-        search_top = h * 0.6
-        search_bot = search_top + 200
-        mask[0:search_top, 0:w] = 0
-        mask[search_bot:h, 0:w] = 0
+    def process(self, frame):
+        region = frame.region(WHITE_LINE_ROI)
+        h, w, d = frame.shape
 
-        cx, cy = right_most_object_coord(mask)
+        mask = region.mask("white_line")
+        with self.tracer.timed("moments"):
+            cx, cy = right_most_object_coord(mask)
+        if cx != -1:
+            cx, cy = region.to_full(cx, cy)
 
         centroid_msg = Centroid()
         centroid_msg.cx = cx
         centroid_msg.cy = cy
         centroid_msg.err = cx - w / 2
+        centroid_msg.header.stamp = frame.msg.header.stamp
+        centroid_msg.header.frame_id = frame.msg.header.frame_id
 
         self.ramp_centroid_pub.publish(centroid_msg)
+        self.tracer.since("publish", frame.msg.header.stamp)
 
 
-rospy.init_node("white_line_ramp")
-follower = WhiteLineRampTracker()
-rospy.spin()
+if __name__ == "__main__":
+    rospy.init_node("white_line_ramp")
+    follower = WhiteLineRampTracker()
+    get_tracer().start_reporting()
+    rospy.spin()
 
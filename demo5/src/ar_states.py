@@ -12,6 +12,7 @@ from geometry_msgs.msg import Twist, Point, Quaternion
 from sensor_msgs.msg import Joy
 from move_base_msgs.msg import MoveBaseAction, MoveBaseGoal
 from kobuki_msgs.msg import Led
+from marker_tracker import MarkerTracker
 
 START_POSITION = (Point(0.000, 0.000, 0.010), Quaternion(0.000, 0.000, 0.000, 1.000))
 MARKER_POSE_TOPIC = "ar_pose_marker"
@@ -41,19 +42,20 @@ class Survey(smach.State):
                                    output_keys=["target_marker"])
         self.pub_node = pub_node
         self.target_marker = None
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
+        self.tracker = MarkerTracker(confirm_hits=4)
 
     def execute(self, userdata):
         self.target_marker = None
+        self.tracker.reset()
         rate = rospy.Rate(10)
         ar_sub = rospy.Subscriber(
-            MARKER_POSE_TOPIC, AlvarMarkers, self.ar_callback, queue_size=1
+            MARKER_POSE_TOPIC, AlvarMarkers, self.tracker.update, queue_size=1
         )
         
         while not rospy.is_shutdown():
 
-            if self.target_marker and self.target_repetitions >= 3 and -0.3 < self.target_marker.pose.pose.position.y and self.target_marker.pose.pose.position.y < 0.3:
+            self.target_marker = self.centred_target()
+            if self.target_marker:
                 userdata.target_marker = self.target_marker
                 ar_sub.unregister()
                 return "approach"
@@ -64,22 +66,13 @@ class Survey(smach.State):
             self.pub_node.publish(twist_msg)
             rate.sleep()
 
-    def ar_callback(self, msg):
-        if not msg.markers:
-            self.ar_focus_id = -1
-            self.target_repetitions = 0
-            return 
-
-        for marker in msg.markers:
-            if marker.id == self.ar_focus_id:
-                self.target_repetitions = self.target_repetitions + 1
-            else:
-                self.ar_focus_id = marker.id
-                self.target_repetitions = 0
-        
-            if marker.id not in TAGS_VISITED:
-                self.target_marker = marker
-                break
+    def centred_target(self):
+        """A confirmed, unvisited marker roughly straight ahead, or None."""
+        for marker_id in self.tracker.confirmed():
+            marker = self.tracker.marker(marker_id)
+            if marker_id not in TAGS_VISITED and -0.3 < marker.pose.pose.position.y < 0.3:
+                return marker
+        return None
 
                 
 class Approach(smach.State):
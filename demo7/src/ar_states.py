@@ -14,7 +14,9 @@ from sensor_msgs.msg import Joy
 from move_base_msgs.msg import MoveBaseAction, MoveBaseGoal
 from kobuki_msgs.msg import Led, BumperEvent
 from nav_msgs.msg import Odometry
-from utils import wait_for_odom_angle, broadcast_box_sides, extract_angle
+from marker_tracker import MarkerTracker
+from topic_cache import wait_for_message
+from utils import wait_for_odom_angle, box_side_broadcaster, extract_angle
 
 MIDCAM_AR_TOPIC = "ar_pose_marker_mid"
 TOPCAM_AR_TOPIC = "ar_pose_marker_top"
@@ -72,8 +74,7 @@ class FindTargetLogitech(FindTarget):
 class FindTargetAuto(FindTarget):
     def __init__(self, rate, pub_node):
         super(FindTargetAuto, self).__init__(rate, pub_node)
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
+        self.tracker = MarkerTracker(confirm_hits=4)
         self.target_marker = None
         self.target_marker_frame = None
         self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
@@ -90,6 +91,8 @@ class FindTargetAuto(FindTarget):
         # self.client.send_goal(survey_pose)
         # self.client.wait_for_result()
 
+        self.tracker.reset()
+        self.found_target = False
         ar_sub = rospy.Subscriber(
             MIDCAM_AR_TOPIC, AlvarMarkers, self.ar_callback, queue_size=1
         )
@@ -117,11 +120,13 @@ class FindTargetAuto(FindTarget):
         g_target_location.orientation = Quaternion(*rot) 
 
     def found_the_target(self):
-        return (
-            self.target_marker
-            and self.target_repetitions >= 3
-            and -0.6 < self.target_marker.pose.pose.position.y < 0.666
-        )
+        for marker_id in self.tracker.confirmed():
+            marker = self.tracker.marker(marker_id)
+            if -0.6 < marker.pose.pose.position.y < 0.666:
+                self.target_marker = marker
+                self.target_marker_frame = "ar_marker_" + str(marker_id)
+                return True
+        return False
 
     def spin_a_bit(self):
         curr_theta = wait_for_odom_angle()
@@ -162,22 +167,11 @@ class FindTargetAuto(FindTarget):
         self.client.wait_for_result()
 
     def ar_callback(self, msg):
-        # if not self.found_target:
-        if not msg.markers:
-            self.ar_focus_id = -1
-            self.target_repetitions = 0
-            return
-
-        for marker in msg.markers:
-            if marker.id == self.ar_focus_id:
-                self.target_repetitions = self.target_repetitions + 1
-            else:
-                self.ar_focus_id = marker.id
-                self.target_repetitions = 0
-
-            self.target_marker = marker
-            self.target_marker_frame = "ar_marker_" + str(marker.id)
-            break
+        self.tracker.update(msg)
+        if self.found_target:
+            marker = self.tracker.marker(self.target_marker.id)
+            if marker is not None:
+                self.target_marker = marker
 
 
 class DriveToStart(smach.State):
@@ -206,8 +200,7 @@ class Survey(smach.State):
         self.pub_node = pub_node
         self.rate = rate
         self.box_marker = None
-        self.ar_focus_id = -1
-        self.target_repetitions = 0
+        self.tracker = MarkerTracker(confirm_hits=4)
         self.scan_direction = 1
         self.disable_change_direction = 1
         self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
@@ -215,9 +208,10 @@ class Survey(smach.State):
 
     def execute(self, userdata):
         self.box_marker = None
+        self.tracker.reset()
         rate = rospy.Rate(10)
         ar_sub = rospy.Subscriber(
-            MIDCAM_AR_TOPIC, AlvarMarkers, self.ar_callback, queue_size=1
+            MIDCAM_AR_TOPIC, AlvarMarkers, self.tracker.update, queue_size=1
         )
 
         print("Look back")
@@ -283,29 +277,12 @@ class Survey(smach.State):
         self.client.wait_for_result()
 
     def box_found(self):
-        return (
-            self.box_marker
-            and self.target_repetitions >= 3
-            and -0.6 < self.box_marker.pose.pose.position.y < 0.6
-        )
-
-    def ar_callback(self, msg):
-        if not msg.markers:
-            self.ar_focus_id = -1
-            self.target_repetitions = 0
-            return
-
-        for marker in msg.markers:
-            if marker.id == self.ar_focus_id:
-                self.target_repetitions = self.target_repetitions + 1
-                print("The marker", self.target_repetitions)
-            else:
-                print("Not the marker", self.target_repetitions)
-                self.ar_focus_id = marker.id
-                self.target_repetitions = 0
-
-            self.box_marker = marker
-            break
+        for marker_id in self.tracker.confirmed():
+            marker = self.tracker.marker(marker_id)
+            if -0.6 < marker.pose.pose.position.y < 0.6:
+                self.box_marker = marker
+                return True
+        return False
 
 
 class ApproachParallel(smach.State):
@@ -317,7 +294,7 @@ class ApproachParallel(smach.State):
         self.box_marker_id = None
         self.box_marker_frame = None
         self.listen = tf.TransformListener()
-        self.br = tf.TransformBroadcaster()
+        self.box_sides = box_side_broadcaster(self.listen)
         self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
         self.client.wait_for_server()
         self.waiting_for_ar = True
@@ -348,7 +325,7 @@ class ApproachParallel(smach.State):
     def ar_callback(self, msg):
         for m in msg.markers:
             if m.id ==  self.box_marker_id:
-                broadcast_box_sides(self.br, self.listen, "ar_marker_" + str(m.id))
+                self.box_sides.update("ar_marker_" + str(m.id))
                 self.waiting_for_ar = False
                 return
 
@@ -368,7 +345,7 @@ class PushParallel(smach.State):
 
     def execute(self, userdata):
         odom_sub = rospy.Subscriber("odom", Odometry, self.odom_callback)
-        rospy.wait_for_message("odom", Odometry)
+        wait_for_message("odom", Odometry)
 
         twist = Twist()
         twist.linear.x = 0.3
@@ -411,7 +388,7 @@ class ApproachPerpendicular(smach.State):
         self.box_marker_frame = None
         self.recalc_count = 0
         self.listen = tf.TransformListener()
-        self.br = tf.TransformBroadcaster()
+        self.box_sides = box_side_broadcaster(self.listen)
         self.client = actionlib.SimpleActionClient("move_base", MoveBaseAction)
         self.client.wait_for_server()
 
@@ -421,7 +398,7 @@ class ApproachPerpendicular(smach.State):
         self.box_marker_frame = "ar_marker_" + str(self.box_marker_id)
 
         odom_sub = rospy.Subscriber("odom", Odometry, self.odom_callback)
-        rospy.wait_for_message("odom", Odometry)
+        wait_for_message("odom", Odometry)
         ar_sub = rospy.Subscriber(
             "ar_pose_marker_mid", AlvarMarkers, self.ar_callback, queue_size=1
         )
@@ -452,7 +429,7 @@ class ApproachPerpendicular(smach.State):
     def ar_callback(self, msg):
         for marker in msg.markers:
             if marker.id == self.box_marker_id:
-                broadcast_box_sides(self.br, self.listen, "ar_marker_" + str(marker.id))
+                self.box_sides.update("ar_marker_" + str(marker.id))
                 self.recalc_count += 1
                 return
 
@@ -468,7 +445,7 @@ class PushPerpendicular(smach.State):
 
     def execute(self, userdata):
         odom_sub = rospy.Subscriber("odom", Odometry, self.odom_callback)
-        rospy.wait_for_message("odom", Odometry)
+        wait_for_message("odom", Odometry)
 
         twist = Twist()
         twist.linear.x = 0.3
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+import numpy as np
+import rospy
+import tf
+import tf2_ros
+from geometry_msgs.msg import TransformStamped
+from tf.transformations import quaternion_matrix
+
+
+class BoxSideBroadcaster(object):
+    """Publish frames for the middle and sides of the box from its AR marker.
+
+    All frames are worked out from a single marker lookup: the box middle is
+    one matrix product with the marker pose, and the sides are the middle
+    plus a fixed array of offsets in the global frame. They go out together
+    as one TFMessage with one stamp.
+
+    Nothing is published when the box middle has moved less than tolerance
+    metres since the last broadcast, apart from a refresh every refresh
+    seconds so the frames stay current for lookups.
+    """
+
+    def __init__(
+        self,
+        listen,
+        sides,
+        global_frame="map",
+        box_frame_prefix="box",
+        middle_offset_from_relative=(0, 0, -0.23),
+        relative_rotation=(0, 0, 1, 0),
+        tolerance=0.02,
+        refresh=1.0,
+    ):
+        """
+        :param listen: tf.TransformListener used for the marker lookup
+        :param sides: [(name, (x, y, z) offset from the middle, quaternion)]
+            with offsets and rotations in global_frame
+        """
+        self.listen = listen
+        self.global_frame = global_frame
+        self.middle_frame = box_frame_prefix + "_middle"
+        self.side_frames = ["%s_%s" % (box_frame_prefix, name) for name, _, _ in sides]
+        self.side_offsets = np.array([offset for _, offset, _ in sides], dtype=float)
+        self.side_rotations = [rotation for _, _, rotation in sides]
+        self.middle_offset = np.append(middle_offset_from_relative, 1.0)
+        self.relative_rotation = relative_rotation
+        self.tolerance = tolerance
+        self.refresh = rospy.Duration(refresh)
+        self.broadcaster = tf2_ros.TransformBroadcaster()
+
+        self.last_frame = None
+        self.last_middle = None
+        self.last_stamp = None
+
+    def side_positions(self, marker_trans, marker_rot):
+        """Return the box middle and an (N, 3) array of sides in global_frame."""
+        global_from_marker = quaternion_matrix(marker_rot)
+        global_from_marker[:3, 3] = marker_trans
+        middle = global_from_marker.dot(self.middle_offset)[:3]
+        return middle, middle + self.side_offsets
+
+    def update(self, relative_frame_name):
+        """Rebroadcast the box frames for a marker frame if the box has moved.
+
+        Returns True if a TFMessage was published.
+        """
+        try:
+            marker_trans, marker_rot = self.listen.lookupTransform(
+                self.global_frame, relative_frame_name, rospy.Time(0)
+            )
+        except (
+            tf.LookupException,
+            tf.ConnectivityException,
+            tf.ExtrapolationException,
+        ) as e:
+            print(e)
+            return False
+
+        middle, sides = self.side_positions(marker_trans, marker_rot)
+        stamp = rospy.Time.now()
+        if (
+            relative_frame_name == self.last_frame
+            and np.linalg.norm(middle - self.last_middle) < self.tolerance
+            and stamp - self.last_stamp < self.refresh
+        ):
+            return False
+
+        transforms = [
+            make_transform(
+                stamp,
+                relative_frame_name,
+                self.middle_frame,
+                self.middle_offset[:3],
+                self.relative_rotation,
+            )
+        ]
+        for frame, position, rotation in zip(
+            self.side_frames, sides, self.side_rotations
+        ):
+            transforms.append(
+                make_transform(stamp, self.global_frame, frame, position, rotation)
+            )
+        self.broadcaster.sendTransform(transforms)
+
+        self.last_frame = relative_frame_name
+        self.last_middle = middle
+        self.last_stamp = stamp
+        return True
+
+
+def make_transform(stamp, parent, child, translation, rotation):
+    transform = TransformStamped()
+    transform.header.stamp = stamp
+    transform.header.frame_id = parent
+    transform.child_frame_id = child
+    (
+        transform.transform.translation.x,
+        transform.transform.translation.y,
+        transform.transform.translation.z,
+    ) = [float(value) for value in translation]
+    (
+        transform.transform.rotation.x,
+        transform.transform.rotation.y,
+        transform.transform.rotation.z,
+        transform.transform.rotation.w,
+    ) = [float(value) for value in rotation]
+    return transform
@@ -14,7 +14,7 @@ from nav_msgs.msg import Odometry
 
 from ar_states import DriveToStart
 
-from utils import broadcast_box_sides
+from utils import box_side_broadcaster
 
 POSITIONS = [
     (Point(0, -0.5, -0.25), Quaternion(0, 0, 0.70710678, 0.70710678)),
@@ -36,7 +36,7 @@ class BoxApproach(smach.State):
         self.client.wait_for_server()
         self.counter = 0
         self.listen = tf.TransformListener()
-        self.br = tf.TransformBroadcaster()
+        self.box_sides = box_side_broadcaster(self.listen)
 
     def execute(self, userdata):
         self.box_marker_id = None
@@ -113,9 +113,7 @@ class BoxApproach(smach.State):
                 self.box_marker_id = marker.id
                 return
         else:
-            broadcast_box_sides(
-                self.br, self.listen, "ar_marker_" + str(self.box_marker.id)
-            )
+            self.box_sides.update("ar_marker_" + str(self.box_marker.id))
 
         return
 
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+import threading
+
+import rospy
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class TopicCache(object):
+    """Hold the latest message on a topic from one long-lived subscriber.
+
+    Waiting on the cache costs nothing but a condition variable, unlike
+    rospy.wait_for_message which sets up and tears down a subscriber (and its
+    connection) on every call.
+    """
+
+    def __init__(self, topic, msg_type):
+        self.topic = topic
+        self.msg_type = msg_type
+        self._condition = threading.Condition()
+        self._latest = None
+        self._count = 0
+        self.sub = rospy.Subscriber(topic, msg_type, self.callback, queue_size=1)
+
+    def callback(self, msg):
+        with self._condition:
+            self._latest = msg
+            self._count += 1
+            self._condition.notify_all()
+
+    def latest(self):
+        """Return the newest message without blocking, or None if none yet."""
+        return self._latest
+
+    def _wait(self, ready, timeout):
+        deadline = None if timeout is None else rospy.get_time() + timeout
+        with self._condition:
+            while not ready():
+                if rospy.is_shutdown():
+                    raise rospy.ROSInterruptException("rospy shutdown")
+                remaining = 0.1
+                if deadline is not None:
+                    remaining = min(remaining, deadline - rospy.get_time())
+                    if remaining <= 0:
+                        raise rospy.ROSException(
+                            "timeout exceeded while waiting for message on topic %s"
+                            % self.topic
+                        )
+                self._condition.wait(remaining)
+            return self._latest
+
+    def wait_for_next(self, timeout=None):
+        """Block until a message arrives after this call and return it."""
+        with self._condition:
+            count = self._count
+        return self._wait(lambda: self._count > count, timeout)
+
+    def wait_for_newer(self, stamp, timeout=None):
+        """Block until the latest message is stamped after stamp and return it.
+
+        Returns straight away if the cached message is already newer.
+        """
+        return self._wait(
+            lambda: self._latest is not None and self._latest.header.stamp > stamp,
+            timeout,
+        )
+
+
+def get_topic_cache(topic, msg_type):
+    """Return the process-wide cache for a topic, subscribing on first use."""
+    name = rospy.resolve_name(topic)
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TopicCache(topic, msg_type)
+        return _caches[name]
+
+
+def wait_for_message(topic, msg_type, timeout=None):
+    """Drop-in replacement for rospy.wait_for_message backed by a TopicCache."""
+    return get_topic_cache(topic, msg_type).wait_for_next(timeout)
+
+
+def latest_message(topic, msg_type):
+    """Return the newest message on topic, or None if nothing has arrived."""
+    return get_topic_cache(topic, msg_type).latest()
@@ -6,13 +6,23 @@ from ros_numpy import numpify
 from nav_msgs.msg import Odometry
 from tf.transformations import decompose_matrix
 import tf
+from box_geometry import BoxSideBroadcaster
+from topic_cache import wait_for_message
 
 
 g_prev_err = 0
 
+# Box frames as (side, offset from the box middle, rotation) in the odom frame
+BOX_SIDES = [
+    ("front", (-0.7, 0, 0.010), (0, 0, 0, 1)),
+    ("back", (0.7, 0, 0.010), (0, 0, 1, 0)),
+    ("right", (0, -0.7, 0.010), (0, 0, 0.70710678, 0.70710678)),
+    ("left", (0, 0.7, 0.010), (0, 0, -0.70710678, 0.70710678)),
+]
+
 
 def wait_for_odom_angle(timeout=None):
-    odom = rospy.wait_for_message("odom", Odometry, timeout=timeout)
+    odom = wait_for_message("odom", Odometry, timeout=timeout)
     return extract_angle(odom.pose.pose)
 
 
@@ -53,59 +63,9 @@ def simple_turn(angle, twist_pub, max_error=3, anglular_scale=1.0):
         theta = wait_for_odom_angle()
 
 
-def broadcast_box_sides(
-    br,
-    listen,
-    relative_frame_name,
-    box_frame_prefix="box",
-    side_offset_from_middle=0.7,
-    middle_offset_from_relative=(0, 0, -0.23),
-    relative_rotation=(0, 0, 1, 0),
-):
-    # Publish a frame to the middle, relative to some other frame
-    br.sendTransform(
-        middle_offset_from_relative,
-        relative_rotation,
-        rospy.Time.now(),
-        box_frame_prefix + "_middle",
-        relative_frame_name,
-    )
-
-    # Get the middle of the box relative to the global odom frame
-    rospy.sleep(0.1)
-    try:
-        box_trans, box_rot = listen.lookupTransform(
-            "odom", box_frame_prefix + "_middle", rospy.Time(0)
-        )
-
-        # Find the sides of the box
-        front_trans = map(sum, zip(box_trans, (-side_offset_from_middle, 0, 0.010)))
-        back_trans = map(sum, zip(box_trans, (side_offset_from_middle, 0, 0.010)))
-        left_trans = map(sum, zip(box_trans, (0, -side_offset_from_middle, 0.010)))
-        right_trans = map(sum, zip(box_trans, (0, side_offset_from_middle, 0.010)))
-
-        # Publish frames to the sides of the box relative to odom
-        br.sendTransform(
-            front_trans, (0, 0, 0, 1), rospy.Time.now(), "box_front", "odom"
-        )
-        br.sendTransform(back_trans, (0, 0, 1, 0), rospy.Time.now(), "box_back", "odom")
-        br.sendTransform(
-            left_trans,
-            (0, 0, 0.70710678, 0.70710678),
-            rospy.Time.now(),
-            "box_right",
-            "odom",
-        )
-        br.sendTransform(
-            right_trans,
-            (0, 0, -0.70710678, 0.70710678),
-            rospy.Time.now(),
-            "box_left",
-            "odom",
-        )
-        print("done")
-    except tf.ExtrapolationException as e:
-        pass
+def box_side_broadcaster(listen):
+    """Broadcaster for the box_middle and box side frames, relative to odom."""
+    return BoxSideBroadcaster(listen, BOX_SIDES, global_frame="odom")
 
 
 if __name__ == "__main__":
@@ -114,12 +74,11 @@ if __name__ == "__main__":
     MIDCAM_AR_TOPIC = "ar_pose_marker_mid"
     rospy.init_node("utils")
 
-    listen = tf.TransformListener()
-    br = tf.TransformBroadcaster()
+    box_sides = box_side_broadcaster(tf.TransformListener())
 
     def ar_callback(msg):
         for m in msg.markers:
-            broadcast_box_sides(br, listen, "ar_marker_" + str(m.id))
+            box_sides.update("ar_marker_" + str(m.id))
 
     ar_sub = rospy.Subscriber(MIDCAM_AR_TOPIC, AlvarMarkers, ar_callback, queue_size=1)
     rospy.spin()